@@ -1,30 +1,60 @@
-import os
 import uuid
-import shutil
 import base64
-import json
-import threading
+import asyncio
+import mimetypes
 import time
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Optional
 from pathlib import Path
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 
-from app.schemas import ProductInput, TaskStatus
-from app.services.pipeline import ProductImagePipeline
+from app.schemas import GenerateRequest
 from app.core.logging import logger, setup_logging
 from app.core.config import settings
+from app.core.static_files import CachedStaticFiles
+from app.services.job_queue import create_job_queue
+from app.services.metrics import registry as metrics_registry, CONTENT_TYPE as METRICS_CONTENT_TYPE, QUEUE_DEPTH, TASKS_IN_FLIGHT
+from app.services.scheduler import JobScheduler, QueueFullError, LANE_PIPELINE, LANE_WHITE_BG
+from app.services.task_store import FINISHED_STATUSES
+from app.services.task_events import TaskEventBus
+from app.services import tracing
+from app.services.task_runner import (
+    DATA_ROOT, DATA_OUTPUTS, PROCESS_ID, task_store, task_events, get_pipeline, execute_job, find_interrupted_tasks
+)
 
 # 初始化日志配置
 setup_logging()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    应用启动时构建流水线，并在后台预热到 LLM 与生图服务商的连接。
+    任务交由独立 Worker 进程执行时 (JOB_QUEUE_BACKEND 不为 local)，API 进程不构建流水线。
+    本进程执行任务且任务存储持久化时，重新提交上次服务退出时中断的任务。
+    """
+    warm_up_task = None
+    if job_queue is None:
+        pipeline = get_pipeline()
+        if settings.PROVIDER_STARTUP_WARMUP:
+            warm_up_task = asyncio.create_task(pipeline.warm_up())
+        if settings.RESUME_INTERRUPTED_TASKS and settings.TASK_STORE_BACKEND.lower() != "memory":
+            await resume_interrupted_tasks()
+    elif settings.TASK_STORE_BACKEND == "memory":
+        logger.warning("JOB_QUEUE_BACKEND is not 'local' but TASK_STORE_BACKEND is 'memory'; workers cannot report progress to this process")
+    yield
+    if warm_up_task and not warm_up_task.done():
+        warm_up_task.cancel()
+    await scheduler.stop()
+
 # 初始化 FastAPI 应用
 app = FastAPI(
     title="Visual Engine API",
     description="电商视觉生成后端服务，负责任务调度和 AI 流水线编排。",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # -----------------------------------------------------------------------------
@@ -43,143 +73,111 @@ app.add_middleware(
 # -----------------------------------------------------------------------------
 # 静态文件服务 (Static File Serving)
 # -----------------------------------------------------------------------------
-# 配置数据存储路径
-DATA_ROOT = Path("data")
-DATA_OUTPUTS = DATA_ROOT / "outputs"
-
-# 确保必要的目录存在
-DATA_ROOT.mkdir(parents=True, exist_ok=True)
-DATA_OUTPUTS.mkdir(parents=True, exist_ok=True)
-
-# 挂载静态目录以服务生成的图片
-app.mount("/outputs", StaticFiles(directory=DATA_OUTPUTS), name="outputs")
-app.mount("/data", StaticFiles(directory=DATA_ROOT), name="data")
+# 挂载静态目录以服务生成的图片 (基于内容哈希的强 ETag)
+# trace.jsonl、intermediates/ 与白底图等文件会被改写，仅 ?v=<hash> 与当前内容一致的 URL 才 immutable 缓存。
+app.mount("/outputs", CachedStaticFiles(directory=DATA_OUTPUTS), name="outputs")
+app.mount("/data", CachedStaticFiles(directory=DATA_ROOT), name="data")
 
 # -----------------------------------------------------------------------------
 # 全局状态与并发控制 (Global State & Concurrency Control)
 # -----------------------------------------------------------------------------
-# 用于同步写入文件级数据库 (products.json) 的锁
-db_lock = threading.Lock()
+# 任务调度器：有界队列 + 固定数量的 Worker，完整流水线与仅白底图任务分开排队。
+# JOB_QUEUE_BACKEND=local 时任务在本进程执行；为 sqlite / redis 时只入队，由 `python -m app.worker` 执行。
+scheduler = JobScheduler()
+job_queue = create_job_queue() if settings.JOB_QUEUE_BACKEND.lower() != "local" else None
 
-# 用于跟踪活跃任务状态的内存存储。
-# 注意：在多 Worker 的生产环境中，请替换为 Redis。
-tasks_db = {}
+def collect_queue_metrics() -> None:
+    """
+    抓取 /metrics 时刷新各通道的排队与执行中任务数 (持久化队列时为所有 Worker 的合计)。
+    """
+    for lane in (LANE_PIPELINE, LANE_WHITE_BG):
+        if job_queue is not None:
+            QUEUE_DEPTH.set(job_queue.size(lane), lane=lane)
+            TASKS_IN_FLIGHT.set(job_queue.running(lane), lane=lane)
+        else:
+            stats = scheduler.stats()[lane]
+            QUEUE_DEPTH.set(stats["queued"], lane=lane)
+            TASKS_IN_FLIGHT.set(stats["running"], lane=lane)
+
+metrics_registry.add_collector(collect_queue_metrics)
 
 # -----------------------------------------------------------------------------
 # 辅助函数 (Helper Functions)
 # -----------------------------------------------------------------------------
 
-def get_next_product_index() -> int:
+def resolve_image_url(url: str) -> Optional[Path]:
     """
-    通过读取 products.json 文件计算下一个可用的商品序号。
+    将 `get_image_url` 生成的 URL 反向解析为服务器上的文件路径。
     
     Returns:
-        int: 下一个可用的自增序号。如果文件为空或不存在，默认为 1。
+        Optional[Path]: 文件路径，无法解析时返回 None。
     """
-    with db_lock:
-        json_path = settings.full_products_json_path
-        if not json_path.exists():
-            return 1
-        
-        try:
-            with open(json_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if not data:
-                    return 1
-                # 过滤掉类似时间戳的异常序号（例如 > 1,000,000）以保持序列连续
-                indices = [
-                    item.get('index', 0) 
-                    for item in data 
-                    if isinstance(item.get('index'), int) and item.get('index', 0) < 1000000
-                ]
-                return max(indices) + 1 if indices else 1
-        except Exception as e:
-            logger.error(f"Error reading products.json: {e}")
-            return 1
+    path = url.split("?", 1)[0]
+    if path.startswith("/outputs/"):
+        return DATA_OUTPUTS / path[len("/outputs/"):]
+    if path.startswith("/data/"):
+        return DATA_ROOT / path[len("/data/"):]
+    candidate = Path(path)
+    return candidate if candidate.is_absolute() else None
 
-def save_product_to_json(product_data: dict) -> None:
+def encode_image_base64(url: str) -> str:
     """
-    线程安全地保存或更新商品数据到 products.json。
-    
-    Args:
-        product_data (dict): 要保存的商品信息字典。
+    读取 URL 对应的图片并编码为 data URI，失败时返回空字符串。
     """
-    with db_lock:
-        json_path = settings.full_products_json_path
-        data = []
-        if json_path.exists():
-            try:
-                with open(json_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-            except Exception as e:
-                logger.error(f"Error loading products.json: {e}")
-        
-        # 检查序号是否存在，以进行更新而不是追加
-        existing_idx = -1
-        for i, item in enumerate(data):
-            if item.get('index') == product_data['index']:
-                existing_idx = i
-                break
-        
-        if existing_idx >= 0:
-            data[existing_idx] = product_data
-        else:
-            data.append(product_data)
-        
-        try:
-            with open(json_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            logger.error(f"Error saving products.json: {e}")
+    image_path = resolve_image_url(url)
+    try:
+        if image_path and image_path.exists():
+            mime_type = mimetypes.guess_type(image_path.name)[0] or "image/png"
+            with open(image_path, "rb") as f:
+                return f"data:{mime_type};base64,{base64.b64encode(f.read()).decode()}"
+    except Exception as e:
+        logger.error(f"Error encoding image {url} to base64: {e}")
+    return ""
 
-def update_task_progress(task_id: str, phrases: List[str] = None, new_image_url: str = None, new_image_base64: str = None, status: str = None):
+async def submit_task(task_id: str, request: GenerateRequest) -> int:
     """
-    线程安全地更新内存中的任务状态，供前端轮询。
+    将任务提交到本进程调度器或持久化任务队列 (仅白底图任务使用独立通道)。
     
-    Args:
-        task_id (str): 任务的唯一标识符。
-        phrases (List[str], optional): 生成的提示词列表。
-        new_image_url (str, optional): 新生成图片的 URL。
-        new_image_base64 (str, optional): 新生成图片的 Base64 字符串。
-        status (str, optional): 新的状态字符串 (例如 'processing', 'completed', 'failed')。
+    Returns:
+        int: 排队位置
+    
+    Raises:
+        HTTPException: 队列已满时返回 429 与 Retry-After，任务被标记为失败。
     """
-    with db_lock:
-        if task_id not in tasks_db:
-            return
-        
-        if phrases is not None:
-            tasks_db[task_id]["phrases"] = phrases
-            
-        if new_image_url is not None:
-            tasks_db[task_id]["images"].append(new_image_url)
-            
-        if new_image_base64 is not None:
-            tasks_db[task_id]["images_base64"].append(new_image_base64)
-            
-        if status is not None:
-            tasks_db[task_id]["status"] = status
+    queued_at = time.time()
+    lane = LANE_WHITE_BG if request.white_bg_only else LANE_PIPELINE
+    try:
+        if job_queue is not None:
+            return await asyncio.to_thread(job_queue.enqueue, task_id, lane, request.model_dump())
+        return await scheduler.submit(task_id, lane, lambda: execute_job(task_id, request, queued_at))
+    except QueueFullError as e:
+        await task_store.aupdate(task_id, status="failed", error="Rejected: job queue is full")
+        logger.warning(f"Rejecting task: {e}")
+        raise HTTPException(
+            status_code=429,
+            detail="Too many tasks in queue, please retry later",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+async def resume_interrupted_tasks() -> None:
+    """
+    重新提交因服务重启而中断的任务 (owner 进程已退出)。
+    通过条件更新认领任务，多个 API 进程同时启动时每个任务只会被一个进程恢复。
+    """
+    for task in await asyncio.to_thread(find_interrupted_tasks):
+        task_id = task["task_id"]
+        if not await task_store.aupdate(task_id, expect={"owner": task.get("owner")}, owner=PROCESS_ID, status="pending"):
+            continue
+        try:
+            await submit_task(task_id, GenerateRequest(**task["request"]))
+            logger.info(f"Resumed interrupted task {task_id} (previous owner: {task.get('owner')})")
+        except HTTPException:
+            logger.warning(f"Could not resume interrupted task {task_id}: job queue is full")
 
 # -----------------------------------------------------------------------------
 # 数据模型 (Data Models)
 # -----------------------------------------------------------------------------
 
-class GenerateRequest(BaseModel):
-    """
-    /api/generate 端点的请求模型。
-    """
-    name: str
-    detail: str
-    attributes: Optional[str] = ""      # 商品属性/规格
-    image_base64: Optional[str] = None  # Base64 编码的源图
-    image_url: Optional[str] = None     # 源图 URL (Fallback)
-    image_path: Optional[str] = None    # 服务端相对路径 (例如 /outputs/xxx.png)
-    product_index: Optional[int] = None # 如果提供，复用现有的商品序号
-    gallery_images: List[str] = []      # 需要下载的橱窗图 URL 列表
-    detail_images: List[str] = []       # 需要下载的详情图 URL 列表
-    need_white_bg: bool = False         # 是否触发去底步骤
-    save_to_data: bool = True           # 是否将数据持久化到磁盘结构
-    white_bg_only: bool = False         # 如果为 True，则在去底后停止
-
 class GenerateResponse(BaseModel):
     """
     任务创建的响应模型。
@@ -192,263 +190,208 @@ class GenerateResponse(BaseModel):
 # -----------------------------------------------------------------------------
 
 @app.post("/api/generate", response_model=GenerateResponse)
-async def generate_scene(request: GenerateRequest, background_tasks: BackgroundTasks):
+async def generate_scene(request: GenerateRequest):
     """
     发起场景生成任务。
     
-    此端点是非阻塞的。它初始化任务上下文并将繁重的工作卸载到后台任务。
+    此端点是非阻塞的。它初始化任务上下文并将任务提交到调度器排队执行。
+    队列已满时返回 429，并通过 Retry-After 头提示客户端稍后重试。
     """
     task_id = str(uuid.uuid4())
     
-    # 1. 为此任务创建一个临时目录
-    task_dir = Path(f"data/temp/{task_id}")
-    task_dir.mkdir(parents=True, exist_ok=True)
-    
-    # 2. 在内存中初始化任务状态
-    tasks_db[task_id] = {
-        "status": "processing",
+    # 1. 在任务存储中初始化任务状态 (需先于入队，独立 Worker 可能立即领取任务)
+    await task_store.acreate(task_id, {
+        "status": "pending",
         "phrases": [],         # 存储生成的场景描述
-        "images": [],          # 存储生成图片的 URL
-        "images_base64": [],   # 存储用于即时预览的 Base64 数据
-        "error": None
-    }
+        "images": [],          # 存储生成图片的 URL (只追加，按完成顺序排列，供 since 游标增量读取)
+        "error": None,
+        "product_index": request.product_index,
+        # 执行任务的进程 (本进程调度时为当前进程，由 Worker 执行时在领取后写入)
+        "owner": PROCESS_ID if job_queue is None else None,
+        # 用于恢复任务的请求 (不含 Base64，源图片落盘后改为服务端路径)
+        "request": request.model_dump(exclude={"image_base64"})
+    })
+    
+    # 2. 入队 (仅白底图任务使用独立通道)
+    position = await submit_task(task_id, request)
     
-    # 3. 在后台调度流水线执行
-    background_tasks.add_task(run_pipeline_task, task_id, request)
+    # 任务由独立 Worker 执行时事件发布在 Worker 进程中，本进程不建立频道，SSE 通过轮询任务存储推送
+    if job_queue is None:
+        task_events.publish(task_id, "created", status="pending", queue_position=position)
     
-    return GenerateResponse(task_id=task_id, status="processing")
+    return GenerateResponse(task_id=task_id, status="pending")
 
 @app.get("/api/task/{task_id}")
-async def get_task_status(task_id: str):
+async def get_task_status(task_id: str, since: int = 0, include_base64: bool = False):
     """
     获取特定任务的当前状态和结果。
     前端用于轮询进度。
+    
+    Args:
+        since (int): 增量游标，只返回第 since 张之后的图片 URL；传入上次响应中的 `cursor` 即可。
+        include_base64 (bool): 是否附带图片的 Base64 数据 (`images_base64` / `white_bg_base64`)。
+                               默认不返回，请优先通过图片 URL 加载 (支持 ETag 与长缓存)。
     """
-    if task_id not in tasks_db:
+    task = await task_store.aget(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
-    return tasks_db[task_id]
+    task.pop("request", None)
+    
+    # 排队中的任务附带排队位置、已等待时间 (本进程调度时还有预计开始时间)
+    if task.get("status") == "pending":
+        if job_queue is not None:
+            task.update(await asyncio.to_thread(job_queue.position, task_id) or {})
+        else:
+            task.update(scheduler.queue_info(task_id) or {})
+    
+    images = task.get("images", [])
+    new_images = images[max(since, 0):]
+    task["images"] = new_images
+    task["cursor"] = len(images)
+    
+    if include_base64:
+        task["images_base64"] = await asyncio.to_thread(lambda: [encode_image_base64(url) for url in new_images])
+        if task.get("white_bg_url"):
+            task["white_bg_base64"] = await asyncio.to_thread(encode_image_base64, task["white_bg_url"])
+    return task
 
-# -----------------------------------------------------------------------------
-# 后台任务逻辑 (Background Task Logic)
-# -----------------------------------------------------------------------------
+@app.post("/api/task/{task_id}/resume", response_model=GenerateResponse)
+async def resume_task(task_id: str):
+    """
+    恢复失败或中断的任务。
+    
+    任务重新排队执行，流水线沿用原输出目录：已保存的中间结果 (intermediates/) 与已生成的场景图直接复用，
+    只执行缺失的部分。进行中的任务返回 409。
+    """
+    task = await task_store.aget(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task.get("status") not in FINISHED_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Task is {task.get('status')}, only finished tasks can be resumed")
+    if not task.get("request"):
+        raise HTTPException(status_code=409, detail="Task has no saved request and cannot be resumed")
+    
+    request = GenerateRequest(**task["request"])
+    if not await task_store.aupdate(
+        task_id, expect={"status": task["status"]},
+        status="pending", error=None, owner=PROCESS_ID if job_queue is None else None
+    ):
+        raise HTTPException(status_code=409, detail="Task is already being resumed")
+    if job_queue is None:
+        task_events.reopen(task_id)
+    position = await submit_task(task_id, request)
+    if job_queue is None:
+        task_events.publish(task_id, "created", status="pending", queue_position=position, resumed=True)
+    
+    return GenerateResponse(task_id=task_id, status="pending")
 
-async def run_pipeline_task(task_id: str, request: GenerateRequest):
+@app.get("/api/task/{task_id}/events")
+async def stream_task_events(task_id: str, request: Request):
     """
-    执行核心 AI 生成流水线。
+    以 Server-Sent Events 推送任务进度。
     
-    步骤:
-    1. 确定存储路径并下载资源 (橱窗/详情图)。
-    2. 解析源图片 (来自 Path, Base64 或 URL)。
-    3. 初始化 ProductImagePipeline。
-    4. 执行流水线 (仅去底 或 全流程生成)。
-    5. 完成或失败时更新任务状态。
+    事件类型:
+    - stage: 阶段状态变化 (white_bg / summarize / refine / phrase / image 的 started/completed/failed)
+    - image: 单张图片生成完成，携带图片 URL (不含 Base64)
+    - completed / failed: 任务结束，随后关闭事件流
+    
+    任务在本进程执行时直接订阅事件总线；任务由独立 Worker 执行 (JOB_QUEUE_BACKEND 不为 local) 或频道已不存在 (如服务重启前的任务) 时
+    退化为轮询任务存储。
     """
+    task = await task_store.aget(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
     try:
-        pipeline = ProductImagePipeline()
-        index = request.product_index
-        
-        # --- 步骤 1: 确定存储路径 & 下载资源 ---
-        if request.save_to_data:
-            if index is None:
-                index = get_next_product_index()
-            
-            target_dir = settings.DATA_ROOT / str(index)
-            target_dir.mkdir(parents=True, exist_ok=True)
-            img_path = target_dir / "main.jpg"
-            
-            # 辅助函数: 下载图片到指定目录
-            import requests
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Referer': 'https://www.1688.com/'
-            }
-            def download_to_dir(urls, directory, prefix):
-                saved_paths = []
-                if not urls: return saved_paths
-                directory.mkdir(exist_ok=True)
-                for i, url in enumerate(urls):
-                    try:
-                        full_url = url if url.startswith('http') else ('https:' + url if url.startswith('//') else url)
-                        if not full_url.startswith('http'): continue
-                        resp = requests.get(full_url, headers=headers, timeout=15)
-                        if resp.status_code == 200:
-                            file_ext = ".jpg"
-                            if "png" in resp.headers.get("Content-Type", "").lower(): file_ext = ".png"
-                            save_path = directory / f"{prefix}_{i}{file_ext}"
-                            with open(save_path, "wb") as f:
-                                f.write(resp.content)
-                            saved_paths.append(str(save_path.relative_to(settings.DATA_ROOT)))
-                    except Exception as e:
-                        logger.error(f"Failed to download image {url}: {e}")
-                return saved_paths
-
-            # 保存橱窗图和详情图
-            saved_sub_images = download_to_dir(request.gallery_images, target_dir / "sub_images", "gallery")
-            saved_detail_images = download_to_dir(request.detail_images, target_dir / "detail", "detail")
-
-            # 持久化商品信息到 JSON
-            product_info = {
-                "index": index,
-                "name": request.name,
-                "detail": request.detail,
-                "attributes": request.attributes,
-                "image": str(img_path.relative_to(settings.DATA_ROOT)),
-                "sub_images": saved_sub_images,
-                "detail_images": saved_detail_images,
-                "task_id": task_id
-            }
-            save_product_to_json(product_info)
-            # 更新任务状态中的商品序号
-            tasks_db[task_id]["product_index"] = index
-        else:
-            # 如果不保存到数据根目录，则使用临时目录
-            task_dir = Path(f"data/temp/{task_id}")
-            task_dir.mkdir(parents=True, exist_ok=True)
-            img_path = task_dir / "main.jpg"
-
-        # --- 步骤 2: 解析源图片 ---
-        active_image_path = img_path
-        if request.image_path:
-            # 情况 A: 图片已存在于服务器上 (例如来自上一步的白底图)
-            rel_path = request.image_path.lstrip('/')
-            src_path = None
-            if rel_path.startswith('outputs/'):
-                src_path = DATA_OUTPUTS / rel_path[8:]
-            elif rel_path.startswith('data/'):
-                src_path = DATA_ROOT / rel_path[5:]
-            
-            if src_path and src_path.exists():
-                active_image_path = src_path
-                logger.info(f"Using provided image source: {active_image_path}")
-            else:
-                raise Exception(f"Image path not found or invalid format: {request.image_path}")
-        elif request.image_base64:
-            # 情况 B: 提供了 Base64 数据
-            header, data = request.image_base64.split(',', 1) if ',' in request.image_base64 else (None, request.image_base64)
-            with open(img_path, "wb") as f:
-                f.write(base64.b64decode(data))
-        elif request.image_url:
-            # 情况 C: 从 URL 下载
-            import requests
-            response = requests.get(request.image_url, timeout=10)
-            with open(img_path, "wb") as f:
-                f.write(response.content)
-        else:
-            raise Exception("No image provided (base64, URL or path)")
+        last_event_id = int(request.headers.get("last-event-id", 0))
+    except ValueError:
+        last_event_id = 0
+    
+    if job_queue is None and task_events.has_channel(task_id):
+        events = task_events.subscribe(task_id, last_event_id=last_event_id)
+    else:
+        events = poll_task_events(task_id)
+    
+    async def event_stream():
+        async for message in events:
+            if await request.is_disconnected():
+                break
+            yield message
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-        # --- 步骤 3: 准备流水线输入 ---
-        product = ProductInput(
-            name=request.name,
-            detail=request.detail,
-            attributes=request.attributes,
-            sample_dir=str(img_path.parent.relative_to(DATA_ROOT)), 
-            image=active_image_path.relative_to(DATA_ROOT) if active_image_path.is_absolute() else active_image_path
-        )
+async def poll_task_events(task_id: str):
+    """
+    通过轮询任务存储生成 SSE 事件，用于任务不在本进程执行的情况。
+    """
+    event_id = 0
+    last_stage = None
+    sent_images = 0
+    while True:
+        task = await task_store.aget(task_id)
+        if task is None:
+            return
+        
+        stage = (task.get("stage"), task.get("stage_state"))
+        if stage[0] and stage != last_stage:
+            last_stage = stage
+            event_id += 1
+            yield TaskEventBus.format_event(event_id, "stage", {"task_id": task_id, "stage": stage[0], "state": stage[1]})
+        
+        for url in task.get("images", [])[sent_images:]:
+            sent_images += 1
+            event_id += 1
+            yield TaskEventBus.format_event(event_id, "image", {"task_id": task_id, "url": url})
+        
+        if task.get("status") in FINISHED_STATUSES:
+            event_id += 1
+            yield TaskEventBus.format_event(event_id, task["status"], {
+                "task_id": task_id,
+                "status": task["status"],
+                "images": task.get("images", []),
+                "phrases": task.get("phrases", []),
+                "product_index": task.get("product_index"),
+                "error": task.get("error")
+            })
+            return
         
-        # --- 步骤 4: 执行流水线 ---
-        if request.white_bg_only:
-            # 子流程: 仅生成白底图
-            white_bg_path = await pipeline.run_white_bg_only(product)
-            white_bg_path_abs = Path(white_bg_path).resolve()
-            
-            # 保存到永久位置
-            product_index = request.product_index if request.product_index is not None else get_next_product_index()
-            task_dir = DATA_ROOT / str(product_index)
-            task_dir.mkdir(parents=True, exist_ok=True)
-            
-            output_white_bg = task_dir / "white_bg_main.jpg"
-            white_bg_path_p = Path(white_bg_path).resolve()
-            output_white_bg_p = output_white_bg.resolve()
-            
-            # 避免自我覆盖
-            if white_bg_path_p == output_white_bg_p:
-                logger.info(f"New white bg is already at target: {output_white_bg_p}")
-            else:
-                if output_white_bg_p.exists():
-                    output_white_bg_p.unlink()
-                shutil.copy(white_bg_path, output_white_bg)
-            
-            output_white_bg_abs = output_white_bg.resolve()
-            
-            # 生成返回 URL
-            try:
-                rel_path = output_white_bg_abs.relative_to(DATA_ROOT.resolve())
-                url = f"/data/{rel_path.as_posix()}"
-            except ValueError:
-                url = str(output_white_bg_abs)
-            
-            # 编码 Base64
-            white_bg_base64 = ""
-            try:
-                if output_white_bg_abs.exists():
-                    with open(output_white_bg_abs, "rb") as f:
-                        white_bg_base64 = f"data:image/png;base64,{base64.b64encode(f.read()).decode()}"
-            except Exception as e:
-                logger.error(f"Error encoding white_bg to base64: {e}")
+        await asyncio.sleep(settings.SSE_POLL_INTERVAL_SECONDS)
 
-            # 更新任务状态
-            with db_lock:
-                tasks_db[task_id]["images"] = [url]
-                tasks_db[task_id]["images_base64"] = [white_bg_base64]
-                tasks_db[task_id]["white_bg_base64"] = white_bg_base64
-                tasks_db[task_id]["status"] = "completed"
-                tasks_db[task_id]["product_index"] = product_index
-        else:
-            # 子流程: 全流程生成
-            result_task = await pipeline.run(
-                product, 
-                need_white_bg=request.need_white_bg
-            )
-            
-            if result_task.status == TaskStatus.COMPLETED:
-                # 任务完成，提取生成的提示词并更新状态
-                final_phrases = []
-                if result_task.phrase_result and result_task.phrase_result.phrases:
-                    final_phrases = [p.scene_description for p in result_task.phrase_result.phrases]
-                
-                # 提取生成的所有图片
-                final_images = []
-                final_images_base64 = []
-                
-                if result_task.image_result and result_task.image_result.images:
-                    for img_obj in result_task.image_result.images:
-                        img_path_abs = Path(img_obj.image_path).resolve()
-                        
-                        # 解析图片 URL
-                        try:
-                            rel_path = img_path_abs.relative_to(DATA_OUTPUTS.resolve())
-                            url = f"/outputs/{rel_path.as_posix()}"
-                        except ValueError:
-                            try:
-                                rel_path = img_path_abs.relative_to(DATA_ROOT.resolve())
-                                url = f"/data/{rel_path.as_posix()}"
-                            except ValueError:
-                                url = str(img_path_abs)
-                        final_images.append(url)
-                        
-                        # 编码 Base64
-                        try:
-                            if img_path_abs.exists():
-                                with open(img_path_abs, "rb") as f:
-                                    base64_data = f"data:image/png;base64,{base64.b64encode(f.read()).decode()}"
-                                    final_images_base64.append(base64_data)
-                        except Exception as e:
-                            logger.error(f"Error encoding final image: {e}")
+@app.get("/api/task/{task_id}/trace")
+async def get_task_trace(task_id: str):
+    """
+    获取任务的执行链路：run_pipeline_task 根 Span 及其下的阶段、LLM 调用、生图请求与下载 Span (按开始时间排序)。
+    
+    已导出的链路读取自任务输出目录下的 TRACE_FILENAME (仅去底任务为 DATA_ROOT/TRACE_DIR/<task_id>.jsonl)；
+    任务正在本进程执行时追加实时链路，未结束的 Span 状态为 running。恢复执行过的任务包含多条链路，以 trace_id 区分。
+    """
+    task = await task_store.aget(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    candidates = [Path(task["output_dir"]) / settings.TRACE_FILENAME] if task.get("output_dir") else []
+    candidates.append(tracing.task_trace_fallback_path(task_id))
+    path = next((p for p in candidates if p.is_file()), None)
+    spans = await asyncio.to_thread(tracing.read_trace, path) if path else []
+    active = tracing.get_active_trace(task_id)
+    if active is not None:
+        spans.extend(active.records())
+    if not spans:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    spans.sort(key=lambda span: span["start"])
+    return {"task_id": task_id, "status": task.get("status"), "spans": spans}
 
-                # 一次性更新所有结果
-                with db_lock:
-                    tasks_db[task_id]["phrases"] = final_phrases
-                    tasks_db[task_id]["images"] = final_images
-                    tasks_db[task_id]["images_base64"] = final_images_base64
-                    tasks_db[task_id]["status"] = "completed"
-            else:
-                update_task_progress(task_id, status="failed")
-                tasks_db[task_id]["error"] = result_task.error
-            
-    except Exception as e:
-        logger.error(f"Error in background task {task_id}: {str(e)}")
-        tasks_db[task_id]["status"] = "failed"
-        tasks_db[task_id]["error"] = str(e)
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus 指标：阶段耗时、生图服务商与 LLM 请求耗时/结果、Token 用量、队列长度、执行中任务数与下载字节数。
+    任务由独立 Worker 执行时，阶段与服务商指标由各 Worker 的 --metrics-port 提供。
+    """
+    return Response(await asyncio.to_thread(metrics_registry.render), media_type=METRICS_CONTENT_TYPE)
 
 if __name__ == "__main__":
     import uvicorn
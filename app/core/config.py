@@ -8,7 +8,7 @@ class Settings(BaseSettings):
     GEMINI_API_KEY: str
 
     # 图像生成配置
-    IMAGE_PROVIDER: str = "gemini"  # gemini, 147api, grsai, deerapi
+    IMAGE_PROVIDER: str = "gemini"  # gemini, 147api, grsai, deerapi；逗号分隔时为按顺序故障转移的链，如 grsai,deerapi,gemini；auto 时按实时表现路由
     
     # 分项生图配置 (可选，如果不设置则回退到 IMAGE_PROVIDER)
     WHITE_BG_PROVIDER: Optional[str] = None
@@ -20,30 +20,162 @@ class Settings(BaseSettings):
     GRSAI_API_KEY: Optional[str] = None
     GRSAI_BASE_URL: str = "https://grsai.dakka.com.cn"
     GRSAI_MODEL: str = "nano-banana-fast"  # 可选: nano-banana-fast, nano-banana-pro 等
+    GRSAI_TIMEOUT: float = 90.0
     
     # 147api 配置
     API147_API_KEY: Optional[str] = None
     API147_BASE_URL: str = "https://api.147api.com"
     API147_MODEL: str = "gemini-2.5-flash-image" # 可选: gemini-2.5-flash-image
+    API147_TIMEOUT: float = 90.0
     
     # DeerAPI 配置
     DEERAPI_API_KEY: Optional[str] = None
     DEERAPI_BASE_URL: str = "https://api.deerapi.com"
     DEERAPI_MODEL: str = "gemini-2.5-flash-image" # 可选: gemini-3-pro-image, gemini-2.5-flash-image
+    DEERAPI_TIMEOUT: float = 120.0
 
     # 官方 Gemini 配置
     GEMINI_MODEL: str = "gemini-2.5-flash-image"
-    
+    GEMINI_EXECUTOR_WORKERS: int = 4  # 官方 SDK 为同步调用，放在独立线程池中执行
+
+    # 生图服务商 HTTP 连接池配置 (所有 HTTP 类服务商共享)
+    PROVIDER_HTTP2: bool = True                   # 安装了 h2 时启用 HTTP/2
+    PROVIDER_MAX_CONNECTIONS: int = 50            # 连接池总连接数上限
+    PROVIDER_MAX_CONNECTIONS_PER_HOST: int = 10   # 单个服务商域名的并发连接上限
+    PROVIDER_KEEPALIVE_EXPIRY: float = 60.0       # 空闲 keep-alive 连接保留时长 (秒)
+    PROVIDER_CONNECT_TIMEOUT: float = 10.0        # 建立连接超时 (秒)
+    PROVIDER_DEFAULT_TIMEOUT: float = 120.0       # 未单独配置时的请求超时 (秒)
+    PROVIDER_STARTUP_WARMUP: bool = True          # 应用启动时预先建立到 LLM 与生图服务商的连接
+
+    # 故障转移链的熔断配置 (按服务商统计，IMAGE_PROVIDER 等配置为逗号分隔的链时生效)
+    PROVIDER_BREAKER_WINDOW_SECONDS: float = 120.0   # 统计失败率与慢调用的滚动窗口 (秒)
+    PROVIDER_BREAKER_MIN_CALLS: int = 5              # 窗口内调用数达到该值才判断是否熔断
+    PROVIDER_BREAKER_ERROR_RATE: float = 0.5         # 失败率 (返回失败或抛出异常) 阈值
+    PROVIDER_BREAKER_SLOW_CALL_SECONDS: float = 60.0 # 超过该耗时的调用计为慢调用
+    PROVIDER_BREAKER_SLOW_CALL_RATE: float = 0.8     # 慢调用比例阈值
+    PROVIDER_BREAKER_OPEN_SECONDS: float = 30.0      # 熔断后经过多久进入半开状态
+    PROVIDER_BREAKER_HALF_OPEN_PROBES: int = 1       # 半开状态放行的探测请求数，全部成功后恢复
+
+    # 自适应限流 (令牌桶 + AIMD)，每个生图服务商、每个 LLM 模型各一个限流器，收到 429 时自动降速并重试
+    RATE_LIMIT_ENABLED: bool = False              # 默认关闭：不排队，也不重试 429，LLM 请求使用 SDK 自带的重试；开启后 SDK 重试由限流器接管
+    PROVIDER_RATE_LIMIT: float = 2.0              # 每个生图服务商的请求速率上限 (次/秒)
+    PROVIDER_RATE_LIMIT_CONFIG: str = ""          # 按服务商覆盖速率上限，格式为 "provider1:rate1,provider2:rate2"
+    LLM_RATE_LIMIT: float = 5.0                   # 每个 LLM 模型的请求速率上限 (次/秒)
+    LLM_RATE_LIMIT_CONFIG: str = ""               # 按模型覆盖速率上限，格式为 "model1:rate1,model2:rate2"
+    RATE_LIMIT_BURST: int = 5                     # 令牌桶容量 (允许的突发请求数)
+    RATE_LIMIT_MIN_RATE: float = 0.05             # 收到 429 后速率下调的下限 (次/秒)
+    RATE_LIMIT_DECREASE_FACTOR: float = 0.5       # 收到 429 时速率乘以该系数
+    RATE_LIMIT_INCREASE_STEP: float = 0.05        # 每次成功请求后速率的回升步长 (次/秒)
+    RATE_LIMIT_MAX_RETRIES: int = 4               # 429 (LLM 还包括连接错误与 5xx，不含超时) 的最大重试次数
+    RATE_LIMIT_BACKOFF_BASE: float = 1.0          # 指数退避基数 (秒)，第 n 次重试前随机等待 0 ~ base*2^n
+    RATE_LIMIT_BACKOFF_MAX: float = 60.0          # 单次退避与 Retry-After 暂停的上限 (秒)
+
+    # 参考图 (商品主图) 预处理配置，每个任务只编码一次并在各次生图调用间复用
+    REFERENCE_IMAGE_MAX_SIDE: int = 2048          # 长边上限 (像素)，超过时等比缩放
+    REFERENCE_IMAGE_FORMAT: str = "PNG"           # 上传给服务商的编码格式: PNG, JPEG, WEBP
+    REFERENCE_IMAGE_QUALITY: int = 92             # JPEG / WEBP 编码质量
+
+    # 场景图并发配置
+    # 每个服务商同时进行的生图请求数，设为 1 即退化为逐张顺序生成
+    IMAGE_GEN_CONCURRENCY: int = 3
+    # 按服务商覆盖并发数，格式为 "provider1:count1,provider2:count2"
+    IMAGE_GEN_CONCURRENCY_CONFIG: str = ""
+
+    # 场景图对冲请求 (Hedged Requests) 配置
+    IMAGE_HEDGING: bool = False                   # 请求耗时超过服务商观测分位数仍未完成时，向对冲服务商发送重复请求
+    IMAGE_HEDGE_PROVIDER: Optional[str] = None    # 对冲请求的服务商，须与场景图服务商不同；未设置或相同时不对冲
+    IMAGE_HEDGE_QUANTILE: float = 0.9             # 触发对冲的耗时分位数
+    IMAGE_HEDGE_MIN_SAMPLES: int = 20             # 成功样本少于该值时不对冲
+    IMAGE_HEDGE_BUDGET: float = 0.1               # 窗口内对冲请求占全部场景图请求的比例上限
+    IMAGE_HEDGE_BUDGET_WINDOW_SECONDS: float = 600.0  # 统计对冲比例的滚动窗口 (秒)
+    PROVIDER_LATENCY_WINDOW: int = 200            # 每个服务商保留的最近成功耗时样本数
+    PROVIDER_EWMA_ALPHA: float = 0.2              # 服务商耗时与成功率 EWMA 的平滑系数，越大越偏重最近的请求
+
+    # 按实时表现路由 (IMAGE_PROVIDER / SCENE_GEN_PROVIDER / WHITE_BG_PROVIDER 为 auto 时生效)
+    IMAGE_ROUTER_PROVIDERS: str = "grsai,147api,deerapi"  # 参与路由的服务商，各自使用默认模型
+    IMAGE_ROUTER_LATENCY_WEIGHT: float = 1.0      # 评分中耗时项 (EWMA 耗时 / 最快服务商的 EWMA 耗时) 的权重
+    IMAGE_ROUTER_FAILURE_WEIGHT: float = 2.0      # 评分中失败率项 (1 - EWMA 成功率) 的权重
+    IMAGE_ROUTER_MIN_SAMPLES: int = 3             # 观测数少于该值的服务商优先分配请求以积累样本
+    IMAGE_ROUTER_EXPLORE_RATE: float = 0.05       # 随机把非最优服务商排在最前的概率，使其统计保持更新
+
+    # LLM (Qwen / DashScope 兼容模式) 配置
+    QWEN_BASE_URL: str = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+    LLM_TIMEOUT: float = 120.0        # 单次 LLM 请求超时 (秒)
+    LLM_MAX_CONNECTIONS: int = 20     # 共享异步客户端的最大连接数
+
+    # 场景优化配置
+    # 将 "优化已有场景" 与 "扩展新场景" 拆分为两个并发的 LLM 请求，耗时由两者之和变为两者中的较大值
+    REFINER_PARALLEL: bool = False
+
     # 提示词生成配置
     PHRASE_PROMPT_TYPE: str = "text"
     PHRASE_PROMPT_VERSION: str = "v1"
     # 场景来源配置，格式为 "source1:count1,source2:count2"
     PHRASE_SCENE_SOURCE_CONFIG: str = "optimized:3,new:2"
+    # 流式接收提示词 (增量解析 Function Calling 参数)，每个场景解析完成即开始生图，与 LLM 生成后续场景重叠执行
+    PHRASE_STREAMING: bool = False
+    # 生成方式: "batch" 一次请求生成全部场景; "per_scene" 每个场景单独发起请求并发执行
+    PHRASE_MODE: str = "batch"
+    PHRASE_PER_SCENE_CONCURRENCY: int = 5    # per_scene 模式下同时进行的请求数
+    # 融合模式: 一次 Function Calling 请求直接从视觉分析结果生成场景与提示词，替代 Step 2 + Step 3 两次串行请求
+    REFINE_PHRASE_FUSED: bool = False
+
+    # 商品素材 (橱窗图 / 详情图) 下载配置
+    ASSET_DOWNLOAD_CONCURRENCY: int = 16      # 同时进行的下载数
+    ASSET_DOWNLOAD_PER_HOST: int = 6          # 单个域名的并发下载数
+    ASSET_DOWNLOAD_TIMEOUT: float = 15.0      # 单次请求超时 (秒)
+    ASSET_DOWNLOAD_RETRIES: int = 3           # 网络错误 / 429 / 5xx 的重试次数
+    ASSET_DOWNLOAD_BACKOFF: float = 0.5       # 首次重试的退避基数 (秒)，之后按指数增长并加抖动
+
+    # 内容寻址素材库配置 (按 SHA-256 跨商品去重，商品目录中为硬链接)
+    ASSET_STORE_ENABLED: bool = True
+    ASSET_STORE_DIR: str = "blobs"            # 素材内容目录，相对于 DATA_ROOT
+    ASSET_STORE_DB_PATH: str = "assets.db"    # URL -> 内容哈希 索引 (SQLite)，相对于 DATA_ROOT
+
+    # 流水线阶段缓存 (summarize / refine / phrase)，输入、模型与提示词版本不变时复用上次结果
+    STAGE_CACHE_ENABLED: bool = True
+    STAGE_CACHE_DIR: str = "stage_cache"      # 缓存目录，相对于 DATA_ROOT
+    STAGE_CACHE_MAX_MB: int = 256             # 缓存总大小上限 (MB)，超过后淘汰最久未使用的条目
 
     # 路径配置
     DATA_ROOT: Path = Path("./data")
     EXCEL_PATH: str = "products.xlsx"
     PRODUCTS_JSON_PATH: str = "products.json"
+    PRODUCT_CATALOG_PATH: str = "products.db"  # 商品目录 (SQLite)，首次启动时自动导入 PRODUCTS_JSON_PATH
+
+    # 任务状态存储配置
+    TASK_STORE_BACKEND: str = "memory"        # memory (单进程) 或 sqlite (可跨 Worker 共享)
+    TASK_STORE_PATH: str = "tasks.db"         # SQLite 数据库文件，相对于 DATA_ROOT
+    TASK_TTL_SECONDS: int = 86400             # 已结束任务的保留时长 (秒)，过期后被清理
+    TASK_EVICT_INTERVAL_SECONDS: int = 300    # 两次过期清理之间的最小间隔 (秒)
+
+    # 任务调度配置
+    SCHEDULER_PIPELINE_WORKERS: int = 2       # 同时执行的完整流水线任务数
+    SCHEDULER_WHITE_BG_WORKERS: int = 2       # 同时执行的仅白底图任务数 (独立通道，不排在完整流水线之后)
+    SCHEDULER_MAX_QUEUE_SIZE: int = 20        # 每个通道的最大排队任务数，超过后返回 429；<= 0 表示不限制
+    SCHEDULER_RETRY_AFTER_SECONDS: int = 30   # 尚无耗时统计时返回的 Retry-After (秒)
+    RESUME_INTERRUPTED_TASKS: bool = True     # 启动时重新执行上次退出时中断的任务 (需持久化任务存储)
+
+    # 持久化任务队列与独立 Worker 配置
+    JOB_QUEUE_BACKEND: str = "local"          # local (API 进程内执行), sqlite (单机多进程), redis (多机)
+    JOB_QUEUE_PATH: str = "jobs.db"           # SQLite 队列文件，相对于 DATA_ROOT
+    JOB_QUEUE_REDIS_URL: str = "redis://localhost:6379/0"
+    JOB_QUEUE_REDIS_PREFIX: str = "visual_engine"
+    WORKER_CONCURRENCY: int = 2               # 每个 Worker 进程同时执行的任务数
+    WORKER_POLL_INTERVAL_SECONDS: float = 1.0 # 队列为空时的轮询间隔 (秒)
+    WORKER_HEARTBEAT_SECONDS: float = 10.0    # 执行中任务的心跳间隔 (秒)
+    WORKER_LEASE_SECONDS: float = 60.0        # 心跳超时后任务被放回队列 (秒)
+    WORKER_METRICS_PORT: int = 0              # Worker 输出 Prometheus 指标的端口，0 表示不输出
+
+    # 链路追踪配置 (本地 JSONL 导出，无需外部 Collector)
+    TRACING_ENABLED: bool = True              # 记录任务内各阶段、LLM 调用、生图请求与下载的嵌套 Span
+    TRACE_FILENAME: str = "trace.jsonl"       # 写入任务输出目录 (与 intermediates/ 同级) 的文件名
+    TRACE_DIR: str = "traces"                 # 没有输出目录的任务 (如仅去底) 的链路文件目录，相对于 DATA_ROOT
+
+    # SSE 进度推送配置
+    SSE_HISTORY_TTL_SECONDS: int = 600        # 任务结束后事件历史的保留时长 (秒)
+    SSE_KEEPALIVE_SECONDS: float = 15.0       # 无事件时发送心跳的间隔 (秒)
+    SSE_POLL_INTERVAL_SECONDS: float = 1.0    # 任务不在本进程执行时，轮询任务存储的间隔 (秒)
 
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -59,4 +191,32 @@ class Settings(BaseSettings):
     def full_products_json_path(self) -> Path:
         return self.DATA_ROOT / self.PRODUCTS_JSON_PATH
 
+    @property
+    def full_product_catalog_path(self) -> Path:
+        return self.DATA_ROOT / self.PRODUCT_CATALOG_PATH
+
+    @property
+    def full_asset_store_dir(self) -> Path:
+        return self.DATA_ROOT / self.ASSET_STORE_DIR
+
+    @property
+    def full_asset_store_db_path(self) -> Path:
+        return self.DATA_ROOT / self.ASSET_STORE_DB_PATH
+
+    @property
+    def full_stage_cache_dir(self) -> Path:
+        return self.DATA_ROOT / self.STAGE_CACHE_DIR
+
+    @property
+    def full_trace_dir(self) -> Path:
+        return self.DATA_ROOT / self.TRACE_DIR
+
+    @property
+    def full_task_store_path(self) -> Path:
+        return self.DATA_ROOT / self.TASK_STORE_PATH
+
+    @property
+    def full_job_queue_path(self) -> Path:
+        return self.DATA_ROOT / self.JOB_QUEUE_PATH
+
 settings = Settings()
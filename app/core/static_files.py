@@ -0,0 +1,86 @@
+import hashlib
+import os
+import stat
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Tuple
+from starlette.datastructures import Headers, QueryParams
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+# 版本参数 ?v= 取内容哈希的前缀长度
+VERSION_LENGTH = 16
+
+# (设备, inode, 修改时间, 大小) -> SHA-256；硬链接到同一素材的文件共用一条缓存，文件被覆盖后键随之变化
+_hash_cache: "OrderedDict[Tuple[int, int, int, int], str]" = OrderedDict()
+_hash_cache_lock = threading.Lock()
+_HASH_CACHE_SIZE = 4096
+
+def content_hash(path: Path, stat_result: os.stat_result = None) -> str:
+    """
+    计算文件内容的 SHA-256 (按 inode + 修改时间 + 大小缓存)。
+    未命中缓存时会读取整个文件，异步代码中应通过 asyncio.to_thread 调用。
+    """
+    stat_result = stat_result or os.stat(path)
+    key = (stat_result.st_dev, stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size)
+    with _hash_cache_lock:
+        cached = _hash_cache.get(key)
+        if cached is not None:
+            _hash_cache.move_to_end(key)
+            return cached
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    value = digest.hexdigest()
+    with _hash_cache_lock:
+        _hash_cache[key] = value
+        while len(_hash_cache) > _HASH_CACHE_SIZE:
+            _hash_cache.popitem(last=False)
+    return value
+
+def content_version(path: Path) -> str:
+    """
+    URL 版本参数 (?v=) 的取值：内容哈希的前 VERSION_LENGTH 位。
+    """
+    return content_hash(path)[:VERSION_LENGTH]
+
+class CachedStaticFiles(StaticFiles):
+    """
+    带强缓存的静态文件服务。
+
+    - ETag 基于文件内容的 SHA-256 (强校验)，If-None-Match 命中时返回 304。
+    - 只有 `?v=<hash>` 与当前文件内容哈希一致的 URL 返回一年期 immutable 缓存头 (内容寻址的图片 URL)；
+      其余请求 (包括恢复执行时会被改写的 trace.jsonl、intermediates/ 及版本已过期的 URL) 返回 no-cache，每次用 ETag 校验。
+    - 内容哈希在 lookup_path (由 StaticFiles 放到线程池执行) 中计算，不阻塞事件循环。
+    """
+    def lookup_path(self, path: str):
+        full_path, stat_result = super().lookup_path(path)
+        if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+            # 预先写入哈希缓存，随后在事件循环中执行的 file_response 直接命中
+            content_hash(full_path, stat_result)
+        return full_path, stat_result
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        digest = content_hash(full_path, stat_result)
+        version = QueryParams(scope.get("query_string", b"")).get("v")
+        versioned = bool(version) and len(version) >= 8 and digest.startswith(version)
+        cache_control = IMMUTABLE_CACHE_CONTROL if versioned else REVALIDATE_CACHE_CONTROL
+
+        response = FileResponse(
+            full_path,
+            status_code=status_code,
+            stat_result=stat_result,
+            headers={
+                "etag": f'"{digest}"',
+                "cache-control": cache_control
+            }
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
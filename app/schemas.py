@@ -42,6 +42,13 @@ class PhraseResult(BaseModel):
     phrases: List[ScenePhrase]
     positive_prompt_template: str = "把图像中的商品，放在带有{{}}的场景中，商品占比不低于75%。综合以上生成一张商品展示图。"
 
+class RefinedPhraseResult(BaseModel):
+    """
+    融合模式 (一次请求完成场景优化与提示词生成) 的结果。
+    """
+    refined_scene: RefinedScene
+    phrase_result: PhraseResult
+
 class GeneratedImage(BaseModel):
     scene_no: int
     image_path: Path
@@ -59,3 +66,20 @@ class GenerationTask(BaseModel):
     phrase_result: Optional[PhraseResult] = None
     image_result: Optional[ImageGenerationResult] = None
     error: Optional[str] = None
+
+class GenerateRequest(BaseModel):
+    """
+    /api/generate 端点的请求模型。
+    """
+    name: str
+    detail: str
+    attributes: Optional[str] = ""      # 商品属性/规格
+    image_base64: Optional[str] = None  # Base64 编码的源图
+    image_url: Optional[str] = None     # 源图 URL (Fallback)
+    image_path: Optional[str] = None    # 服务端相对路径 (例如 /outputs/xxx.png)
+    product_index: Optional[int] = None # 如果提供，复用现有的商品序号
+    gallery_images: List[str] = []      # 需要下载的橱窗图 URL 列表
+    detail_images: List[str] = []       # 需要下载的详情图 URL 列表
+    need_white_bg: bool = False         # 是否触发去底步骤
+    save_to_data: bool = True           # 是否将数据持久化到磁盘结构
+    white_bg_only: bool = False         # 如果为 True，则在去底后停止
@@ -0,0 +1,261 @@
+import asyncio
+import hashlib
+import os
+import random
+import shutil
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+import httpx
+from loguru import logger
+from app.core.config import settings
+from app.services.asset_store import AssetStore, get_asset_store
+from app.services.metrics import DOWNLOAD_BYTES, DOWNLOADS
+from app.services import tracing
+
+# 1688 等图床会校验 UA 与 Referer
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Referer': 'https://www.1688.com/'
+}
+
+# 这些状态码视为临时错误，按退避策略重试
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+@dataclass
+class DownloadResult:
+    """
+    单个 URL 的下载结果与耗时。
+    """
+    url: str
+    path: Optional[Path] = None
+    status_code: Optional[int] = None
+    size: int = 0
+    elapsed: float = 0.0
+    attempts: int = 0
+    sha256: Optional[str] = None
+    deduplicated: bool = False
+    cached: bool = False
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.path is not None
+
+def normalize_url(url: str) -> Optional[str]:
+    """
+    补全协议相对地址 (//img.alicdn.com/...)，非 http(s) 地址返回 None。
+    """
+    full_url = 'https:' + url if url.startswith('//') else url
+    return full_url if full_url.startswith('http') else None
+
+def guess_extension(content_type: str) -> str:
+    return ".png" if "png" in (content_type or "").lower() else ".jpg"
+
+class AssetDownloader:
+    """
+    商品素材 (橱窗图 / 详情图) 并发下载器。
+
+    - 共享的 httpx.AsyncClient 连接池，总并发受 ASSET_DOWNLOAD_CONCURRENCY 限制，单个域名受 ASSET_DOWNLOAD_PER_HOST 限制。
+    - 网络错误、超时及 408/429/5xx 按指数退避 (带抖动) 重试。
+    - 响应体流式写入临时文件，完成后重命名，不在内存中缓存整张图片。
+    - 同一 URL 同时只下载一次：批次内或并发任务间的重复 URL 等待首个下载完成后复用结果。
+    - 启用素材库 (ASSET_STORE_ENABLED) 时，内容按 SHA-256 去重存储，目标文件为硬链接；
+      素材库中已记录的 URL 直接链接本地内容，不访问网络。
+    """
+    def __init__(self, store: Optional[AssetStore] = None):
+        self.store = store if store is not None else get_asset_store()
+        self.concurrency = max(1, settings.ASSET_DOWNLOAD_CONCURRENCY)
+        self.per_host = max(1, settings.ASSET_DOWNLOAD_PER_HOST)
+        self.retries = max(0, settings.ASSET_DOWNLOAD_RETRIES)
+        self.backoff = settings.ASSET_DOWNLOAD_BACKOFF
+        self.client = httpx.AsyncClient(
+            headers=DEFAULT_HEADERS,
+            timeout=httpx.Timeout(settings.ASSET_DOWNLOAD_TIMEOUT),
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        )
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def _global_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = httpx.URL(url).host
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.per_host)
+        return self._host_semaphores[host]
+
+    async def _fetch(self, url: str, save_stem: Path) -> DownloadResult:
+        """
+        下载 URL 到 save_stem + 扩展名 (扩展名由 Content-Type 决定)，失败时按策略重试。
+        """
+        result = DownloadResult(url=url)
+        start = time.perf_counter()
+        tmp_path = save_stem.with_name(save_stem.name + ".part")
+
+        for attempt in range(1, self.retries + 2):
+            result.attempts = attempt
+            retryable = False
+            try:
+                async with self._global_semaphore(), self._host_semaphore(url):
+                    async with self.client.stream("GET", url) as response:
+                        result.status_code = response.status_code
+                        if response.status_code == 200:
+                            size = 0
+                            digest = hashlib.sha256()
+                            with open(tmp_path, "wb") as f:
+                                async for chunk in response.aiter_bytes(64 * 1024):
+                                    f.write(chunk)
+                                    digest.update(chunk)
+                                    size += len(chunk)
+                            ext = guess_extension(response.headers.get("Content-Type", ""))
+                            save_path = save_stem.with_suffix(ext)
+                            sha256 = digest.hexdigest()
+                            if self.store is not None:
+                                await asyncio.to_thread(self._store_download, url, tmp_path, sha256, ext, save_path)
+                            else:
+                                os.replace(tmp_path, save_path)
+                            result.path, result.size, result.sha256, result.error = save_path, size, sha256, None
+                            DOWNLOAD_BYTES.inc(size)
+                            break
+                        retryable = response.status_code in RETRYABLE_STATUS_CODES
+                        result.error = f"HTTP {response.status_code}"
+            except (httpx.TransportError, OSError) as e:
+                retryable = True
+                result.error = f"{type(e).__name__}: {e}"
+                if tmp_path.exists():
+                    tmp_path.unlink()
+
+            if not retryable or attempt > self.retries:
+                break
+            delay = self.backoff * (2 ** (attempt - 1)) * (1 + random.random())
+            logger.warning(f"Download {url} failed ({result.error}), retrying in {delay:.2f}s ({attempt}/{self.retries})")
+            await asyncio.sleep(delay)
+
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    def _store_download(self, url: str, tmp_path: Path, sha256: str, ext: str, save_path: Path) -> None:
+        blob = self.store.put_file(tmp_path, sha256, ext)
+        self.store.link(blob, save_path)
+        self.store.remember_url(url, sha256)
+
+    async def _reuse(self, source: Path, save_path: Path) -> None:
+        """
+        复用已下载的文件：启用素材库时创建硬链接，否则复制。
+        """
+        if save_path == source:
+            return
+        if self.store is not None:
+            await asyncio.to_thread(self.store.link, source, save_path)
+        else:
+            await asyncio.to_thread(shutil.copyfile, source, save_path)
+
+    async def download(self, url: str, save_stem: Path) -> DownloadResult:
+        """
+        下载单个 URL。若同一 URL 正在被其他调用下载，则等待其完成并复用文件。
+        每次调用记录一个 download Span (大小、是否命中素材库或复用进行中的下载)。
+
+        :param url: 图片地址 (支持 // 开头的协议相对地址)
+        :param save_stem: 不含扩展名的保存路径，如 data/1/detail/detail_0
+        """
+        with tracing.span("download", url=url) as span:
+            result = await self._download(url, save_stem)
+            span.set(size=result.size, status_code=result.status_code, attempts=result.attempts, cached=result.cached, deduplicated=result.deduplicated)
+            if not result.ok:
+                span.fail(result.error or "failed")
+            return result
+
+    async def _download(self, url: str, save_stem: Path) -> DownloadResult:
+        full_url = normalize_url(url)
+        if full_url is None:
+            return DownloadResult(url=url, error="Unsupported URL")
+
+        start = time.perf_counter()
+        if self.store is not None:
+            known = await asyncio.to_thread(self.store.lookup_url, full_url)
+            if known is not None:
+                sha256, blob = known
+                save_path = save_stem.with_suffix(blob.suffix)
+                await self._reuse(blob, save_path)
+                DOWNLOADS.inc(outcome="cached")
+                return DownloadResult(
+                    url=url, path=save_path, size=blob.stat().st_size, sha256=sha256,
+                    cached=True, elapsed=time.perf_counter() - start
+                )
+
+        inflight = self._inflight.get(full_url)
+        if inflight is not None:
+            source: DownloadResult = await asyncio.shield(inflight)
+            result = DownloadResult(url=url, status_code=source.status_code, deduplicated=True, error=source.error)
+            if source.ok:
+                save_path = save_stem.with_suffix(source.path.suffix)
+                await self._reuse(source.path, save_path)
+                result.path, result.size, result.sha256 = save_path, source.size, source.sha256
+            result.elapsed = time.perf_counter() - start
+            DOWNLOADS.inc(outcome="deduplicated" if result.ok else "failed")
+            return result
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[full_url] = future
+        try:
+            result = await self._fetch(full_url, save_stem)
+            result.url = url
+            DOWNLOADS.inc(outcome="downloaded" if result.ok else "failed")
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_result(DownloadResult(url=url, error=f"{type(e).__name__}: {e}"))
+            raise
+        finally:
+            del self._inflight[full_url]
+
+    async def download_to_dir(self, urls: List[str], directory: Path, prefix: str) -> List[str]:
+        """
+        并发下载一组图片到 directory，文件名为 {prefix}_{i}{ext} (i 为 URL 在列表中的位置)。
+
+        :return: 下载成功的文件路径 (相对于 DATA_ROOT)，按 URL 原始顺序排列
+        """
+        if not urls:
+            return []
+        directory.mkdir(parents=True, exist_ok=True)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*[
+            self.download(url, directory / f"{prefix}_{i}") for i, url in enumerate(urls)
+        ])
+
+        saved_paths = []
+        for result in results:
+            if result.ok:
+                logger.debug(
+                    f"Downloaded {result.url} -> {result.path.name} "
+                    f"({result.size} bytes, {result.elapsed:.2f}s, attempts={result.attempts}, "
+                    f"deduplicated={result.deduplicated}, cached={result.cached})"
+                )
+                saved_paths.append(str(result.path.relative_to(settings.DATA_ROOT)))
+            else:
+                logger.error(f"Failed to download image {result.url}: {result.error} ({result.elapsed:.2f}s, attempts={result.attempts})")
+
+        logger.info(f"Downloaded {len(saved_paths)}/{len(urls)} {prefix} images to {directory} in {time.perf_counter() - start:.2f}s")
+        return saved_paths
+
+    async def aclose(self):
+        await self.client.aclose()
+
+_downloader: Optional[AssetDownloader] = None
+
+def get_asset_downloader() -> AssetDownloader:
+    """
+    获取进程内共享的 AssetDownloader 实例 (首次调用时创建)。
+    """
+    global _downloader
+    if _downloader is None:
+        _downloader = AssetDownloader()
+    return _downloader
@@ -0,0 +1,145 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import stat
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+from loguru import logger
+from app.core.config import settings
+
+class AssetStore:
+    """
+    基于 SHA-256 的内容寻址素材库，用于跨商品去重。
+
+    - 每份内容只在 DATA_ROOT/ASSET_STORE_DIR/<hash[:2]>/<hash><ext> 保存一次，
+      各商品目录 (data/{index}/...) 中的文件是指向它的硬链接 (跨文件系统时退化为复制)。
+      硬链接与素材库文件共用同一 inode (权限也相同)，因此素材保持可写；改写商品文件时须写入新文件后
+      os.replace 替换 (本项目的写入均如此)，不能原地修改，否则会影响链接到同一内容的其它商品。
+    - 记录 URL -> 内容哈希 的映射，已下载过的 URL 直接链接本地内容，不再访问网络。
+    - 内容哈希可作为下游缓存的稳定键。
+    """
+    def __init__(self, root: Path = None, db_path: Path = None):
+        self.root = Path(root or settings.full_asset_store_dir)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.db_path = Path(db_path or settings.full_asset_store_db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha256 TEXT PRIMARY KEY,
+                ext TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+        logger.info(f"Initialized asset store: {self.root}")
+
+    def blob_path(self, sha256: str, ext: str) -> Path:
+        return self.root / sha256[:2] / f"{sha256}{ext}"
+
+    def put_file(self, src: Path, sha256: str, ext: str) -> Path:
+        """
+        将已计算好哈希的文件移入素材库 (内容已存在时直接删除 src)。
+
+        :return: 素材库中的文件路径
+        """
+        blob = self.blob_path(sha256, ext)
+        if blob.exists():
+            os.unlink(src)
+        else:
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(src, blob)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO blobs (sha256, ext, size, created_at) VALUES (?, ?, ?, ?)",
+                (sha256, ext, blob.stat().st_size, time.time())
+            )
+            self._conn.commit()
+        return blob
+
+    def put_bytes(self, data: bytes, ext: str) -> Tuple[str, Path]:
+        """
+        保存一段内存中的内容 (如 Base64 上传的主图)。
+
+        :return: (内容哈希, 素材库中的文件路径)
+        """
+        sha256 = hashlib.sha256(data).hexdigest()
+        blob = self.blob_path(sha256, ext)
+        if blob.exists():
+            return sha256, blob
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = blob.with_name(f"{blob.name}.{os.getpid()}.{threading.get_ident()}.part")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        return sha256, self.put_file(tmp_path, sha256, ext)
+
+    def link(self, blob: Path, dest: Path) -> Path:
+        """
+        在商品目录中创建指向素材库文件的硬链接 (已存在的 dest 会被原子替换)。
+        """
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        mode = blob.stat().st_mode
+        if not mode & stat.S_IWUSR:
+            # 早期版本将素材设为只读，硬链接出的商品文件也随之只读，这里恢复属主写权限
+            os.chmod(blob, mode | stat.S_IWUSR)
+        tmp_path = dest.with_name(f"{dest.name}.{os.getpid()}.{threading.get_ident()}.link")
+        try:
+            os.link(blob, tmp_path)
+        except OSError:
+            # 跨文件系统或不支持硬链接时退化为复制
+            shutil.copyfile(blob, tmp_path)
+        os.replace(tmp_path, dest)
+        return dest
+
+    def lookup_url(self, url: str) -> Optional[Tuple[str, Path]]:
+        """
+        查询 URL 对应的已存内容。
+
+        :return: (内容哈希, 素材库中的文件路径)，未记录或文件已被删除时返回 None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT b.sha256, b.ext FROM urls u JOIN blobs b ON u.sha256 = b.sha256 WHERE u.url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        blob = self.blob_path(*row)
+        return (row[0], blob) if blob.exists() else None
+
+    def remember_url(self, url: str, sha256: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO urls (url, sha256, updated_at) VALUES (?, ?, ?)",
+                (url, sha256, time.time())
+            )
+            self._conn.commit()
+
+_store: Optional[AssetStore] = None
+_store_lock = threading.Lock()
+
+def get_asset_store() -> Optional[AssetStore]:
+    """
+    获取进程内共享的 AssetStore 实例，ASSET_STORE_ENABLED=False 时返回 None。
+    """
+    global _store
+    if not settings.ASSET_STORE_ENABLED:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = AssetStore()
+    return _store
@@ -1,26 +1,27 @@
 import pandas as pd
-import json
 from pathlib import Path
 from typing import List
 from loguru import logger
 from app.schemas import ProductInput
 from app.core.config import settings
+from app.services.product_catalog import ProductCatalog, get_product_catalog
 
 class JSONDataLoader:
-    def __init__(self):
-        self.json_path = settings.full_products_json_path
+    """
+    从商品目录加载商品数据。
+
+    商品目录取代了 products.json，首次使用时会自动导入已有的 products.json；
+    可通过 `python -m app.services.product_catalog export` 导出为 JSON。
+    """
+    def __init__(self, catalog: ProductCatalog = None):
+        self.catalog = catalog or get_product_catalog()
         self.data_root = settings.DATA_ROOT
 
     def load_products(self) -> List[ProductInput]:
-        logger.info(f"Loading products from {self.json_path}")
-        
-        if not self.json_path.exists():
-            logger.error(f"JSON file not found: {self.json_path}")
-            return []
+        logger.info(f"Loading products from {self.catalog.db_path}")
 
         try:
-            with open(self.json_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            data = self.catalog.list_products()
             
             products = []
             for item in data:
@@ -44,7 +45,7 @@ class JSONDataLoader:
             logger.info(f"Successfully loaded {len(products)} products")
             return products
         except Exception as e:
-            logger.exception(f"Error loading JSON file: {e}")
+            logger.exception(f"Error loading product catalog: {e}")
             return []
 
 class ExcelDataLoader:
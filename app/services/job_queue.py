@@ -0,0 +1,390 @@
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+from loguru import logger
+from app.core.config import settings
+from app.services.scheduler import QueueFullError
+
+@dataclass
+class QueuedJob:
+    """
+    队列中的一个任务。payload 为 GenerateRequest.model_dump() 的结果。
+    """
+    task_id: str
+    lane: str
+    payload: dict
+    queued_at: float
+    attempts: int = 0
+
+class BaseJobQueue(ABC):
+    """
+    持久化任务队列基类，供 API 进程入队、独立的 Worker 进程 (`python -m app.worker`) 领取执行。
+
+    Worker 领取任务后定期发送心跳；心跳超时 (Worker 崩溃或被杀) 的任务由 requeue_stale 放回队首重新执行。
+    所有方法均为同步调用，在事件循环中请通过 asyncio.to_thread 调用。
+    """
+    def __init__(self, max_queue_size: int = None):
+        max_queue_size = max_queue_size if max_queue_size is not None else settings.SCHEDULER_MAX_QUEUE_SIZE
+        # <= 0 表示不限制队列长度
+        self.max_queue_size: Optional[int] = max_queue_size if max_queue_size > 0 else None
+
+    @abstractmethod
+    def enqueue(self, task_id: str, lane: str, payload: dict) -> int:
+        """
+        将任务加入指定通道队尾。
+
+        :return: 排队位置 (从 1 开始)
+        :raises QueueFullError: 队列已满
+        """
+        pass
+
+    @abstractmethod
+    def claim(self, lanes: List[str], worker_id: str) -> Optional[QueuedJob]:
+        """
+        按 lanes 顺序领取第一个可执行的任务，队列为空时返回 None (不阻塞)。
+        """
+        pass
+
+    @abstractmethod
+    def heartbeat(self, task_id: str) -> None:
+        """
+        刷新执行中任务的心跳时间。
+        """
+        pass
+
+    @abstractmethod
+    def complete(self, task_id: str, worker_id: str, attempts: int) -> bool:
+        """
+        任务执行结束 (无论成功或失败)，将其移出队列。
+
+        只有 (worker_id, attempts) 与当前领取记录一致时才移除：Worker 心跳停顿期间任务可能已被放回队列并由
+        其他 Worker (或本 Worker 的其他执行槽) 重新领取，此时旧的执行结束不能删除新的领取。
+
+        :param worker_id: 领取任务的 Worker
+        :param attempts: 领取时的 QueuedJob.attempts
+        :return: 是否移除了任务
+        """
+        pass
+
+    @abstractmethod
+    def requeue_stale(self, lease_seconds: float) -> int:
+        """
+        将心跳超过 lease_seconds 的执行中任务放回队首。
+
+        :return: 重新入队的任务数量
+        """
+        pass
+
+    @abstractmethod
+    def position(self, task_id: str) -> Optional[dict]:
+        """
+        查询排队中任务的通道与位置，任务不在排队状态时返回 None。
+        """
+        pass
+
+    @abstractmethod
+    def size(self, lane: str) -> int:
+        """
+        指定通道中排队 (未被领取) 的任务数。
+        """
+        pass
+
+    @abstractmethod
+    def running(self, lane: str) -> int:
+        """
+        指定通道中已被 Worker 领取、正在执行的任务数。
+        """
+        pass
+
+class SQLiteJobQueue(BaseJobQueue):
+    """
+    基于 SQLite (WAL 模式) 的任务队列，适用于单机多进程 (API + N 个 Worker 共享同一个数据库文件)。
+    领取任务在 BEGIN IMMEDIATE 事务中完成，同一任务不会被两个 Worker 同时领取。
+    """
+    def __init__(self, db_path: Path = None, **kwargs):
+        super().__init__(**kwargs)
+        self.db_path = Path(db_path or settings.full_job_queue_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # isolation_level=None: 由代码显式控制事务 (BEGIN IMMEDIATE)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_id TEXT NOT NULL UNIQUE,
+                lane TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                queued_at REAL NOT NULL,
+                worker_id TEXT,
+                heartbeat_at REAL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_lane_status ON jobs(lane, status, seq)")
+        logger.info(f"Initialized SQLite job queue: {self.db_path}")
+
+    def _transaction(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn()
+                self._conn.execute("COMMIT")
+                return result
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def enqueue(self, task_id: str, lane: str, payload: dict) -> int:
+        def insert():
+            queued = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE lane = ? AND status = 'queued'", (lane,)
+            ).fetchone()[0]
+            if self.max_queue_size is not None and queued >= self.max_queue_size:
+                raise QueueFullError(lane, settings.SCHEDULER_RETRY_AFTER_SECONDS)
+            self._conn.execute(
+                "INSERT INTO jobs (task_id, lane, payload, status, queued_at) VALUES (?, ?, ?, 'queued', ?)",
+                (task_id, lane, json.dumps(payload, ensure_ascii=False), time.time())
+            )
+            return queued + 1
+        return self._transaction(insert)
+
+    def claim(self, lanes: List[str], worker_id: str) -> Optional[QueuedJob]:
+        def take():
+            for lane in lanes:
+                row = self._conn.execute(
+                    "SELECT task_id, payload, queued_at, attempts FROM jobs "
+                    "WHERE lane = ? AND status = 'queued' ORDER BY seq LIMIT 1",
+                    (lane,)
+                ).fetchone()
+                if row is None:
+                    continue
+                task_id, payload, queued_at, attempts = row
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'running', worker_id = ?, heartbeat_at = ?, attempts = attempts + 1 "
+                    "WHERE task_id = ?",
+                    (worker_id, time.time(), task_id)
+                )
+                return QueuedJob(task_id, lane, json.loads(payload), queued_at, attempts + 1)
+            return None
+        return self._transaction(take)
+
+    def heartbeat(self, task_id: str) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE task_id = ?", (time.time(), task_id))
+
+    def complete(self, task_id: str, worker_id: str, attempts: int) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM jobs WHERE task_id = ? AND status = 'running' AND worker_id = ? AND attempts = ?",
+                (task_id, worker_id, attempts)
+            ).rowcount > 0
+
+    def requeue_stale(self, lease_seconds: float) -> int:
+        def requeue():
+            cutoff = time.time() - lease_seconds
+            stale = self._conn.execute(
+                "SELECT seq FROM jobs WHERE status = 'running' AND heartbeat_at < ?", (cutoff,)
+            ).fetchall()
+            for (seq,) in stale:
+                # 以负数序号放回队首，优先于新任务执行
+                min_seq = self._conn.execute("SELECT MIN(seq) FROM jobs").fetchone()[0]
+                self._conn.execute(
+                    "UPDATE jobs SET seq = ?, status = 'queued', worker_id = NULL, heartbeat_at = NULL WHERE seq = ?",
+                    (min(min_seq, 0) - 1, seq)
+                )
+            return len(stale)
+        return self._transaction(requeue)
+
+    def position(self, task_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT seq, lane, queued_at FROM jobs WHERE task_id = ? AND status = 'queued'", (task_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            seq, lane, queued_at = row
+            ahead = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE lane = ? AND status = 'queued' AND seq < ?", (lane, seq)
+            ).fetchone()[0]
+        return {
+            "lane": lane,
+            "queue_position": ahead + 1,
+            "queue_wait_seconds": round(time.time() - queued_at, 2),
+        }
+
+    def size(self, lane: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE lane = ? AND status = 'queued'", (lane,)
+            ).fetchone()[0]
+
+    def running(self, lane: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE lane = ? AND status = 'running'", (lane,)
+            ).fetchone()[0]
+
+# 入队：检查队列长度与写入任务在同一个脚本中完成，多个 API 进程并发入队时也不会超过上限
+# (ARGV[1] 为上限，0 表示不限制)；队列已满时返回 -1
+_ENQUEUE_SCRIPT = """
+if tonumber(ARGV[1]) > 0 and redis.call('LLEN', KEYS[1]) >= tonumber(ARGV[1]) then
+    return -1
+end
+redis.call('HSET', KEYS[2], 'lane', ARGV[2], 'payload', ARGV[3], 'queued_at', ARGV[4], 'attempts', 0)
+return redis.call('LPUSH', KEYS[1], ARGV[5])
+"""
+
+# 领取任务：转移到 processing 列表与写入首次心跳在同一个脚本中完成，
+# 避免 Worker 在两步之间崩溃时任务留在 processing 中却没有心跳、永远不会被放回队列
+_CLAIM_SCRIPT = """
+local task_id = redis.call('LMOVE', KEYS[1], KEYS[2], 'RIGHT', 'LEFT')
+if not task_id then
+    return false
+end
+redis.call('ZADD', KEYS[3], ARGV[2], task_id)
+local job_key = ARGV[1] .. ':job:' .. task_id
+redis.call('HINCRBY', job_key, 'attempts', 1)
+redis.call('HSET', job_key, 'worker_id', ARGV[3])
+local result = redis.call('HGETALL', job_key)
+table.insert(result, 1, task_id)
+return result
+"""
+
+# 结束任务：只有领取记录 (worker_id + attempts) 仍与调用方一致时才移除，避免删除其他 Worker 重新领取的任务
+_COMPLETE_SCRIPT = """
+local job_key = ARGV[1] .. ':job:' .. ARGV[2]
+local job = redis.call('HMGET', job_key, 'lane', 'worker_id', 'attempts')
+if job[2] ~= ARGV[3] or job[3] ~= ARGV[4] then
+    return 0
+end
+redis.call('LREM', ARGV[1] .. ':processing:' .. job[1], 0, ARGV[2])
+redis.call('ZREM', KEYS[1], ARGV[2])
+redis.call('DEL', job_key)
+return 1
+"""
+
+# 放回心跳超时的任务：只有 ZREM 成功 (返回 1) 的一方移动任务，多个 Worker 同时回收时每个任务只会放回一次
+_REQUEUE_STALE_SCRIPT = """
+local requeued = 0
+for _, task_id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])) do
+    if redis.call('ZREM', KEYS[1], task_id) == 1 then
+        local lane = redis.call('HGET', ARGV[1] .. ':job:' .. task_id, 'lane')
+        if lane then
+            redis.call('LREM', ARGV[1] .. ':processing:' .. lane, 0, task_id)
+            -- RPUSH 放到出队一端，优先于新任务执行
+            redis.call('RPUSH', ARGV[1] .. ':queue:' .. lane, task_id)
+            requeued = requeued + 1
+        end
+    end
+end
+return requeued
+"""
+
+class RedisJobQueue(BaseJobQueue):
+    """
+    基于 Redis (或兼容协议的服务，如 Valkey / KeyDB，需支持 LMOVE 即 Redis >= 6.2) 的任务队列，适用于多台机器上的 Worker。
+    需要额外安装 redis 包 (pip install "redis>=4.2")。
+
+    - {prefix}:queue:{lane}: 排队任务 ID 列表 (LPUSH 入队，RPOP 方向出队)
+    - {prefix}:processing:{lane}: 已被领取的任务 ID 列表 (LMOVE 原子转移，Worker 崩溃时不丢任务)
+    - {prefix}:job:{task_id}: 任务内容 (hash)
+    - {prefix}:heartbeats: 执行中任务的心跳时间 (sorted set)
+
+    入队 (含队列长度检查)、领取、结束与回收超时任务均由 Lua 脚本在服务端原子执行。
+    """
+    def __init__(self, url: str = None, prefix: str = None, **kwargs):
+        super().__init__(**kwargs)
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("JOB_QUEUE_BACKEND=redis requires the 'redis' package: pip install \"redis>=4.2\"") from e
+        self.url = url or settings.JOB_QUEUE_REDIS_URL
+        self.prefix = prefix or settings.JOB_QUEUE_REDIS_PREFIX
+        self.redis = redis.Redis.from_url(self.url, decode_responses=True)
+        self._enqueue_script = self.redis.register_script(_ENQUEUE_SCRIPT)
+        self._claim_script = self.redis.register_script(_CLAIM_SCRIPT)
+        self._requeue_stale_script = self.redis.register_script(_REQUEUE_STALE_SCRIPT)
+        self._complete_script = self.redis.register_script(_COMPLETE_SCRIPT)
+        logger.info(f"Initialized Redis job queue: {self.url} (prefix={self.prefix})")
+
+    def _key(self, *parts: str) -> str:
+        return ":".join((self.prefix,) + parts)
+
+    def enqueue(self, task_id: str, lane: str, payload: dict) -> int:
+        position = self._enqueue_script(
+            keys=[self._key("queue", lane), self._key("job", task_id)],
+            args=[self.max_queue_size or 0, lane, json.dumps(payload, ensure_ascii=False), time.time(), task_id],
+        )
+        if position < 0:
+            raise QueueFullError(lane, settings.SCHEDULER_RETRY_AFTER_SECONDS)
+        return position
+
+    def claim(self, lanes: List[str], worker_id: str) -> Optional[QueuedJob]:
+        for lane in lanes:
+            result = self._claim_script(
+                keys=[self._key("queue", lane), self._key("processing", lane), self._key("heartbeats")],
+                args=[self.prefix, time.time(), worker_id],
+            )
+            if not result:
+                continue
+            task_id, fields = result[0], result[1:]
+            data = dict(zip(fields[::2], fields[1::2]))
+            return QueuedJob(task_id, lane, json.loads(data["payload"]), float(data["queued_at"]), int(data["attempts"]))
+        return None
+
+    def heartbeat(self, task_id: str) -> None:
+        self.redis.zadd(self._key("heartbeats"), {task_id: time.time()}, xx=True)
+
+    def complete(self, task_id: str, worker_id: str, attempts: int) -> bool:
+        return bool(self._complete_script(
+            keys=[self._key("heartbeats")],
+            args=[self.prefix, task_id, worker_id, attempts],
+        ))
+
+    def requeue_stale(self, lease_seconds: float) -> int:
+        return int(self._requeue_stale_script(
+            keys=[self._key("heartbeats")],
+            args=[self.prefix, time.time() - lease_seconds],
+        ))
+
+    def position(self, task_id: str) -> Optional[dict]:
+        data = self.redis.hmget(self._key("job", task_id), "lane", "queued_at")
+        lane, queued_at = data
+        if not lane:
+            return None
+        queue_key = self._key("queue", lane)
+        index = self.redis.lpos(queue_key, task_id)
+        if index is None:
+            return None
+        return {
+            "lane": lane,
+            "queue_position": self.redis.llen(queue_key) - index,
+            "queue_wait_seconds": round(time.time() - float(queued_at), 2),
+        }
+
+    def size(self, lane: str) -> int:
+        return self.redis.llen(self._key("queue", lane))
+
+    def running(self, lane: str) -> int:
+        return self.redis.llen(self._key("processing", lane))
+
+def create_job_queue(backend: str = None) -> BaseJobQueue:
+    """
+    根据配置创建持久化任务队列。
+
+    :param backend: 队列后端 (sqlite, redis)，为空时读取 JOB_QUEUE_BACKEND
+    """
+    name = (backend or settings.JOB_QUEUE_BACKEND).lower()
+    if name == "sqlite":
+        return SQLiteJobQueue()
+    if name == "redis":
+        return RedisJobQueue()
+    raise ValueError(f"Unknown job queue backend: {name}. Available: ['sqlite', 'redis']")
@@ -0,0 +1,285 @@
+import asyncio
+import bisect
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Sequence, Tuple
+from loguru import logger
+
+# Prometheus 文本格式 (text/plain; version=0.0.4)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 默认耗时分桶 (秒)，覆盖从单次 LLM 调用到整段生图的范围
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class _Metric(ABC):
+    """
+    指标基类，子类实现 _samples 输出各组标签的样本行。
+    """
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        pass
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    """
+    单调递增计数器。
+    """
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+class Gauge(_Metric):
+    """
+    可增可减的瞬时值，通常在抓取时由收集函数重新设置。
+    """
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+class Histogram(_Metric):
+    """
+    累积分桶直方图，输出 _bucket / _sum / _count。
+    """
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每组标签: [各分桶计数 (非累积，最后一项为 +Inf 分桶), sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][index] += 1
+            counts[1] += value
+
+    def count(self, **labels) -> int:
+        counts = self._values.get(self._key(labels))
+        return sum(counts[0]) if counts else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(c[0]), c[1])) for key, c in self._values.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """
+    进程内指标注册表。
+
+    收集函数 (collector) 在每次抓取前调用，用于刷新队列长度等需要实时查询的 Gauge；
+    收集失败只记录警告，不影响其它指标输出。
+    """
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+registry = MetricsRegistry()
+
+# --- 流水线阶段 ---
+STAGE_DURATION = registry.register(Histogram(
+    "visual_engine_stage_duration_seconds", "Pipeline stage duration (white_bg, summarize, refine, phrase, image)", ["stage"]
+))
+STAGE_RESULTS = registry.register(Counter(
+    "visual_engine_stage_total", "Pipeline stage executions by outcome (completed, failed)", ["stage", "outcome"]
+))
+
+# --- 生图服务商 ---
+PROVIDER_LATENCY = registry.register(Histogram(
+    "visual_engine_provider_request_seconds", "Image provider request latency", ["provider", "model"]
+))
+PROVIDER_REQUESTS = registry.register(Counter(
+    "visual_engine_provider_requests_total", "Image provider requests by outcome (success, failure, error, cancelled)", ["provider", "outcome"]
+))
+PROVIDER_CIRCUIT_STATE = registry.register(Gauge(
+    "visual_engine_provider_circuit_state", "Provider circuit breaker state (0 closed, 1 half-open, 2 open)", ["provider"]
+))
+PROVIDER_FAILOVERS = registry.register(Counter(
+    "visual_engine_provider_failovers_total", "Image requests handed to the next provider in a failover chain", ["source", "target"]
+))
+PROVIDER_EWMA_LATENCY = registry.register(Gauge(
+    "visual_engine_provider_ewma_latency_seconds", "EWMA of successful image request latency per provider", ["provider"]
+))
+PROVIDER_SUCCESS_RATE = registry.register(Gauge(
+    "visual_engine_provider_success_rate", "EWMA of image request success per provider", ["provider"]
+))
+IMAGE_ROUTER_SELECTIONS = registry.register(Counter(
+    "visual_engine_image_router_selections_total", "Image requests the auto router sent first to each provider", ["provider"]
+))
+IMAGE_HEDGES = registry.register(Counter(
+    "visual_engine_image_hedges_total",
+    "Hedged scene image requests by outcome (issued, won, lost, failed, budget_exhausted, no_capacity)", ["outcome"]
+))
+IMAGE_HEDGE_RATE = registry.register(Gauge(
+    "visual_engine_image_hedge_rate", "Share of scene image requests hedged within the budget window"
+))
+
+# --- 自适应限流 (生图服务商与 LLM 模型) ---
+RATE_LIMIT_RATE = registry.register(Gauge(
+    "visual_engine_rate_limit_rps", "Current adaptive rate limit per endpoint (requests per second)", ["limiter"]
+))
+RATE_LIMIT_WAITING = registry.register(Gauge(
+    "visual_engine_rate_limit_waiting", "Requests queued for a rate limiter token", ["limiter"]
+))
+RATE_LIMIT_WAIT = registry.register(Histogram(
+    "visual_engine_rate_limit_wait_seconds", "Time spent waiting for a rate limiter token", ["limiter"]
+))
+RATE_LIMITED = registry.register(Counter(
+    "visual_engine_rate_limited_total", "HTTP 429 responses received per endpoint", ["limiter"]
+))
+
+# --- LLM ---
+LLM_LATENCY = registry.register(Histogram(
+    "visual_engine_llm_request_seconds", "LLM request latency (until the last chunk for streaming requests)", ["model"]
+))
+LLM_REQUESTS = registry.register(Counter(
+    "visual_engine_llm_requests_total", "LLM requests by outcome (success, error, cancelled)", ["model", "outcome"]
+))
+LLM_TOKENS = registry.register(Counter(
+    "visual_engine_llm_tokens_total", "LLM token usage reported by completion.usage", ["model", "type"]
+))
+
+# --- 任务与队列 ---
+QUEUE_DEPTH = registry.register(Gauge(
+    "visual_engine_queue_depth", "Tasks waiting in the job queue", ["lane"]
+))
+TASKS_IN_FLIGHT = registry.register(Gauge(
+    "visual_engine_tasks_in_flight", "Tasks currently being executed", ["lane"]
+))
+
+# --- 素材下载 ---
+DOWNLOAD_BYTES = registry.register(Counter(
+    "visual_engine_download_bytes_total", "Bytes downloaded from remote asset URLs"
+))
+DOWNLOADS = registry.register(Counter(
+    "visual_engine_downloads_total", "Asset downloads by outcome (downloaded, cached, deduplicated, failed)", ["outcome"]
+))
+
+def record_llm_usage(model: str, usage) -> None:
+    """
+    累计 completion.usage 中的 Token 数 (usage 为空时忽略)。
+    """
+    if usage is None:
+        return
+    LLM_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, model=model, type="prompt")
+    LLM_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, model=model, type="completion")
+
+async def serve_metrics(host: str, port: int) -> None:
+    """
+    以最简 HTTP 服务输出指标，供没有 FastAPI 的 Worker 进程使用 (任意路径均返回指标)。
+    """
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            # 读取并丢弃请求头
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            body = registry.render().encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 200 OK\r\nContent-Type: {CONTENT_TYPE}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii")
+                + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    async with server:
+        await server.serve_forever()
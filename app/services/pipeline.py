@@ -1,17 +1,27 @@
+import argparse
+import asyncio
 import time
 import uuid
 import json
 from datetime import datetime
 from pathlib import Path
 from loguru import logger
-from app.schemas import ProductInput, GenerationTask, TaskStatus
+from pydantic import ValidationError
+from app.schemas import ProductInput, GenerationTask, TaskStatus, SceneSummary, RefinedScene, PhraseResult, RefinedPhraseResult
 from app.core.config import settings
+from app.services.stage_cache import StageCache, get_stage_cache
+from app.services.metrics import STAGE_DURATION, STAGE_RESULTS
+from app.services import tracing
 from app.services.processors.scene_summarizer import SceneSummarizer
 from app.services.processors.scene_refiner import SceneRefiner
 from app.services.processors.phrase_generator import PhraseGenerator
+from app.services.processors.refine_phrase_generator import RefinePhraseGenerator
 from app.services.processors.image_generator import ImageGenerator
 from app.services.processors.white_bg_generator import WhiteBGGenerator
 
+# 中间结果中保存最终商品输入 (白底图处理之后) 的步骤名，用于恢复任务
+PRODUCT_INPUT_STEP = "00_product_input"
+
 class ProductImagePipeline:
     """
     电商视觉生成核心流水线 (Core Pipeline)。
@@ -25,8 +35,22 @@ class ProductImagePipeline:
         self.summarizer = SceneSummarizer()       # 分析商品特征场景
         self.refiner = SceneRefiner()             # 拓展商品场景
         self.phrase_generator = PhraseGenerator() # 将场景转换为具体的绘画 Prompt
+        self.refine_phrase_generator = RefinePhraseGenerator(self.refiner, self.phrase_generator) # 融合模式：一次请求完成 Step 2 + Step 3
         self.image_generator = ImageGenerator()   # 对接外部绘图API
         self.white_bg_generator = WhiteBGGenerator() # 白底图生成
+        self.stage_cache = get_stage_cache()      # 阶段结果缓存 (未启用时为 None)
+
+    async def warm_up(self):
+        """
+        预先建立到 LLM 与生图服务商的连接，使首个任务无需承担 TLS 握手等冷启动延迟。
+        共享的服务商实例只预热一次，预热失败不影响服务启动。
+        """
+        providers = {id(p): p for p in (self.image_generator.provider, self.white_bg_generator.provider)}
+        await asyncio.gather(
+            self.summarizer.client.warm_up(),
+            *[provider.warm_up() for provider in providers.values()],
+            return_exceptions=True
+        )
 
     def _save_intermediate(self, task_dir: Path, step_name: str, data: any):
         """
@@ -44,9 +68,9 @@ class ProductImagePipeline:
         filepath = output_dir / filename
         
         try:
-            # 优先使用 Pydantic 的 model_dump 方法进行序列化
+            # 优先使用 Pydantic 的 model_dump 方法进行序列化 (json 模式，Path 等字段转为字符串)
             if hasattr(data, "model_dump"):
-                content = data.model_dump()
+                content = data.model_dump(mode="json")
             else:
                 content = data
                 
@@ -56,31 +80,170 @@ class ProductImagePipeline:
         except Exception as e:
             logger.error(f"Failed to save intermediate result: {e}")
 
-    async def run_white_bg_only(self, product: ProductInput) -> Path:
+    def _load_intermediate(self, task_dir: Path, step_name: str, result_type):
+        """
+        读取 _save_intermediate 保存的中间结果，用于恢复任务。
+        
+        Args:
+            task_dir (Path): 任务输出目录
+            step_name (str): 步骤名称
+            result_type: 结果的 Pydantic 模型类
+            
+        Returns:
+            中间结果，文件不存在或内容无效时返回 None
+        """
+        filepath = task_dir / "intermediates" / f"{step_name}.json"
+        if not filepath.exists():
+            return None
+        try:
+            with open(filepath, "r", encoding="utf-8") as f:
+                return result_type(**json.load(f))
+        except (OSError, ValueError, ValidationError) as e:
+            logger.warning(f"Ignoring invalid intermediate result {filepath}: {e}")
+            return None
+
+    async def _cache_lookup(self, stage: str, processor, result_type, inputs: callable):
+        """
+        查询阶段缓存：缓存键由阶段名、模型名、提示词版本与规范化输入决定。
+        
+        Args:
+            stage (str): 阶段名称 (summarize, refine, phrase)
+            processor: 处理器实例，提供 model_name 与 prompt_version
+            result_type: 结果的 Pydantic 模型类，用于从缓存内容还原
+            inputs (callable): 返回规范化输入字典的同步函数 (在线程中执行，可读取图片计算哈希)
+            
+        Returns:
+            tuple: (缓存键，未启用缓存时为 None; 命中的结果，未命中时为 None)
+        """
+        if self.stage_cache is None:
+            return None, None
+        
+        try:
+            key = StageCache.make_key(stage, processor.model_name, processor.prompt_version, await asyncio.to_thread(inputs))
+        except Exception as e:
+            logger.warning(f"Stage cache bypassed for {stage}, failed to build key: {e}")
+            return None, None
+        
+        cached = await asyncio.to_thread(self.stage_cache.get, stage, key)
+        if cached is not None:
+            try:
+                result = result_type(**cached)
+                logger.info(f"Stage cache hit: {stage} ({key[:12]})")
+                return key, result
+            except ValidationError as e:
+                logger.warning(f"Stage cache entry {stage}/{key[:12]} no longer matches {result_type.__name__}: {e}")
+        
+        logger.info(f"Stage cache miss: {stage} ({key[:12]})")
+        return key, None
+
+    async def _cache_store(self, stage: str, key: str, result) -> None:
+        """
+        写入阶段缓存，写入失败不影响流水线。
+        """
+        if self.stage_cache is None or key is None:
+            return
+        try:
+            await asyncio.to_thread(self.stage_cache.put, stage, key, result)
+        except OSError as e:
+            logger.error(f"Failed to write stage cache entry {stage}/{key[:12]}: {e}")
+
+    async def _run_cached(self, stage: str, processor, result_type, inputs: callable, compute: callable):
+        """
+        通过阶段缓存执行一个 LLM 阶段，未命中时调用 compute (无参协程函数) 并写入缓存。
+        
+        Returns:
+            tuple: (阶段结果, 缓存状态 "hit" / "miss"，未启用缓存时为 None)
+        """
+        key, result = await self._cache_lookup(stage, processor, result_type, inputs)
+        if result is not None:
+            return result, "hit"
+        result = await compute()
+        await self._cache_store(stage, key, result)
+        return result, ("miss" if key else None)
+
+    async def _complete_phrase_stage(self, task_dir: Path, step_name: str, phrase_result: PhraseResult, cache_key: str, cache_state: str, started_at: float, on_event: callable):
+        """
+        Step 3 结束后的收尾：写入缓存 (未命中时)、保存中间结果并报告进度。
+        """
+        if cache_state == "miss":
+            await self._cache_store("phrase", cache_key, phrase_result)
+        self._save_intermediate(task_dir, step_name, phrase_result)
+        logger.info(f"✅ Step 3 Completed in {time.time() - started_at:.2f}s. Generated {len(phrase_result.phrases)} phrases.")
+        self._emit(on_event, "phrase", "completed", phrases=[p.scene_description for p in phrase_result.phrases], cache=cache_state, duration=round(time.time() - started_at, 2))
+
+    def _emit(self, on_event: callable, stage: str, state: str, **data):
+        """
+        向上层报告阶段进度事件，回调异常不影响流水线执行。
+        
+        Args:
+            on_event (callable): 事件回调，签名为 on_event(stage, state, **data)
+            stage (str): 阶段名称 (white_bg, summarize, refine, phrase, image)
+            state (str): 阶段状态 (started, completed, failed)
+            
+        completed 事件携带的 duration (秒) 同时计入阶段耗时直方图，从中间结果恢复的阶段不计入；
+        事件同时驱动链路中的阶段 Span (stage.<stage>)。
+        """
+        if state == "completed" and "duration" in data:
+            STAGE_DURATION.observe(data["duration"], stage=stage)
+            STAGE_RESULTS.inc(stage=stage, outcome=state)
+        elif state == "failed" and stage:
+            STAGE_RESULTS.inc(stage=stage, outcome=state)
+        tracing.stage_event(stage, state, **data)
+        if not on_event:
+            return
+        try:
+            on_event(stage, state, **data)
+        except Exception as e:
+            logger.error(f"Pipeline event callback failed ({stage}/{state}): {e}")
+
+    async def run_white_bg_only(self, product: ProductInput, on_event: callable = None) -> Path:
         """
         [独立功能] 仅执行白底图生成。
         
         Args:
             product (ProductInput): 商品输入信息
+            on_event (callable): 阶段进度回调，签名为 on_event(stage, state, **data)
             
         Returns:
             Path: 生成的白底图绝对路径
         """
         logger.info("Pipeline: Generating white background only...")
-        new_image_path = await self.white_bg_generator.process(product.image)
+        start = time.time()
+        self._emit(on_event, "white_bg", "started")
+        try:
+            new_image_path = await self.white_bg_generator.process(product.image)
+        except Exception as e:
+            self._emit(on_event, "white_bg", "failed", error=str(e))
+            raise e
+        self._emit(on_event, "white_bg", "completed", duration=round(time.time() - start, 2))
         return new_image_path
 
-    async def run(self, product: ProductInput, need_white_bg: bool = False) -> GenerationTask:
+    async def run(self, product: ProductInput, need_white_bg: bool = False, on_image_complete: callable = None, on_event: callable = None, resume_dir: Path = None) -> GenerationTask:
         """
         执行完整的视觉生成流水线。
         
         Args:
             product (ProductInput): 商品输入数据（包含图片路径、名称等）
             need_white_bg (bool): 是否需要先进行白底图处理（默认 False）
+            on_image_complete (callable): 每张场景图生成完成后的回调，参数为 GeneratedImage（支持同步或异步函数）
+            on_event (callable): 阶段进度回调，签名为 on_event(stage, state, **data)，用于实时推送进度
+            resume_dir (Path): 恢复中断的任务：沿用该输出目录，依次复用 intermediates/ 中已完成的步骤，
+                               并跳过目录中已生成的场景图，只执行缺失的部分
             
         Returns:
             GenerationTask: 包含最终结果及各步骤中间数据的任务对象
+            
+        链路记录在 pipeline.run Span 下 (未处于任务链路中时单独成链)，并导出到输出目录下的 TRACE_FILENAME。
         """
+        with tracing.start_trace("pipeline.run", product=product.name, resume=resume_dir is not None):
+            run_span = tracing.current_span()
+            task = await self._run(product, need_white_bg, on_image_complete, on_event, resume_dir)
+            run_span.set(task_id=task.task_id)
+            if task.status == TaskStatus.FAILED:
+                run_span.fail(task.error or "failed")
+            return task
+
+    async def _run(self, product: ProductInput, need_white_bg: bool, on_image_complete: callable, on_event: callable, resume_dir: Path) -> GenerationTask:
         start_time = time.time()
         task_id = str(uuid.uuid4())
         
@@ -89,6 +252,18 @@ class ProductImagePipeline:
         
         # 0. 预先构建任务输出目录名 (格式: ID_模型组合_时间戳)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        
+        # 恢复任务：沿用原输出目录，读取已保存的商品输入 (含已生成的白底图路径)，不再重复白底图处理
+        resuming = resume_dir is not None
+        if resuming:
+            resume_dir = Path(resume_dir)
+            saved_product = self._load_intermediate(resume_dir, PRODUCT_INPUT_STEP, ProductInput)
+            if saved_product is not None:
+                product = saved_product
+                task.product = product
+                need_white_bg = False
+            logger.info(f"♻️ Resuming pipeline from {resume_dir}")
+        
         product_id = Path(product.sample_dir).name
         
         # --- Step 0: 白底图预处理 (Optional) ---
@@ -96,66 +271,107 @@ class ProductImagePipeline:
             s0_start = time.time()
             logger.info("--- [Step 0: White Background Generation] ---")
             logger.info(f"Source Image for White BG: {product.image}")
+            self._emit(on_event, "white_bg", "started")
             try:
                 new_image_path = await self.white_bg_generator.process(product.image)
                 product.image = new_image_path # 更新商品图片路径为白底图
                 logger.info(f"✅ Step 0 Completed. Generated White BG: {product.image}")
+                self._emit(on_event, "white_bg", "completed", duration=round(time.time() - s0_start, 2))
             except Exception as e:
                 logger.error(f"❌ Step 0 Failed: {e}")
+                self._emit(on_event, "white_bg", "failed", error=str(e))
                 raise e
         else:
             logger.info("--- [Step 0: Skipped (User chose not to generate white BG)] ---")
             logger.info(f"Using existing image as reference: {product.image}")
         
-        # 构建输出目录名称，包含关键配置信息以利于实验追踪
-        folder_name = (
-            f"{product_id}_"
-            f"{self.summarizer.model_name}_"
-            f"{self.refiner.model_name}_"
-            f"{self.phrase_generator.model_name}_"
-            f"{self.phrase_generator.prompt_type}_"
-            f"{self.image_generator.provider.provider_name}_"
-            f"{self.image_generator.provider.model_name}_"
-            f"{timestamp}"
-        )
-        
-        task_dir = settings.DATA_ROOT / "outputs" / folder_name
+        if resuming:
+            task_dir = resume_dir
+        else:
+            # 构建输出目录名称，包含关键配置信息以利于实验追踪
+            folder_name = (
+                f"{product_id}_"
+                f"{self.summarizer.model_name}_"
+                f"{self.refiner.model_name}_"
+                f"{self.phrase_generator.model_name}_"
+                f"{self.phrase_generator.prompt_type}_"
+                f"{self.image_generator.provider.provider_name}_"
+                f"{self.image_generator.provider.model_name}_"
+                f"{timestamp}"
+            )
+            task_dir = settings.DATA_ROOT / "outputs" / folder_name
         task_dir.mkdir(parents=True, exist_ok=True)
+        tracing.add_export_path(task_dir / settings.TRACE_FILENAME)
+        # 保存最终使用的商品输入，任务中断后可据此恢复
+        self._save_intermediate(task_dir, PRODUCT_INPUT_STEP, product)
+        self._emit(on_event, "prepare", "completed", output_dir=str(task_dir))
         
         logger.info(f"🚀 [Pipeline Start] Task ID: {task_id}")
         logger.info(f"📦 Product: {product.name} (ID: {product_id})")
         logger.info(f"📂 Output Directory: {task_dir}")
         logger.info(f"⚙️ Config: Type={self.phrase_generator.prompt_type}, Version={self.phrase_generator.prompt_version}")
         
+        stage = None
         try:
             # --- Step 1: 视觉理解 (Visual Understanding) ---
             # 利用多模态大模型 (Qwen-VL) 分析商品图片，提取核心特征
+            # 恢复任务时依次复用已完成步骤的中间结果；某一步重新执行后，其后续步骤也必须重新执行
             s1_start = time.time()
-            logger.info("Step 1: Summarizing product")
-            task.summary = await self.summarizer.process(product)
-            self._save_intermediate(task_dir, f"01_scene_summarizer_{self.summarizer.model_name}", task.summary)
-            logger.info(f"✅ Step 1 Completed in {time.time() - s1_start:.2f}s")
+            stage = "summarize"
+            step_name = f"01_scene_summarizer_{self.summarizer.model_name}"
+            task.summary = self._load_intermediate(task_dir, step_name, SceneSummary) if resuming else None
+            if task.summary is not None:
+                logger.info("♻️ Step 1 restored from intermediates")
+                self._emit(on_event, stage, "completed", scene_count=len(task.summary.scenes), resumed=True)
+            else:
+                resuming = False
+                logger.info("Step 1: Summarizing product")
+                self._emit(on_event, stage, "started")
+                task.summary, cache_state = await self._run_cached(
+                    stage, self.summarizer, SceneSummary,
+                    lambda: self.summarizer.cache_inputs(product),
+                    lambda: self.summarizer.process(product)
+                )
+                self._save_intermediate(task_dir, step_name, task.summary)
+                logger.info(f"✅ Step 1 Completed in {time.time() - s1_start:.2f}s")
+                self._emit(on_event, stage, "completed", scene_count=len(task.summary.scenes), cache=cache_state, duration=round(time.time() - s1_start, 2))
             
             # --- Step 2: 场景优化 (Scene Refining) ---
             # 利用 LLM 基于视觉描述扩展适合电商营销的场景列表
             s2_start = time.time()
-            logger.info("Step 2: Refining scenes (Text Optimization & Expansion)...")
-            task.refined_scene = await self.refiner.process(product, task.summary)
-            self._save_intermediate(task_dir, f"02_scene_refiner_{self.refiner.model_name}", task.refined_scene)
-            logger.info(f"✅ Step 2 Completed in {time.time() - s2_start:.2f}s. Total scenes: {len(task.refined_scene.scenes)}")
-            
-            # --- Step 3: 提示词生成 (Phrase Generation) ---
-            # 将场景描述转化为具体的生图 Prompt
-            s3_start = time.time()
-            logger.info(f"Step 3: Generating scene phrases ({self.phrase_generator.prompt_type})...")
-            task.phrase_result = await self.phrase_generator.process(product, task.refined_scene)
-            self._save_intermediate(task_dir, f"03_phrase_generator_{self.phrase_generator.model_name}_{self.phrase_generator.prompt_type}", task.phrase_result)
-            logger.info(f"✅ Step 3 Completed in {time.time() - s3_start:.2f}s. Generated {len(task.phrase_result.phrases)} phrases.")
-            
-            # --- Step 4: 图像生成 (Image Generation) ---
-            # 调用配置的图像生成提供商 (Provider) 执行生图任务
-            s4_start = time.time()
-            logger.info(f"Step 4: Generating images with {self.image_generator.provider.provider_name}...")
+            stage = "refine"
+            step_name = f"02_scene_refiner_{self.refiner.model_name}"
+            task.refined_scene = self._load_intermediate(task_dir, step_name, RefinedScene) if resuming else None
+            if task.refined_scene is not None:
+                logger.info("♻️ Step 2 restored from intermediates")
+                self._emit(on_event, stage, "completed", scene_count=len(task.refined_scene.scenes), resumed=True)
+            elif settings.REFINE_PHRASE_FUSED:
+                # 融合模式：一次请求同时完成场景优化与提示词生成，Step 3 直接使用其结果
+                resuming = False
+                logger.info("Step 2+3: Refining scenes and generating phrases in one request...")
+                self._emit(on_event, stage, "started")
+                self._emit(on_event, "phrase", "started")
+                fused, fused_cache_state = await self._run_cached(
+                    "refine_phrase", self.refine_phrase_generator, RefinedPhraseResult,
+                    lambda: self.refine_phrase_generator.cache_inputs(product, task.summary),
+                    lambda: self.refine_phrase_generator.process(product, task.summary)
+                )
+                task.refined_scene, task.phrase_result = fused.refined_scene, fused.phrase_result
+                self._save_intermediate(task_dir, step_name, task.refined_scene)
+                logger.info(f"✅ Step 2 Completed in {time.time() - s2_start:.2f}s (fused with Step 3). Total scenes: {len(task.refined_scene.scenes)}")
+                self._emit(on_event, stage, "completed", scene_count=len(task.refined_scene.scenes), cache=fused_cache_state, fused=True, duration=round(time.time() - s2_start, 2))
+            else:
+                resuming = False
+                logger.info("Step 2: Refining scenes (Text Optimization & Expansion)...")
+                self._emit(on_event, stage, "started")
+                task.refined_scene, cache_state = await self._run_cached(
+                    stage, self.refiner, RefinedScene,
+                    lambda: self.refiner.cache_inputs(product, task.summary),
+                    lambda: self.refiner.process(product, task.summary)
+                )
+                self._save_intermediate(task_dir, step_name, task.refined_scene)
+                logger.info(f"✅ Step 2 Completed in {time.time() - s2_start:.2f}s. Total scenes: {len(task.refined_scene.scenes)}")
+                self._emit(on_event, stage, "completed", scene_count=len(task.refined_scene.scenes), cache=cache_state, duration=round(time.time() - s2_start, 2))
             
             # 注入元数据，用于生图结果的文件命名或 Exif 信息
             metadata = {
@@ -168,13 +384,78 @@ class ProductImagePipeline:
                 "image_model": self.image_generator.provider.model_name
             }
             
-            task.image_result = await self.image_generator.process(
-                product, 
-                task.phrase_result, 
-                task_dir, 
-                metadata=metadata
-            )
+            # --- Step 3: 提示词生成 (Phrase Generation) ---
+            # 将场景描述转化为具体的生图 Prompt
+            s3_start = time.time()
+            stage = "phrase"
+            step_name = f"03_phrase_generator_{self.phrase_generator.model_name}_{self.phrase_generator.prompt_type}"
+            restored_phrases = self._load_intermediate(task_dir, step_name, PhraseResult) if resuming else None
+            if task.phrase_result is not None:
+                # 融合模式下提示词已在 Step 2 的同一次请求中生成
+                await self._complete_phrase_stage(task_dir, step_name, task.phrase_result, None, fused_cache_state, s2_start, on_event)
+            elif restored_phrases is not None:
+                task.phrase_result = restored_phrases
+                logger.info("♻️ Step 3 restored from intermediates")
+                self._emit(on_event, stage, "completed", phrases=[p.scene_description for p in task.phrase_result.phrases], resumed=True)
+            else:
+                resuming = False
+                logger.info(f"Step 3: Generating scene phrases ({self.phrase_generator.prompt_type})...")
+                self._emit(on_event, stage, "started")
+                cache_key, task.phrase_result = await self._cache_lookup(
+                    stage, self.phrase_generator, PhraseResult,
+                    lambda: self.phrase_generator.cache_inputs(product, task.refined_scene)
+                )
+                cache_state = "miss" if cache_key else None
+                if task.phrase_result is not None:
+                    await self._complete_phrase_stage(task_dir, step_name, task.phrase_result, cache_key, "hit", s3_start, on_event)
+                elif settings.PHRASE_STREAMING:
+                    # 流式模式：每条提示词解析完成即提交生图，LLM 生成后续场景与前面场景的生图重叠执行
+                    s4_start = time.time()
+                    logger.info(f"Step 3+4: Streaming phrases into image generation with {self.image_generator.provider.provider_name}...")
+                    self._emit(on_event, "image", "started", image_count=None)
+                    template = self.phrase_generator.result_template()
+                    streamed = []
+                    
+                    async def phrase_stream():
+                        async for phrase in self.phrase_generator.process_stream(product, task.refined_scene):
+                            streamed.append(phrase)
+                            yield phrase
+                        # 提示词全部到达后即保存中间结果，此后生图中断也可从 Step 4 恢复
+                        task.phrase_result = PhraseResult(phrases=streamed, positive_prompt_template=template)
+                        await self._complete_phrase_stage(task_dir, step_name, task.phrase_result, cache_key, cache_state, s3_start, on_event)
+                        nonlocal stage
+                        stage = "image"
+                    
+                    task.image_result = await self.image_generator.process_stream(
+                        product,
+                        phrase_stream(),
+                        template,
+                        task_dir,
+                        metadata=metadata,
+                        on_image_complete=on_image_complete
+                    )
+                else:
+                    task.phrase_result = await self.phrase_generator.process(product, task.refined_scene)
+                    await self._complete_phrase_stage(task_dir, step_name, task.phrase_result, cache_key, cache_state, s3_start, on_event)
+            
+            # --- Step 4: 图像生成 (Image Generation) ---
+            # 调用配置的图像生成提供商 (Provider) 执行生图任务 (流式模式下已与 Step 3 一同完成)
+            stage = "image"
+            if task.image_result is None:
+                s4_start = time.time()
+                logger.info(f"Step 4: Generating images with {self.image_generator.provider.provider_name}...")
+                self._emit(on_event, stage, "started", image_count=len(task.phrase_result.phrases))
+                
+                task.image_result = await self.image_generator.process(
+                    product, 
+                    task.phrase_result, 
+                    task_dir, 
+                    metadata=metadata,
+                    on_image_complete=on_image_complete,
+                    reuse_existing=resuming
+                )
             logger.info(f"✅ Step 4 Completed in {time.time() - s4_start:.2f}s. Saved {len(task.image_result.images)} images.")
+            self._emit(on_event, stage, "completed", image_count=len(task.image_result.images), duration=round(time.time() - s4_start, 2))
             
             # 标记任务成功
             task.status = TaskStatus.COMPLETED
@@ -186,7 +467,22 @@ class ProductImagePipeline:
             task.status = TaskStatus.FAILED
             task.error = str(e)
             logger.error(f"❌ [Pipeline Failed] Task {task_id}: {e}")
+            self._emit(on_event, stage, "failed", error=str(e))
             import traceback
             logger.error(traceback.format_exc())
             
         return task
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="从任务输出目录恢复执行流水线 (只执行缺失的步骤与场景图)")
+    parser.add_argument("--resume", type=Path, required=True, help="任务输出目录，如 data/outputs/<目录名>")
+    args = parser.parse_args()
+
+    pipeline = ProductImagePipeline()
+    saved_product = pipeline._load_intermediate(args.resume, PRODUCT_INPUT_STEP, ProductInput)
+    if saved_product is None:
+        raise SystemExit(f"{args.resume} has no intermediates/{PRODUCT_INPUT_STEP}.json, cannot resume")
+    result = asyncio.run(pipeline.run(saved_product, resume_dir=args.resume))
+    if result.status != TaskStatus.COMPLETED:
+        raise SystemExit(f"Pipeline failed: {result.error}")
+    logger.info(f"Resumed pipeline finished with {len(result.image_result.images)} images in {args.resume}")
@@ -1,11 +1,18 @@
+import asyncio
+import glob
+import inspect
 import os
 import PIL.Image
 from pathlib import Path
 from datetime import datetime
+from typing import AsyncIterator, Optional
 from loguru import logger
-from app.schemas import ProductInput, PhraseResult, ImageGenerationResult, GeneratedImage
+from app.schemas import ProductInput, PhraseResult, ScenePhrase, ImageGenerationResult, GeneratedImage
 from app.core.config import settings
+from .image_providers.concurrency import get_provider_concurrency
 from .image_providers.provider_factory import ImageProviderFactory
+from .image_providers.hedging import RequestHedger
+from .image_providers.reference_image import PreparedReference
 
 class ImageGenerator:
     """
@@ -22,10 +29,55 @@ class ImageGenerator:
         )
         logger.info(f"Initialized ImageGenerator with provider: {self.provider.provider_name}, model: {self.provider.model_name}")
 
-    async def process(self, product: ProductInput, phrase_result: PhraseResult, output_dir: Path, metadata: dict = None, on_image_complete: callable = None) -> ImageGenerationResult:
-        logger.info(f"--- [Image Generation Start] ---")
-        logger.info(f"Product Name: {product.name}")
-        
+        # 对冲请求 (可选)：主请求过慢时向另一个服务商发送重复请求
+        self.hedger = None
+        if settings.IMAGE_HEDGING:
+            hedge_provider = ImageProviderFactory.create(settings.IMAGE_HEDGE_PROVIDER) if settings.IMAGE_HEDGE_PROVIDER else None
+            if hedge_provider is None or hedge_provider.provider_name == self.provider.provider_name:
+                # 向同一个服务商重复请求只会加重它的负载 (慢往往正是因为它过载)，不对冲
+                logger.warning(f"IMAGE_HEDGING requires an IMAGE_HEDGE_PROVIDER different from {self.provider.provider_name}, hedging disabled")
+            else:
+                self.hedger = RequestHedger(self.provider, hedge_provider)
+                logger.info(f"Image request hedging enabled: {self.provider.provider_name} -> {hedge_provider.provider_name} (p{settings.IMAGE_HEDGE_QUANTILE * 100:g}, budget {settings.IMAGE_HEDGE_BUDGET:.0%})")
+
+    @staticmethod
+    def _output_stem(scene_no: int, metadata: dict = None) -> str:
+        """
+        场景图文件名 (不含时间戳与扩展名)，同一任务目录中同一场景的文件名前缀固定，便于恢复时识别。
+        """
+        if metadata:
+            # 格式: 商品序号_sceneX_summarizer模型_refiner模型_phrase模型_prompt类型_服务商_生图模型
+            return (
+                f"{metadata['product_id']}_"
+                f"scene{scene_no}_"
+                f"{metadata['summarizer_model']}_"
+                f"{metadata['refiner_model']}_"
+                f"{metadata['phrase_model']}_"
+                f"{metadata['prompt_type']}_"
+                f"{metadata['provider_name']}_"
+                f"{metadata['image_model']}"
+            )
+        return f"generated_{scene_no}"
+
+    @staticmethod
+    def find_existing_image(output_dir: Path, stem: str) -> Optional[Path]:
+        """
+        查找任务目录中已生成的场景图 (取最新的一张可完整解码的图片)，不存在时返回 None。
+        """
+        candidates = sorted(output_dir.glob(f"{glob.escape(stem)}_*.png"), key=lambda p: p.stat().st_mtime, reverse=True)
+        for candidate in candidates:
+            try:
+                with PIL.Image.open(candidate) as img:
+                    img.verify()
+                return candidate
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable image {candidate}: {e}")
+        return None
+
+    async def _prepare_reference(self, product: ProductInput) -> PreparedReference:
+        """
+        加载商品主图作为生图参考图，预处理并交给服务商预编码。
+        """
         # 1. 使用指定的 image 路径作为原始商品图片
         original_image = None
         image_path = Path(product.image) if isinstance(product.image, str) else product.image
@@ -66,58 +118,119 @@ class ImageGenerator:
         
         if not original_image:
             raise Exception(f"No valid original image found for product {product.name} at {image_path_abs}")
+        
+        # 参考图只预处理一次 (归一化 + 限制分辨率)，并预先编码服务商所需格式，所有场景共享
+        try:
+            reference = await asyncio.to_thread(PreparedReference, original_image)
+        finally:
+            original_image.close()
+        await self.provider.prepare_reference(reference)
+        return reference
+
+    async def process(self, product: ProductInput, phrase_result: PhraseResult, output_dir: Path, metadata: dict = None, on_image_complete: callable = None, reuse_existing: bool = False) -> ImageGenerationResult:
+        """
+        并发生成所有场景图。
+        
+        Args:
+            reuse_existing (bool): 恢复任务时为 True，output_dir 中已存在的场景图直接复用，不再调用服务商 (也不触发 on_image_complete)。
+        """
+        async def phrases():
+            for phrase in phrase_result.phrases:
+                yield phrase
+        
+        return await self.process_stream(
+            product, phrases(), phrase_result.positive_prompt_template, output_dir,
+            metadata=metadata, on_image_complete=on_image_complete,
+            reuse_existing=reuse_existing, image_count=len(phrase_result.phrases)
+        )
+
+    async def process_stream(self, product: ProductInput, phrases: AsyncIterator[ScenePhrase], positive_prompt_template: str, output_dir: Path, metadata: dict = None, on_image_complete: callable = None, reuse_existing: bool = False, image_count: int = None) -> ImageGenerationResult:
+        """
+        从异步提示词流中逐个接收场景，每收到一个立即提交生图 (与上游 LLM 继续生成后续场景重叠执行)。
+        参考图的预处理与接收第一个场景并行进行。
+        
+        Args:
+            phrases (AsyncIterator[ScenePhrase]): 场景提示词流
+            positive_prompt_template (str): 提示词模板，"{{}}" 被替换为场景描述
+            image_count (int): 场景总数 (仅用于日志，流式时可能未知)
+        """
+        logger.info(f"--- [Image Generation Start] ---")
+        logger.info(f"Product Name: {product.name}")
+        
+        # 1. 参考图只预处理一次，所有场景共享
+        reference_task = asyncio.create_task(self._prepare_reference(product))
 
         # 2. 确保输出目录存在
         output_dir.mkdir(parents=True, exist_ok=True)
         
-        generated_images = []
         timestamp = datetime.now().strftime("%H%M%S")
         
-        # 3. 遍历短语生成图片
-        image_count = len(phrase_result.phrases)
-        logger.info(f"Generating {image_count} images for product '{product.name}'")
+        # 3. 并发生成所有场景图：本任务同时进行的生图数受此处限制，
+        #    各实际服务商 (故障转移链与 auto 路由的成员、对冲服务商) 的全局并发名额由 BaseImageProvider.generate 控制
+        semaphore = asyncio.Semaphore(get_provider_concurrency(self.provider.provider_name))
+        logger.info(f"Generating {image_count or 'streamed'} images for product '{product.name}' (concurrency: {get_provider_concurrency(self.provider.provider_name)})")
         
-        for i, phrase in enumerate(phrase_result.phrases):
+        async def generate_one(i: int, phrase) -> Optional[GeneratedImage]:
             # 替换提示词模板中的占位符
-            prompt = phrase_result.positive_prompt_template.replace("{{}}", phrase.scene_description)
-            logger.info(f"[{i+1}/{image_count}] Processing scene {phrase.scene_no}...")
+            prompt = positive_prompt_template.replace("{{}}", phrase.scene_description)
             logger.debug(f"Full generation prompt: {prompt}")
             
-            # 构建符合要求的文件名
-            if metadata:
-                # 格式: 商品序号_sceneX_summarizer模型_refiner模型_phrase模型_prompt类型_服务商_生图模型_时间戳.png
-                output_filename = (
-                    f"{metadata['product_id']}_"
-                    f"scene{phrase.scene_no}_"
-                    f"{metadata['summarizer_model']}_"
-                    f"{metadata['refiner_model']}_"
-                    f"{metadata['phrase_model']}_"
-                    f"{metadata['prompt_type']}_"
-                    f"{metadata['provider_name']}_"
-                    f"{metadata['image_model']}_"
-                    f"{timestamp}.png"
-                )
-            else:
-                output_filename = f"generated_{phrase.scene_no}_{timestamp}.png"
+            # 构建符合要求的文件名 (前缀_时间戳.png)
+            stem = self._output_stem(phrase.scene_no, metadata)
+            if reuse_existing:
+                existing = await asyncio.to_thread(self.find_existing_image, output_dir, stem)
+                if existing is not None:
+                    logger.info(f"[{i+1}/{image_count or '?'}] Reusing existing image {phrase.scene_no}: {existing}")
+                    return GeneratedImage(scene_no=phrase.scene_no, image_path=existing, prompt=prompt)
                 
-            output_path = output_dir / output_filename
+            output_path = output_dir / f"{stem}_{timestamp}.png"
+            reference = await reference_task
             
-            logger.info(f"Generating image {phrase.scene_no} using {self.provider.provider_name} ({self.provider.model_name})...")
+            async with semaphore:
+                logger.info(f"[{i+1}/{image_count or '?'}] Generating image {phrase.scene_no} using {self.provider.provider_name} ({self.provider.model_name})...")
+                try:
+                    if self.hedger is not None:
+                        success = await self.hedger.generate(prompt, reference, output_path)
+                    else:
+                        success = await self.provider.generate(prompt, reference, output_path)
+                except Exception as e:
+                    logger.error(f"  > Unexpected error generating image {phrase.scene_no}: {e}")
+                    return None
             
-            try:
-                success = await self.provider.generate_image(prompt, original_image, output_path)
-                
-                if success:
-                    generated_images.append(GeneratedImage(
-                        scene_no=phrase.scene_no,
-                        image_path=output_path,
-                        prompt=prompt
-                    ))
-                    logger.info(f"  > Successfully saved to {output_path}")
-                else:
-                    logger.warning(f"  > Provider failed to generate image {phrase.scene_no}")
-                    
-            except Exception as e:
-                logger.error(f"  > Unexpected error generating image {phrase.scene_no}: {e}")
-
+            if not success:
+                logger.warning(f"  > Provider failed to generate image {phrase.scene_no}")
+                return None
+            
+            generated = GeneratedImage(
+                scene_no=phrase.scene_no,
+                image_path=output_path,
+                prompt=prompt
+            )
+            logger.info(f"  > Successfully saved to {output_path}")
+            
+            # 每张图完成后立即回调，便于上层实时展示进度
+            if on_image_complete:
+                try:
+                    ret = on_image_complete(generated)
+                    if inspect.isawaitable(ret):
+                        await ret
+                except Exception as e:
+                    logger.error(f"  > on_image_complete callback failed for image {phrase.scene_no}: {e}")
+            return generated
+        
+        tasks = []
+        try:
+            async for phrase in phrases:
+                tasks.append(asyncio.create_task(generate_one(len(tasks), phrase)))
+            # 即使没有需要生成的场景 (全部复用)，参考图加载失败也要向上抛出
+            await reference_task
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in [reference_task, *tasks]:
+                task.cancel()
+            await asyncio.gather(reference_task, *tasks, return_exceptions=True)
+            raise
+        
+        # gather 保持提交顺序，结果与场景到达顺序一致
+        generated_images = [img for img in results if img is not None]
         return ImageGenerationResult(images=generated_images)
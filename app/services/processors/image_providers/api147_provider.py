@@ -1,12 +1,12 @@
 import json
 import copy
-import requests
 import base64
-import io
 from pathlib import Path
+from typing import Union
 from PIL import Image
 from loguru import logger
 from .base_provider import BaseImageProvider
+from .reference_image import PreparedReference
 from app.core.config import settings
 
 class Api147Provider(BaseImageProvider):
@@ -20,12 +20,12 @@ class Api147Provider(BaseImageProvider):
         self.base_url = settings.API147_BASE_URL.rstrip('/')
         # 优先使用传入的模型名，否则从配置中读取
         self.model_name = model_name or settings.API147_MODEL
+        self.timeout = settings.API147_TIMEOUT
 
-    async def generate_image(self, prompt: str, original_image: Image.Image, output_path: Path) -> bool:
-        # 将 PIL 图片转换为 base64
-        buffered = io.BytesIO()
-        original_image.save(buffered, format="PNG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+    async def generate_image(self, prompt: str, original_image: Union[Image.Image, PreparedReference], output_path: Path) -> bool:
+        # 参考图在同一任务内只编码一次 (PreparedReference 按格式缓存)
+        reference = PreparedReference.from_image(original_image)
+        image_part = await reference.inline_part_async(self.reference_format)
 
         url = f"{self.base_url}/v1beta/models/{self.model_name}:generateContent"
         
@@ -40,12 +40,7 @@ class Api147Provider(BaseImageProvider):
                 {
                     "role": "user",
                     "parts": [
-                        {
-                            "inlineData": {
-                                "mimeType": "image/png",
-                                "data": img_base64
-                            }
-                        },
+                        image_part,
                         {
                             "text": prompt
                         }
@@ -61,13 +56,11 @@ class Api147Provider(BaseImageProvider):
             logger.info(f"Calling 147api: {url}")
             # 记录请求负载（隐藏 base64 图片数据）
             log_payload = copy.deepcopy(payload)
-            if log_payload["contents"][0]["parts"][1].get("inlineData"):
-                log_payload["contents"][0]["parts"][1]["inlineData"]["data"] = "<BASE64_IMAGE_DATA_TRUNCATED>"
+            if log_payload["contents"][0]["parts"][0].get("inlineData"):
+                log_payload["contents"][0]["parts"][0]["inlineData"]["data"] = "<BASE64_IMAGE_DATA_TRUNCATED>"
             logger.debug(f"Request Payload: {json.dumps(log_payload, ensure_ascii=False, indent=2)}")
             
-            response = requests.post(url, headers=headers, json=payload, timeout=90)
-            response.raise_for_status()
-            data = response.json()
+            data = await self._post_json(url, headers=headers, payload=payload, timeout=self.timeout)
             
             # 记录响应摘要（隐藏 base64 图片数据）
             log_data = copy.deepcopy(data)
@@ -1,23 +1,117 @@
-from abc import ABC, abstractmethod
-from pathlib import Path
-from PIL import Image
-
-class BaseImageProvider(ABC):
-    """
-    图像生成服务商基类，定义统一的生图接口。
-    """
-    def __init__(self):
-        self.provider_name = "unknown"
-        self.model_name = "unknown"
-
-    @abstractmethod
-    async def generate_image(self, prompt: str, original_image: Image.Image, output_path: Path) -> bool:
-        """
-        根据提示词和原始图片生成新图片。
-        
-        :param prompt: 生成提示词
-        :param original_image: 原始 PIL 图片对象
-        :param output_path: 生成图片的保存路径
-        :return: 是否生成成功
-        """
-        pass
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Union
+from PIL import Image
+from app.core.config import settings
+from app.services.metrics import PROVIDER_LATENCY, PROVIDER_REQUESTS
+from app.services import tracing
+from app.services.rate_limiter import call_with_rate_limit, get_provider_rate_limiter, measure_rate_limit_wait
+from .concurrency import get_provider_semaphore
+from .http_transport import get_http_transport
+from .latency_stats import LatencyStats, get_latency_stats
+from .reference_image import PreparedReference
+
+class BaseImageProvider(ABC):
+    """
+    图像生成服务商基类，定义统一的生图接口。
+    """
+    def __init__(self):
+        self.provider_name = "unknown"
+        self.model_name = "unknown"
+        # 所有服务商共享同一个异步连接池
+        self.transport = get_http_transport()
+        # 参考图上传时使用的编码格式 (PNG / JPEG / WEBP)
+        self.reference_format = settings.REFERENCE_IMAGE_FORMAT
+
+    async def prepare_reference(self, reference: PreparedReference) -> None:
+        """
+        预先编码本服务商所需格式的参考图，使同一任务内的并发生图请求直接复用缓存。
+        
+        :param reference: 任务内共享的 PreparedReference
+        """
+        await asyncio.to_thread(reference.get_base64, self.reference_format)
+
+    async def warm_up(self) -> None:
+        """
+        预先建立到服务商的连接 (DNS + TCP + TLS)，使首个任务无需承担冷启动延迟。
+        默认对 base_url 发送一次 HEAD 请求；没有 base_url 的服务商 (如官方 SDK) 不做处理。
+        """
+        base_url = getattr(self, "base_url", None)
+        if base_url:
+            await self.transport.warm_up(base_url)
+
+    async def _post_json(self, url: str, headers: dict, payload: dict, timeout: float = None) -> dict:
+        """
+        经本服务商的共享限流器发送 JSON POST 请求：排队取得令牌，429 时降速并退避重试。
+        参数与返回值同 ProviderHTTPTransport.post_json。
+        """
+        return await call_with_rate_limit(
+            get_provider_rate_limiter(self.provider_name),
+            lambda: self.transport.post_json(url, headers=headers, payload=payload, timeout=timeout)
+        )
+
+    def has_capacity(self) -> bool:
+        """
+        本服务商的并发名额是否未满 (对冲请求据此决定是否发出，不排队等待)。
+        """
+        return not get_provider_semaphore(self.provider_name).locked()
+
+    def latency_stats(self) -> LatencyStats:
+        """
+        用于估算本服务商耗时的统计 (对冲请求据此计算分位数)。
+        """
+        return get_latency_stats(self.provider_name)
+
+    async def generate(self, prompt: str, original_image: Union[Image.Image, PreparedReference], output_path: Path) -> bool:
+        """
+        调用 generate_image 并记录请求耗时与结果 (success / failure / error / cancelled) 指标及 provider.generate_image Span，
+        成功请求的耗时与成功 / 失败结果同时计入 LatencyStats (供对冲请求估算分位数与 auto 路由评分)，
+        被取消的请求已耗费的时间作为耗时下界计入。参数与返回值同 generate_image。
+        记录的耗时不含在限流器中排队与退避重试的等待 (见 measure_rate_limit_wait)，只反映服务商本身的响应速度。
+        同一服务商的并发请求数受 IMAGE_GEN_CONCURRENCY (可按服务商覆盖) 限制，等待名额的时间同样不计入。
+        """
+        async with get_provider_semaphore(self.provider_name):
+            return await self._generate_instrumented(prompt, original_image, output_path)
+
+    async def _generate_instrumented(self, prompt: str, original_image: Union[Image.Image, PreparedReference], output_path: Path) -> bool:
+        start = time.perf_counter()
+        outcome = "error"
+        with measure_rate_limit_wait() as waited:
+            try:
+                with tracing.span("provider.generate_image", provider=self.provider_name, model=self.model_name, output=Path(output_path).name) as span:
+                    success = await self.generate_image(prompt, original_image, output_path)
+                    if waited.seconds:
+                        span.set(rate_limit_wait=round(waited.seconds, 3))
+                    if not success:
+                        span.fail("provider returned failure")
+                outcome = "success" if success else "failure"
+                if success:
+                    get_latency_stats(self.provider_name).record(time.perf_counter() - start - waited.seconds)
+                else:
+                    get_latency_stats(self.provider_name).record_failure()
+                return success
+            except asyncio.CancelledError:
+                # 对冲请求中落败的一方被取消，已耗费的时间作为下界样本，避免最慢的样本被丢弃
+                outcome = "cancelled"
+                get_latency_stats(self.provider_name).record_lower_bound(time.perf_counter() - start - waited.seconds)
+                raise
+            except Exception:
+                get_latency_stats(self.provider_name).record_failure()
+                raise
+            finally:
+                PROVIDER_LATENCY.observe(time.perf_counter() - start - waited.seconds, provider=self.provider_name, model=self.model_name)
+                PROVIDER_REQUESTS.inc(provider=self.provider_name, outcome=outcome)
+
+    @abstractmethod
+    async def generate_image(self, prompt: str, original_image: Union[Image.Image, PreparedReference], output_path: Path) -> bool:
+        """
+        根据提示词和原始图片生成新图片。
+        
+        :param prompt: 生成提示词
+        :param original_image: 原始 PIL 图片对象，或任务内预处理好的 PreparedReference
+        :param output_path: 生成图片的保存路径
+        :return: 是否生成成功
+        """
+        pass
@@ -0,0 +1,155 @@
+import threading
+import time
+from collections import deque
+from typing import Dict, List
+from loguru import logger
+from app.core.config import settings
+from app.services.metrics import registry, PROVIDER_CIRCUIT_STATE
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+# 指标中的状态取值
+_STATE_VALUES = {STATE_CLOSED: 0, STATE_HALF_OPEN: 1, STATE_OPEN: 2}
+
+class CircuitBreaker:
+    """
+    单个生图服务商的熔断器，基于滚动时间窗口内的失败率与慢调用比例。
+
+    - closed: 正常放行。窗口内调用数达到 PROVIDER_BREAKER_MIN_CALLS 且失败率或慢调用比例超过阈值时转为 open。
+    - open: 拒绝调用，PROVIDER_BREAKER_OPEN_SECONDS 后转为 half_open。
+    - half_open: 最多放行 PROVIDER_BREAKER_HALF_OPEN_PROBES 个探测请求，全部成功后恢复 closed (清空窗口)，任一失败重新 open。
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.window_seconds = settings.PROVIDER_BREAKER_WINDOW_SECONDS
+        self.min_calls = max(1, settings.PROVIDER_BREAKER_MIN_CALLS)
+        self.error_rate = settings.PROVIDER_BREAKER_ERROR_RATE
+        self.slow_call_seconds = settings.PROVIDER_BREAKER_SLOW_CALL_SECONDS
+        self.slow_call_rate = settings.PROVIDER_BREAKER_SLOW_CALL_RATE
+        self.open_seconds = settings.PROVIDER_BREAKER_OPEN_SECONDS
+        self.half_open_probes = max(1, settings.PROVIDER_BREAKER_HALF_OPEN_PROBES)
+        # 窗口内的调用记录: (结束时间, 是否成功, 耗时)
+        self._calls: deque = deque()
+        self._state = STATE_CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str) -> None:
+        if state == self._state:
+            return
+        logger.warning(f"Circuit breaker for provider {self.name}: {self._state} -> {state}")
+        self._state = state
+        if state == STATE_OPEN:
+            self._opened_at = time.monotonic()
+        elif state == STATE_CLOSED:
+            self._calls.clear()
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+
+    def _refresh(self) -> None:
+        if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._transition(STATE_HALF_OPEN)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    def allow(self) -> bool:
+        """
+        是否放行一次调用；half_open 状态下放行的调用计为探测请求，调用方必须随后调用 record。
+        """
+        with self._lock:
+            self._refresh()
+            if self._state == STATE_CLOSED:
+                return True
+            if self._state == STATE_HALF_OPEN and self._probes_in_flight < self.half_open_probes - self._probe_successes:
+                self._probes_in_flight += 1
+                return True
+            return False
+
+    def record(self, success: bool, latency: float) -> None:
+        """
+        记录一次调用结果 (失败包括服务商返回失败与抛出异常)。
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._state == STATE_HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if not success:
+                    self._transition(STATE_OPEN)
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_probes:
+                    self._transition(STATE_CLOSED)
+                return
+            if self._state == STATE_OPEN:
+                # 熔断前已放行、熔断后才结束的调用不再计入
+                return
+
+            self._calls.append((now, success, latency))
+            while self._calls and now - self._calls[0][0] > self.window_seconds:
+                self._calls.popleft()
+            total = len(self._calls)
+            if total < self.min_calls:
+                return
+            failures = sum(1 for _, ok, _ in self._calls if not ok)
+            slow = sum(1 for _, _, elapsed in self._calls if elapsed >= self.slow_call_seconds)
+            if failures / total >= self.error_rate or slow / total >= self.slow_call_rate:
+                logger.warning(
+                    f"Provider {self.name} unhealthy: {failures}/{total} failed, {slow}/{total} slower than "
+                    f"{self.slow_call_seconds}s in the last {self.window_seconds}s"
+                )
+                self._transition(STATE_OPEN)
+
+    def release(self) -> None:
+        """
+        放行后未完成的调用 (如任务被取消)：归还半开状态的探测名额，不计入结果。
+        """
+        with self._lock:
+            if self._state == STATE_HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def snapshot(self) -> dict:
+        """
+        当前状态与窗口统计，用于监控。
+        """
+        with self._lock:
+            self._refresh()
+            total = len(self._calls)
+            return {
+                "provider": self.name,
+                "state": self._state,
+                "window_calls": total,
+                "window_failures": sum(1 for _, ok, _ in self._calls if not ok),
+                "window_slow_calls": sum(1 for _, _, elapsed in self._calls if elapsed >= self.slow_call_seconds),
+            }
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(provider_name: str) -> CircuitBreaker:
+    """
+    获取服务商的熔断器 (按服务商名称在进程内共享，同一服务商的不同故障转移链共用健康状态)。
+    """
+    key = provider_name.lower()
+    with _breakers_lock:
+        if key not in _breakers:
+            _breakers[key] = CircuitBreaker(key)
+        return _breakers[key]
+
+def circuit_breaker_snapshots() -> List[dict]:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return [breaker.snapshot() for breaker in breakers]
+
+def collect_circuit_states() -> None:
+    for snapshot in circuit_breaker_snapshots():
+        PROVIDER_CIRCUIT_STATE.set(_STATE_VALUES[snapshot["state"]], provider=snapshot["provider"])
+
+registry.add_collector(collect_circuit_states)
@@ -0,0 +1,39 @@
+import asyncio
+from typing import Dict
+from loguru import logger
+from app.core.config import settings
+
+# 每个实际服务商 (后端) 共享一个信号量，限制同时进行的生图请求数
+_provider_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+def _parse_concurrency_config(config: str) -> Dict[str, int]:
+    """
+    解析 "provider1:count1,provider2:count2" 格式的并发配置。
+    """
+    result = {}
+    try:
+        for item in config.split(","):
+            if ":" in item:
+                name, count = item.split(":")
+                result[name.strip().lower()] = int(count.strip())
+    except Exception as e:
+        logger.warning(f"Failed to parse IMAGE_GEN_CONCURRENCY_CONFIG: {e}. Using default.")
+        return {}
+    return result
+
+def get_provider_concurrency(provider_name: str) -> int:
+    """
+    获取指定服务商允许的最大并发生图数。
+    """
+    overrides = _parse_concurrency_config(settings.IMAGE_GEN_CONCURRENCY_CONFIG)
+    return max(1, overrides.get(provider_name.lower(), settings.IMAGE_GEN_CONCURRENCY))
+
+def get_provider_semaphore(provider_name: str) -> asyncio.Semaphore:
+    """
+    获取指定服务商的并发信号量 (首次调用时按配置创建)。
+    由 BaseImageProvider.generate 按实际服务商获取，故障转移链、auto 路由与对冲请求共用同一后端时共享名额。
+    """
+    key = provider_name.lower()
+    if key not in _provider_semaphores:
+        _provider_semaphores[key] = asyncio.Semaphore(get_provider_concurrency(key))
+    return _provider_semaphores[key]
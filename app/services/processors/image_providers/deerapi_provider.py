@@ -1,10 +1,10 @@
-import requests
 import base64
-import io
 from pathlib import Path
+from typing import Union
 from PIL import Image
 from loguru import logger
 from .base_provider import BaseImageProvider
+from .reference_image import PreparedReference
 from app.core.config import settings
 
 class DeerApiProvider(BaseImageProvider):
@@ -20,12 +20,12 @@ class DeerApiProvider(BaseImageProvider):
         self.base_url = settings.DEERAPI_BASE_URL.rstrip('/')
         # 优先使用传入的模型名，否则从配置中读取
         self.model_name = model_name or settings.DEERAPI_MODEL
+        self.timeout = settings.DEERAPI_TIMEOUT
 
-    async def generate_image(self, prompt: str, original_image: Image.Image, output_path: Path) -> bool:
-        # 将 PIL 图片转换为 base64
-        buffered = io.BytesIO()
-        original_image.save(buffered, format="PNG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+    async def generate_image(self, prompt: str, original_image: Union[Image.Image, PreparedReference], output_path: Path) -> bool:
+        # 参考图在同一任务内只编码一次 (PreparedReference 按格式缓存)
+        reference = PreparedReference.from_image(original_image)
+        image_part = await reference.inline_part_async(self.reference_format, snake_case=True)
 
         # 接口路径：/v1beta/models/{model}:generateContent
         url = f"{self.base_url}/v1beta/models/{self.model_name}:generateContent"
@@ -41,12 +41,7 @@ class DeerApiProvider(BaseImageProvider):
                 {
                     "role": "user",
                     "parts": [
-                        {
-                            "inline_data": {
-                                "mime_type": "image/png",
-                                "data": img_base64
-                            }
-                        },
+                        image_part,
                         {
                             "text": prompt
                         }
@@ -60,9 +55,7 @@ class DeerApiProvider(BaseImageProvider):
 
         try:
             logger.info(f"Calling DeerAPI (Gemini Protocol): {url}")
-            response = requests.post(url, headers=headers, json=payload, timeout=120)
-            response.raise_for_status()
-            data = response.json()
+            data = await self._post_json(url, headers=headers, payload=payload, timeout=self.timeout)
             
             image_saved = False
             # 解析响应，文档显示图像数据在 candidates[0].content.parts 的 inline_data 中
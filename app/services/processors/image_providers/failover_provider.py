@@ -0,0 +1,104 @@
+import asyncio
+import time
+from pathlib import Path
+from typing import List, Union
+from PIL import Image
+from loguru import logger
+from app.services import tracing
+from app.services.metrics import PROVIDER_FAILOVERS
+from app.services.rate_limiter import measure_rate_limit_wait
+from .base_provider import BaseImageProvider
+from .circuit_breaker import get_circuit_breaker
+from .latency_stats import LatencyStats
+from .reference_image import PreparedReference
+
+class FailoverProvider(BaseImageProvider):
+    """
+    按顺序组成的故障转移链 (如 grsai → deerapi → gemini)，对外表现为一个普通服务商。
+
+    每次生图依次尝试链上的服务商，跳过熔断器处于 open 状态的成员；某个成员返回失败或抛出异常时
+    记入其熔断器并转交下一个成员。所有成员都被熔断时仍尝试第一个成员，避免整条链不可用。
+    """
+    def __init__(self, members: List[BaseImageProvider]):
+        super().__init__()
+        if not members:
+            raise ValueError("FailoverProvider needs at least one member provider")
+        self.members = members
+        self.provider_name = "+".join(member.provider_name for member in members)
+        # 模型名与主服务商一致 (用于输出目录命名)，实际生成的服务商记录在链路的 served_by 属性中
+        self.model_name = members[0].model_name
+        self.reference_format = members[0].reference_format
+
+    async def prepare_reference(self, reference: PreparedReference) -> None:
+        # 只为主服务商预编码，转移到其它成员时由其按需编码 (PreparedReference 按格式缓存)
+        await self.members[0].prepare_reference(reference)
+
+    async def warm_up(self) -> None:
+        await asyncio.gather(*[member.warm_up() for member in self.members], return_exceptions=True)
+
+    def has_capacity(self) -> bool:
+        # 链本身不占并发名额，任一成员有空闲名额即可
+        return any(member.has_capacity() for member in self.members)
+
+    def latency_stats(self) -> LatencyStats:
+        # 链本身不记录统计，按通常承接请求的主服务商估算
+        return self.members[0].latency_stats()
+
+    async def generate(self, prompt: str, original_image: Union[Image.Image, PreparedReference], output_path: Path) -> bool:
+        """
+        只记录 provider.generate_image Span (实际服务商记为 served_by 属性)。
+        并发名额、耗时、结果指标与 LatencyStats 由被调用的成员各自占用和记录，链本身不再处理，避免一次请求被计入两次。
+        """
+        with tracing.span("provider.generate_image", provider=self.provider_name, model=self.model_name, output=Path(output_path).name) as span:
+            success = await self.generate_image(prompt, original_image, output_path)
+            if not success:
+                span.fail("provider returned failure")
+            return success
+
+    async def _attempt(self, member: BaseImageProvider, prompt: str, original_image, output_path: Path) -> bool:
+        breaker = get_circuit_breaker(member.provider_name)
+        start = time.perf_counter()
+        # 熔断器的慢调用判断与 BaseImageProvider.generate 一样扣除限流器排队与退避等待，只被本地限流的服务商不会被误判为慢
+        with measure_rate_limit_wait() as waited:
+            try:
+                success = await member.generate(prompt, original_image, output_path)
+            except asyncio.CancelledError:
+                breaker.release()
+                raise
+            except Exception as e:
+                logger.error(f"Provider {member.provider_name} raised during generation: {e}")
+                success = False
+        breaker.record(success, time.perf_counter() - start - waited.seconds)
+        if success:
+            tracing.current_span().set(served_by=member.provider_name)
+        return success
+
+    def _candidates(self) -> List[BaseImageProvider]:
+        """
+        本次生图尝试成员的顺序，故障转移链固定为配置顺序。
+        """
+        return self.members
+
+    async def generate_image(self, prompt: str, original_image: Union[Image.Image, PreparedReference], output_path: Path) -> bool:
+        candidates = self._candidates()
+        previous = None
+        for member in candidates:
+            # 逐个判断，避免为用不到的成员占用半开状态的探测名额
+            if not get_circuit_breaker(member.provider_name).allow():
+                continue
+            if previous is not None:
+                logger.warning(f"Failing over from {previous.provider_name} to {member.provider_name} for {output_path.name}")
+                PROVIDER_FAILOVERS.inc(source=previous.provider_name, target=member.provider_name)
+            if await self._attempt(member, prompt, original_image, output_path):
+                return True
+            previous = member
+        if previous is None:
+            logger.warning(f"All providers in failover chain {self.provider_name} are open, trying {candidates[0].provider_name} anyway")
+            return await self._attempt(candidates[0], prompt, original_image, output_path)
+        return False
+
+    def health(self) -> List[dict]:
+        """
+        链上各成员的熔断器状态 (按故障转移顺序)。
+        """
+        return [get_circuit_breaker(member.provider_name).snapshot() for member in self.members]
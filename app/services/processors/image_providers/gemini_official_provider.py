@@ -1,15 +1,28 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import google.generativeai as genai
 from pathlib import Path
+from typing import Union
 from PIL import Image
 from loguru import logger
+from app.services.rate_limiter import call_with_rate_limit, get_provider_rate_limiter
 from .base_provider import BaseImageProvider
+from .reference_image import PreparedReference
 from app.core.config import settings
 
+# 官方 SDK 的 generate_content 是同步阻塞调用，统一放到专用线程池执行，避免阻塞事件循环
+_sdk_executor = ThreadPoolExecutor(
+    max_workers=settings.GEMINI_EXECUTOR_WORKERS,
+    thread_name_prefix="gemini-sdk"
+)
+
 class GeminiOfficialProvider(BaseImageProvider):
     """
     Google Gemini 官方 API 提供商。
     """
     def __init__(self, model_name: str = None):
+        super().__init__()
+        self.provider_name = "gemini"
         self.api_key = settings.GEMINI_API_KEY
         genai.configure(api_key=self.api_key)
         # 优先使用传入的模型名，否则从配置中读取
@@ -20,14 +33,28 @@ class GeminiOfficialProvider(BaseImageProvider):
             logger.error(f"Failed to initialize Gemini Official model: {e}")
             self.model = None
 
-    async def generate_image(self, prompt: str, original_image: Image.Image, output_path: Path) -> bool:
+    async def prepare_reference(self, reference: PreparedReference) -> None:
+        # 官方 SDK 直接接收 PIL 图片，无需预先编码
+        pass
+
+    async def generate_image(self, prompt: str, original_image: Union[Image.Image, PreparedReference], output_path: Path) -> bool:
         if not self.model:
             logger.error("Gemini Official model is not initialized.")
             return False
             
         try:
-            # 官方 SDK 调用
-            response = self.model.generate_content([prompt, original_image])
+            # 官方 SDK 直接接收 PIL 图片，使用预处理后 (已限制分辨率) 的版本
+            reference = PreparedReference.from_image(original_image)
+            # 官方 SDK 调用 (在专用线程池中执行)，配额耗尽 (ResourceExhausted) 时由限流器降速重试
+            loop = asyncio.get_running_loop()
+            response = await call_with_rate_limit(
+                get_provider_rate_limiter(self.provider_name),
+                lambda: loop.run_in_executor(
+                    _sdk_executor,
+                    self.model.generate_content,
+                    [prompt, reference.image]
+                )
+            )
             
             if response.candidates and response.candidates[0].content.parts:
                 for part in response.candidates[0].content.parts:
@@ -1,10 +1,10 @@
-import requests
 import base64
-import io
 from pathlib import Path
+from typing import Union
 from PIL import Image
 from loguru import logger
 from .base_provider import BaseImageProvider
+from .reference_image import PreparedReference
 from app.core.config import settings
 
 class GrsaiProvider(BaseImageProvider):
@@ -18,12 +18,12 @@ class GrsaiProvider(BaseImageProvider):
         self.base_url = settings.GRSAI_BASE_URL.rstrip('/')
         # 优先使用传入的模型名，否则从配置中读取
         self.model_name = model_name or settings.GRSAI_MODEL
+        self.timeout = settings.GRSAI_TIMEOUT
 
-    async def generate_image(self, prompt: str, original_image: Image.Image, output_path: Path) -> bool:
-        # 将 PIL 图片转换为 base64
-        buffered = io.BytesIO()
-        original_image.save(buffered, format="PNG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+    async def generate_image(self, prompt: str, original_image: Union[Image.Image, PreparedReference], output_path: Path) -> bool:
+        # 参考图在同一任务内只编码一次 (PreparedReference 按格式缓存)
+        reference = PreparedReference.from_image(original_image)
+        image_part = await reference.inline_part_async(self.reference_format)
 
         # 根据用户示例，使用 v1beta 接口
         # 提示：如果 :generateContent 不支持，可以尝试 :streamGenerateContent
@@ -40,12 +40,7 @@ class GrsaiProvider(BaseImageProvider):
                 {
                     "role": "user",
                     "parts": [
-                        {
-                            "inlineData": {
-                                "mimeType": "image/png",
-                                "data": img_base64
-                            }
-                        },
+                        image_part,
                         {
                             "text": prompt
                         }
@@ -59,9 +54,7 @@ class GrsaiProvider(BaseImageProvider):
 
         try:
             logger.info(f"Calling Grsai: {url}")
-            response = requests.post(url, headers=headers, json=payload, timeout=90)
-            response.raise_for_status()
-            data = response.json()
+            data = await self._post_json(url, headers=headers, payload=payload, timeout=self.timeout)
             
             image_saved = False
             # 解析 Gemini 响应格式
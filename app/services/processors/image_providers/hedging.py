@@ -0,0 +1,147 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Optional, Union
+from PIL import Image
+from loguru import logger
+from app.core.config import settings
+from app.services import tracing
+from app.services.metrics import IMAGE_HEDGES, IMAGE_HEDGE_RATE
+from .base_provider import BaseImageProvider
+from .reference_image import PreparedReference
+
+class HedgeBudget:
+    """
+    对冲预算：滚动窗口内对冲请求数不超过全部请求数的 ratio 倍。
+    """
+    def __init__(self, ratio: float, window_seconds: float):
+        self.ratio = ratio
+        self.window_seconds = window_seconds
+        self._requests: deque = deque()
+        self._hedges: deque = deque()
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float) -> None:
+        for timestamps in (self._requests, self._hedges):
+            while timestamps and now - timestamps[0] > self.window_seconds:
+                timestamps.popleft()
+
+    def record_request(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            self._requests.append(now)
+
+    def try_acquire(self) -> bool:
+        """
+        预算允许时占用一次对冲名额并返回 True。
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            if len(self._hedges) + 1 > self.ratio * len(self._requests):
+                return False
+            self._hedges.append(now)
+            return True
+
+    def rate(self) -> float:
+        with self._lock:
+            self._prune(time.monotonic())
+            return len(self._hedges) / len(self._requests) if self._requests else 0.0
+
+class RequestHedger:
+    """
+    场景图对冲请求：主请求超过主服务商观测的 IMAGE_HEDGE_QUANTILE 分位耗时 (不含限流等待) 仍未完成时，
+    向对冲服务商发送一次重复请求，采用先成功的结果并取消另一方。
+
+    - 主服务商成功样本少于 IMAGE_HEDGE_MIN_SAMPLES 时不对冲。
+    - 对冲比例受 HedgeBudget 限制；对冲服务商的并发名额已满时也不对冲 (不排队等待，见 has_capacity)。
+    - 可能对冲时主请求与对冲请求分别写入临时文件 (.primary.part / .hedge.part)，只有胜出一方被替换为正式输出路径，
+      避免两路请求写同一个文件。
+    """
+    def __init__(self, primary: BaseImageProvider, hedge: BaseImageProvider):
+        self.primary = primary
+        self.hedge = hedge
+        self.quantile = settings.IMAGE_HEDGE_QUANTILE
+        self.min_samples = settings.IMAGE_HEDGE_MIN_SAMPLES
+        self.budget = HedgeBudget(settings.IMAGE_HEDGE_BUDGET, settings.IMAGE_HEDGE_BUDGET_WINDOW_SECONDS)
+
+    def hedge_delay(self) -> Optional[float]:
+        """
+        当前的对冲等待时间 (主服务商耗时分位数)，样本不足时为 None。
+        """
+        return self.primary.latency_stats().quantile(self.quantile, self.min_samples)
+
+    async def _run_hedge(self, prompt: str, original_image, hedge_path: Path, delay: float) -> bool:
+        with tracing.span("image.hedge", provider=self.hedge.provider_name, delay=round(delay, 2)):
+            return await self.hedge.generate(prompt, original_image, hedge_path)
+
+    async def generate(self, prompt: str, original_image: Union[Image.Image, PreparedReference], output_path: Path) -> bool:
+        """
+        参数与返回值同 BaseImageProvider.generate。
+        """
+        self.budget.record_request()
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self.primary.generate(prompt, original_image, output_path)
+
+        # 两路请求各写一个临时文件，只有胜出一方的文件被替换为正式输出。
+        # 被取消的一方可能仍在线程池中执行 (如 Gemini SDK 调用)，稍后写完也只会留下 .part 文件，不会覆盖正式输出。
+        primary_path = output_path.with_name(f"{output_path.stem}.primary.part")
+        hedge_path = output_path.with_name(f"{output_path.stem}.hedge.part")
+        primary = asyncio.create_task(self.primary.generate(prompt, original_image, primary_path))
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if not done:
+                if not self.hedge.has_capacity():
+                    IMAGE_HEDGES.inc(outcome="no_capacity")
+                elif not self.budget.try_acquire():
+                    IMAGE_HEDGES.inc(outcome="budget_exhausted")
+                else:
+                    IMAGE_HEDGES.inc(outcome="issued")
+                    IMAGE_HEDGE_RATE.set(self.budget.rate())
+                    logger.info(f"Hedging {output_path.name} on {self.hedge.provider_name} after {delay:.1f}s")
+                    hedge = asyncio.create_task(self._run_hedge(prompt, original_image, hedge_path, delay))
+
+            if hedge is None:
+                if not await primary:
+                    return False
+                await asyncio.to_thread(os.replace, primary_path, output_path)
+                return True
+
+            # 任一方成功即采用；一方失败时继续等待另一方
+            pending = {primary, hedge}
+            winner = None
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in done if not task.cancelled() and task.exception() is None and task.result()), None)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+            if winner is None:
+                IMAGE_HEDGES.inc(outcome="failed")
+                if primary.exception() is not None:
+                    raise primary.exception()
+                return False
+            if winner is hedge:
+                await asyncio.to_thread(os.replace, hedge_path, output_path)
+                IMAGE_HEDGES.inc(outcome="won")
+                logger.info(f"Hedged request on {self.hedge.provider_name} won for {output_path.name}")
+            else:
+                await asyncio.to_thread(os.replace, primary_path, output_path)
+                IMAGE_HEDGES.inc(outcome="lost")
+            return True
+        except BaseException:
+            for task in (primary, hedge):
+                if task is not None:
+                    task.cancel()
+            await asyncio.gather(*[task for task in (primary, hedge) if task is not None], return_exceptions=True)
+            raise
+        finally:
+            for path in (primary_path, hedge_path):
+                path.unlink(missing_ok=True)
@@ -0,0 +1,85 @@
+import asyncio
+import importlib.util
+import time
+from typing import Dict
+import httpx
+from loguru import logger
+from app.core.config import settings
+
+class ProviderHTTPTransport:
+    """
+    生图服务商共享的异步 HTTP 传输层。
+
+    - 基于 httpx.AsyncClient，keep-alive 连接池在所有服务商之间复用，避免每张图重新握手。
+    - 安装了 h2 时自动启用 HTTP/2。
+    - 按域名限制并发连接数，防止单个服务商占满连接池。
+    """
+    def __init__(self):
+        self.http2 = settings.PROVIDER_HTTP2 and importlib.util.find_spec("h2") is not None
+        self.max_connections_per_host = max(1, settings.PROVIDER_MAX_CONNECTIONS_PER_HOST)
+        self.client = httpx.AsyncClient(
+            http2=self.http2,
+            timeout=httpx.Timeout(settings.PROVIDER_DEFAULT_TIMEOUT, connect=settings.PROVIDER_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=settings.PROVIDER_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.PROVIDER_MAX_CONNECTIONS,
+                keepalive_expiry=settings.PROVIDER_KEEPALIVE_EXPIRY
+            )
+        )
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = httpx.URL(url).host
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.max_connections_per_host)
+        return self._host_semaphores[host]
+
+    async def post_json(self, url: str, headers: dict, payload: dict, timeout: float = None) -> dict:
+        """
+        发送 JSON POST 请求并返回解析后的 JSON 响应。
+
+        :param url: 请求地址
+        :param headers: 请求头
+        :param payload: JSON 请求体
+        :param timeout: 本次请求的读超时 (秒)，为空时使用 PROVIDER_DEFAULT_TIMEOUT
+        :raises httpx.HTTPStatusError: 响应状态码非 2xx
+        """
+        request_timeout = httpx.Timeout(
+            timeout or settings.PROVIDER_DEFAULT_TIMEOUT,
+            connect=settings.PROVIDER_CONNECT_TIMEOUT
+        )
+        async with self._host_semaphore(url):
+            response = await self.client.post(url, headers=headers, json=payload, timeout=request_timeout)
+        response.raise_for_status()
+        return response.json()
+
+    async def warm_up(self, url: str) -> bool:
+        """
+        对 url 发送一次 HEAD 请求以建立 keep-alive 连接，失败时只记录警告。
+
+        :return: 是否成功建立连接 (任意 HTTP 状态码都视为成功)
+        """
+        start = time.perf_counter()
+        try:
+            async with self._host_semaphore(url):
+                await self.client.head(url, timeout=httpx.Timeout(settings.PROVIDER_CONNECT_TIMEOUT))
+        except httpx.HTTPError as e:
+            logger.warning(f"Failed to warm up connection to {url}: {e}")
+            return False
+        logger.info(f"Warmed up connection to {httpx.URL(url).host} in {time.perf_counter() - start:.2f}s")
+        return True
+
+    async def aclose(self):
+        await self.client.aclose()
+
+_transport: ProviderHTTPTransport = None
+
+def get_http_transport() -> ProviderHTTPTransport:
+    """
+    获取进程内共享的 ProviderHTTPTransport 实例 (首次调用时创建)。
+    """
+    global _transport
+    if _transport is None:
+        _transport = ProviderHTTPTransport()
+        logger.info(f"Initialized provider HTTP transport (http2={_transport.http2}, per-host limit={_transport.max_connections_per_host})")
+    return _transport
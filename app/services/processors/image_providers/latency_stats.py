@@ -0,0 +1,105 @@
+import math
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+from app.core.config import settings
+from app.services.metrics import registry, PROVIDER_EWMA_LATENCY, PROVIDER_SUCCESS_RATE
+
+class LatencyStats:
+    """
+    单个服务商的实时表现：最近 PROVIDER_LATENCY_WINDOW 次成功生图的耗时样本 (用于估算分位数)，
+    以及成功耗时与成功率的 EWMA (平滑系数 PROVIDER_EWMA_ALPHA，用于 auto 路由)。
+    失败请求只计入成功率，不影响耗时 (快速失败不应让服务商显得更快)。
+    """
+    def __init__(self, name: str, window: int = None):
+        self.name = name
+        self._samples: deque = deque(maxlen=max(1, window or settings.PROVIDER_LATENCY_WINDOW))
+        self.alpha = min(1.0, max(0.0, settings.PROVIDER_EWMA_ALPHA))
+        self.ewma_latency: Optional[float] = None
+        # 没有观测时按全部成功处理
+        self.ewma_success = 1.0
+        self.observations = 0
+        self._lock = threading.Lock()
+
+    def _observe(self, success: bool) -> None:
+        self.observations += 1
+        self.ewma_success += self.alpha * ((1.0 if success else 0.0) - self.ewma_success)
+
+    def _add_latency(self, latency: float) -> None:
+        self._samples.append(latency)
+        if self.ewma_latency is None:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency += self.alpha * (latency - self.ewma_latency)
+
+    def record(self, latency: float) -> None:
+        """
+        记录一次成功生图的耗时。
+        """
+        with self._lock:
+            self._add_latency(latency)
+            self._observe(True)
+
+    def record_lower_bound(self, latency: float) -> None:
+        """
+        记录一次被取消的请求 (如对冲中落败的主请求) 已耗费的时间，作为其耗时的下界样本。
+        这些恰好是最慢的请求，丢弃它们会使分位数越估越低、对冲越来越频繁；不计入成功率。
+        """
+        with self._lock:
+            self._add_latency(latency)
+
+    def record_failure(self) -> None:
+        """
+        记录一次失败 (服务商返回失败或抛出异常)。
+        """
+        with self._lock:
+            self._observe(False)
+
+    def count(self) -> int:
+        return len(self._samples)
+
+    def quantile(self, q: float, min_samples: int = 1) -> Optional[float]:
+        """
+        返回 q 分位数 (最近秩法)，样本数少于 min_samples 时返回 None。
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples or len(samples) < min_samples:
+            return None
+        index = min(len(samples) - 1, max(0, math.ceil(q * len(samples)) - 1))
+        return samples[index]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "provider": self.name,
+                "ewma_latency": round(self.ewma_latency, 3) if self.ewma_latency is not None else None,
+                "ewma_success": round(self.ewma_success, 3),
+                "observations": self.observations,
+            }
+
+_stats: Dict[str, LatencyStats] = {}
+_stats_lock = threading.Lock()
+
+def get_latency_stats(provider_name: str) -> LatencyStats:
+    """
+    获取服务商的耗时统计 (按服务商名称在进程内共享，由 BaseImageProvider.generate 记录)。
+    """
+    key = provider_name.lower()
+    with _stats_lock:
+        if key not in _stats:
+            _stats[key] = LatencyStats(key)
+        return _stats[key]
+
+def latency_stats_snapshots() -> List[dict]:
+    with _stats_lock:
+        stats = list(_stats.values())
+    return [s.snapshot() for s in stats]
+
+def collect_latency_stats() -> None:
+    for snapshot in latency_stats_snapshots():
+        if snapshot["ewma_latency"] is not None:
+            PROVIDER_EWMA_LATENCY.set(snapshot["ewma_latency"], provider=snapshot["provider"])
+        PROVIDER_SUCCESS_RATE.set(snapshot["ewma_success"], provider=snapshot["provider"])
+
+registry.add_collector(collect_latency_stats)
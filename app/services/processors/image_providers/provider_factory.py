@@ -1,36 +1,114 @@
-from typing import Dict, Type
+import threading
+from typing import Dict, List, Tuple, Type
+from loguru import logger
 from .base_provider import BaseImageProvider
 from .gemini_official_provider import GeminiOfficialProvider
 from .grsai_provider import GrsaiProvider
 from .api147_provider import Api147Provider
 from .deerapi_provider import DeerApiProvider
+from .failover_provider import FailoverProvider
+from .routing_provider import RoutingProvider
 from app.core.config import settings
 
 class ImageProviderFactory:
     """
     图像提供商工厂类，负责根据配置创建具体的提供商实例。
+
+    默认返回进程内共享的实例：同一 (服务商, 模型) 只构建一次，
+    WHITE_BG_PROVIDER 与 SCENE_GEN_PROVIDER 解析为相同组合时共用同一个实例。
+
+    服务商名称为逗号分隔的列表 (如 grsai,deerapi,gemini) 时构建 FailoverProvider 故障转移链：
+    指定的模型只用于第一个服务商，其余成员使用各自的默认模型；成员同样是共享实例。
+
+    虚拟服务商 auto 构建 RoutingProvider，按实时耗时与成功率在 IMAGE_ROUTER_PROVIDERS 之间选择，
+    成员使用各自的默认模型。
     """
+    ROUTER_NAME = "auto"
     _providers: Dict[str, Type[BaseImageProvider]] = {
         "gemini": GeminiOfficialProvider,
         "grsai": GrsaiProvider,
         "147api": Api147Provider,
         "deerapi": DeerApiProvider
     }
+    # 各服务商未指定模型时使用的默认模型配置项
+    _default_model_settings: Dict[str, str] = {
+        "gemini": "GEMINI_MODEL",
+        "grsai": "GRSAI_MODEL",
+        "147api": "API147_MODEL",
+        "deerapi": "DEERAPI_MODEL"
+    }
+    _instances: Dict[Tuple[str, str], BaseImageProvider] = {}
+    _lock = threading.Lock()
 
     @classmethod
-    def create(cls, provider_name: str = None, model_name: str = None) -> BaseImageProvider:
+    def create(cls, provider_name: str = None, model_name: str = None, shared: bool = True) -> BaseImageProvider:
         """
         创建一个提供商实例。
         
-        :param provider_name: 提供商名称（如 gemini, grsai, 147api, deerapi）
+        :param provider_name: 提供商名称（如 gemini, grsai, 147api, deerapi），逗号分隔时为故障转移链，auto 时按实时表现路由
         :param model_name: 模型名称 (可选)
+        :param shared: 是否返回共享实例 (默认)；为 False 时总是新建
         :return: BaseImageProvider 的实例
         """
         # 优先从参数获取，否则从 settings 获取
         name = provider_name or settings.IMAGE_PROVIDER
+        if name.strip().lower() == cls.ROUTER_NAME:
+            return cls._create_router(model_name, shared)
+        chain = list(dict.fromkeys(n.strip().lower() for n in name.split(",") if n.strip()))
+        if len(chain) > 1:
+            return cls._create_chain(chain, model_name, shared)
+        name = chain[0] if chain else name
         provider_cls = cls._providers.get(name.lower())
         
         if not provider_cls:
             raise ValueError(f"Unknown image provider: {name}. Available: {list(cls._providers.keys())}")
         
-        return provider_cls(model_name=model_name)
+        if not shared:
+            return provider_cls(model_name=model_name)
+
+        # 按解析后的模型名作为键，显式指定默认模型与不指定时命中同一个实例
+        key = (name.lower(), model_name or getattr(settings, cls._default_model_settings[name.lower()]))
+        with cls._lock:
+            if key not in cls._instances:
+                cls._instances[key] = provider_cls(model_name=key[1])
+                logger.info(f"Created shared image provider: {key[0]} / {key[1]}")
+            return cls._instances[key]
+
+    @classmethod
+    def _create_chain(cls, names: List[str], model_name: str, shared: bool) -> FailoverProvider:
+        members = [cls.create(names[0], model_name, shared)] + [cls.create(n, shared=shared) for n in names[1:]]
+        if not shared:
+            return FailoverProvider(members)
+
+        key = ("+".join(names), members[0].model_name)
+        with cls._lock:
+            if key not in cls._instances:
+                cls._instances[key] = FailoverProvider(members)
+                logger.info(f"Created shared failover chain: {' -> '.join(names)} ({key[1]})")
+            return cls._instances[key]
+
+    @classmethod
+    def _create_router(cls, model_name: str, shared: bool) -> RoutingProvider:
+        if model_name:
+            logger.warning(f"Ignoring model {model_name} for provider {cls.ROUTER_NAME}: each routed provider uses its default model")
+        names = list(dict.fromkeys(n.strip().lower() for n in settings.IMAGE_ROUTER_PROVIDERS.split(",") if n.strip()))
+        if cls.ROUTER_NAME in names:
+            raise ValueError(f"IMAGE_ROUTER_PROVIDERS must not contain {cls.ROUTER_NAME}")
+        members = [cls.create(n, shared=shared) for n in names]
+        if not shared:
+            return RoutingProvider(members)
+
+        key = (cls.ROUTER_NAME, "+".join(names))
+        with cls._lock:
+            if key not in cls._instances:
+                cls._instances[key] = RoutingProvider(members)
+                logger.info(f"Created shared latency-aware router over {', '.join(names)}")
+            return cls._instances[key]
+
+    @classmethod
+    def shared_instances(cls) -> List[BaseImageProvider]:
+        """
+        返回当前已创建的全部共享实例。
+        """
+        with cls._lock:
+            return list(cls._instances.values())
@@ -0,0 +1,103 @@
+import asyncio
+import base64
+import io
+import threading
+from typing import Dict, Tuple, Union
+from PIL import Image, ImageOps
+from loguru import logger
+from app.core.config import settings
+
+_MIME_TYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+}
+
+class PreparedReference:
+    """
+    预处理后的参考图 (商品主图)。
+
+    由 ImageGenerator / WhiteBGGenerator 在每个任务开始时构建一次：
+    - 归一化方向与色彩模式，长边限制在 REFERENCE_IMAGE_MAX_SIDE 以内。
+    - 按编码格式 (PNG / JPEG / WEBP) 缓存 base64 结果，按字段风格 (inlineData / inline_data) 缓存请求片段，
+      同一任务内的多次生图调用不再重复编码。
+    """
+    def __init__(self, image: Image.Image, max_side: int = None):
+        max_side = max_side or settings.REFERENCE_IMAGE_MAX_SIDE
+        original_size = image.size
+
+        # exif_transpose 总是返回新图片，不会修改调用方传入的对象
+        img = ImageOps.exif_transpose(image)
+        # 保留透明通道 (PNG / WEBP 可用)，其余模式统一转为 RGB
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+        if max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        self.image = img
+        self._encoded: Dict[str, str] = {}
+        self._parts: Dict[Tuple[str, bool], dict] = {}
+        self._lock = threading.Lock()
+        logger.debug(f"Prepared reference image: {original_size} -> {self.image.size} ({self.image.mode})")
+
+    @classmethod
+    def from_image(cls, image: Union[Image.Image, "PreparedReference"]) -> "PreparedReference":
+        """
+        兼容旧接口：已经是 PreparedReference 时直接返回，否则基于 PIL 图片构建。
+        """
+        if isinstance(image, PreparedReference):
+            return image
+        return cls(image)
+
+    @staticmethod
+    def mime_type(fmt: str) -> str:
+        return _MIME_TYPES[fmt.upper()]
+
+    def get_base64(self, fmt: str = "PNG") -> str:
+        """
+        获取指定格式的 base64 编码 (首次调用时编码并缓存，线程安全)。
+        """
+        fmt = fmt.upper()
+        if fmt not in _MIME_TYPES:
+            raise ValueError(f"Unsupported reference image format: {fmt}. Available: {list(_MIME_TYPES.keys())}")
+
+        with self._lock:
+            if fmt not in self._encoded:
+                img = self.image
+                save_kwargs = {}
+                if fmt == "JPEG":
+                    img = img.convert("RGB")
+                    save_kwargs["quality"] = settings.REFERENCE_IMAGE_QUALITY
+                elif fmt == "WEBP":
+                    save_kwargs["quality"] = settings.REFERENCE_IMAGE_QUALITY
+                buffered = io.BytesIO()
+                img.save(buffered, format=fmt, **save_kwargs)
+                self._encoded[fmt] = base64.b64encode(buffered.getvalue()).decode('utf-8')
+                logger.debug(f"Encoded reference image as {fmt}: {len(self._encoded[fmt])} base64 chars")
+            return self._encoded[fmt]
+
+    def inline_part(self, fmt: str = "PNG", snake_case: bool = False) -> dict:
+        """
+        获取 Gemini 协议的图片请求片段。
+
+        :param fmt: 编码格式 (PNG / JPEG / WEBP)
+        :param snake_case: True 返回 {"inline_data": {"mime_type", "data"}} (DeerAPI)，
+                           False 返回 {"inlineData": {"mimeType", "data"}}
+        """
+        key = (fmt.upper(), snake_case)
+        if key not in self._parts:
+            data = self.get_base64(fmt)
+            if snake_case:
+                part = {"inline_data": {"mime_type": self.mime_type(fmt), "data": data}}
+            else:
+                part = {"inlineData": {"mimeType": self.mime_type(fmt), "data": data}}
+            self._parts[key] = part
+        return self._parts[key]
+
+    async def inline_part_async(self, fmt: str = "PNG", snake_case: bool = False) -> dict:
+        """
+        inline_part 的异步版本，首次编码放到线程中执行，避免阻塞事件循环。
+        """
+        if (fmt.upper(), snake_case) in self._parts:
+            return self._parts[(fmt.upper(), snake_case)]
+        return await asyncio.to_thread(self.inline_part, fmt, snake_case)
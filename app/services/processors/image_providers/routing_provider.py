@@ -0,0 +1,94 @@
+import random
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List
+from app.core.config import settings
+from app.services import tracing
+from app.services.metrics import IMAGE_ROUTER_SELECTIONS
+from .base_provider import BaseImageProvider
+from .circuit_breaker import STATE_OPEN, get_circuit_breaker
+from .failover_provider import FailoverProvider
+from .latency_stats import LatencyStats, get_latency_stats
+
+class RoutingProvider(FailoverProvider):
+    """
+    按实时表现选择服务商的虚拟服务商 (名称 auto)，成员为 IMAGE_ROUTER_PROVIDERS。
+
+    每次生图按评分从低到高排列成员，评分 = IMAGE_ROUTER_LATENCY_WEIGHT × (EWMA 耗时 / 最快成员的 EWMA 耗时)
+    + IMAGE_ROUTER_FAILURE_WEIGHT × (1 - EWMA 成功率)，统计来自各成员共享的 LatencyStats。
+    - 观测数 (含进行中的请求) 少于 IMAGE_ROUTER_MIN_SAMPLES 的成员排在最前，先积累样本。
+    - 以 IMAGE_ROUTER_EXPLORE_RATE 的概率把一个非最优成员提到最前，使落后成员的统计保持更新。
+    - 熔断中的成员排在最后；排好的顺序按故障转移链处理，失败时转交下一个成员。
+    """
+    def __init__(self, members: List[BaseImageProvider]):
+        super().__init__(members)
+        self.provider_name = "auto"
+        # 各成员的模型名可能不同，输出目录中统一记为 auto，实际服务商记录在链路的 served_by 属性中
+        self.model_name = "auto"
+        self.latency_weight = settings.IMAGE_ROUTER_LATENCY_WEIGHT
+        self.failure_weight = settings.IMAGE_ROUTER_FAILURE_WEIGHT
+        self.min_samples = max(0, settings.IMAGE_ROUTER_MIN_SAMPLES)
+        self.explore_rate = settings.IMAGE_ROUTER_EXPLORE_RATE
+        # 各成员经本路由发出、尚未结束的请求数
+        self._in_flight: Dict[str, int] = defaultdict(int)
+
+    def scores(self) -> Dict[str, float]:
+        """
+        已积累足够样本的成员的当前评分 (越低越好)。
+        """
+        stats = {member.provider_name: get_latency_stats(member.provider_name) for member in self.members}
+        known = {name: s for name, s in stats.items() if s.observations >= self.min_samples}
+        latencies = [s.ewma_latency for s in known.values() if s.ewma_latency is not None]
+        fastest = min(latencies, default=None)
+        # 从未成功的成员按最慢的成员计算耗时项
+        worst_ratio = max(latencies) / fastest if fastest else 1.0
+        scores = {}
+        for name, s in known.items():
+            ratio = s.ewma_latency / fastest if s.ewma_latency is not None and fastest else worst_ratio
+            scores[name] = self.latency_weight * ratio + self.failure_weight * (1.0 - s.ewma_success)
+        return scores
+
+    def latency_stats(self) -> LatencyStats:
+        # 按当前评分最优的成员估算 (尚无评分时取第一个成员)
+        scores = self.scores()
+        return min(self.members, key=lambda m: scores.get(m.provider_name, float("inf"))).latency_stats()
+
+    def _candidates(self) -> List[BaseImageProvider]:
+        scores = self.scores()
+        warming = [m for m in self.members if m.provider_name not in scores]
+        warming = [m for m in warming if get_latency_stats(m.provider_name).observations + self._in_flight[m.provider_name] < self.min_samples]
+        ranked = sorted((m for m in self.members if m.provider_name in scores), key=lambda m: scores[m.provider_name])
+        # 正在积累样本但已有足够请求在途的成员，排在已评分成员之后
+        pending = [m for m in self.members if m not in warming and m not in ranked]
+        ordered = sorted(warming, key=lambda m: get_latency_stats(m.provider_name).observations + self._in_flight[m.provider_name]) + ranked + pending
+        if len(ordered) > 1 and not warming and random.random() < self.explore_rate:
+            explored = random.choice(ordered[1:])
+            ordered.remove(explored)
+            ordered.insert(0, explored)
+        # 熔断中的成员排到最后 (只读取状态，不占用半开探测名额)，选中数按实际最先尝试的成员统计
+        ordered = [m for m in ordered if get_circuit_breaker(m.provider_name).state != STATE_OPEN] + \
+            [m for m in ordered if get_circuit_breaker(m.provider_name).state == STATE_OPEN]
+        IMAGE_ROUTER_SELECTIONS.inc(provider=ordered[0].provider_name)
+        tracing.current_span().set(route=[m.provider_name for m in ordered], scores={k: round(v, 3) for k, v in scores.items()})
+        return ordered
+
+    async def _attempt(self, member: BaseImageProvider, prompt: str, original_image, output_path: Path) -> bool:
+        self._in_flight[member.provider_name] += 1
+        try:
+            return await super()._attempt(member, prompt, original_image, output_path)
+        finally:
+            self._in_flight[member.provider_name] -= 1
+
+    def health(self) -> List[dict]:
+        """
+        各成员的熔断器状态、EWMA 统计与当前评分 (按配置顺序)。
+        """
+        scores = self.scores()
+        result = []
+        for member in self.members:
+            snapshot = get_circuit_breaker(member.provider_name).snapshot()
+            snapshot.update(get_latency_stats(member.provider_name).snapshot())
+            snapshot["score"] = round(scores[member.provider_name], 3) if member.provider_name in scores else None
+            snapshot["in_flight"] = self._in_flight[member.provider_name]
+            result.append(snapshot)
+        return result
@@ -0,0 +1,67 @@
+import json
+from typing import List
+
+class IncrementalArrayParser:
+    """
+    增量 JSON 解析器：从逐段到达的 JSON 文本中提取顶层对象某个数组字段的元素。
+
+    例如流式接收 {"scenes": [{...}, {...}]} 时，每个 scenes[i] 对象的右括号一到达就返回该元素，
+    无需等待整段 JSON 结束。只处理 数组元素为对象 的情况，其余内容仅用于跟踪嵌套层级。
+    """
+    def __init__(self, key: str):
+        self.key = key
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_key = None
+        self._in_target = False
+        self._item_start = None
+
+    def feed(self, text: str) -> List[dict]:
+        """
+        追加一段文本，返回本次新完成的数组元素 (按出现顺序)。
+        """
+        self._buffer += text
+        items = []
+        buffer = self._buffer
+        for i in range(self._pos, len(buffer)):
+            ch = buffer[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        # 顶层对象中的字符串：可能是键名，遇到 '[' 时据此判断是否为目标数组
+                        self._last_key = json.loads(buffer[self._string_start:i + 1])
+                continue
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in "{[":
+                self._depth += 1
+                if ch == "[" and self._depth == 2 and self._last_key == self.key:
+                    self._in_target = True
+                elif ch == "{" and self._in_target and self._depth == 3:
+                    self._item_start = i
+            elif ch in "}]":
+                self._depth -= 1
+                if ch == "}" and self._in_target and self._depth == 2 and self._item_start is not None:
+                    items.append(json.loads(buffer[self._item_start:i + 1]))
+                    self._item_start = None
+                elif ch == "]" and self._in_target and self._depth == 1:
+                    self._in_target = False
+        self._pos = len(buffer)
+        return items
+
+    @property
+    def text(self) -> str:
+        """
+        目前为止接收到的完整文本。
+        """
+        return self._buffer
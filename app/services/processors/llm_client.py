@@ -0,0 +1,154 @@
+import asyncio
+import time
+from typing import AsyncIterator
+import httpx
+from openai import AsyncOpenAI, APIConnectionError, APITimeoutError, InternalServerError, DEFAULT_MAX_RETRIES
+from loguru import logger
+from app.core.config import settings
+from app.services.metrics import LLM_LATENCY, LLM_REQUESTS, record_llm_usage
+from app.services import tracing
+from app.services.rate_limiter import call_with_rate_limit, get_llm_rate_limiter
+
+# 启用限流时由 call_with_rate_limit 负责重试的临时错误 (连接错误与 5xx)
+_TRANSIENT_ERRORS = (APIConnectionError, InternalServerError)
+# APITimeoutError 是 APIConnectionError 的子类，但单次超时已达 LLM_TIMEOUT，重试会使一次调用阻塞数倍时长，不重试
+_NON_TRANSIENT_ERRORS = (APITimeoutError,)
+
+class LLMClient:
+    """
+    异步 LLM 客户端，供 SceneSummarizer / SceneRefiner / PhraseGenerator 共享。
+
+    基于 AsyncOpenAI (DashScope 兼容模式)，底层复用同一个 httpx 连接池，
+    LLM 请求期间不会阻塞事件循环，同一个 Worker 可以并发处理多个任务。
+    每个模型的请求经过共享的自适应限流器 (get_llm_rate_limiter)，429 与临时错误由限流器退避重试，不再由 SDK 内部重试。
+    """
+    def __init__(self, api_key: str = None, base_url: str = None, timeout: float = None, max_connections: int = None):
+        self.api_key = api_key or settings.QWEN_API_KEY
+        self.base_url = base_url or settings.QWEN_BASE_URL
+        timeout = timeout or settings.LLM_TIMEOUT
+        max_connections = max_connections or settings.LLM_MAX_CONNECTIONS
+
+        self.http_client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections
+            )
+        )
+        self.client = AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            http_client=self.http_client,
+            max_retries=0 if settings.RATE_LIMIT_ENABLED else DEFAULT_MAX_RETRIES,
+        )
+
+    async def chat(self, model: str, messages: list, **kwargs):
+        """
+        发起一次 Chat Completions 请求并返回原始 completion 对象。
+
+        :param model: 模型名称 (如 qwen-plus, qwen-vl-plus)
+        :param messages: OpenAI 格式的消息列表
+        :param kwargs: 透传给 chat.completions.create 的其他参数 (tools, tool_choice 等)
+        """
+        start = time.perf_counter()
+        with tracing.span("llm.chat", model=model) as span:
+            try:
+                completion = await call_with_rate_limit(
+                    get_llm_rate_limiter(model),
+                    lambda: self.client.chat.completions.create(model=model, messages=messages, **kwargs),
+                    transient=_TRANSIENT_ERRORS,
+                    non_transient=_NON_TRANSIENT_ERRORS,
+                )
+            except Exception:
+                LLM_REQUESTS.inc(model=model, outcome="error")
+                raise
+            finally:
+                LLM_LATENCY.observe(time.perf_counter() - start, model=model)
+            LLM_REQUESTS.inc(model=model, outcome="success")
+            usage = getattr(completion, "usage", None)
+            record_llm_usage(model, usage)
+            if usage is not None:
+                span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+            return completion
+
+    async def chat_stream(self, model: str, messages: list, **kwargs) -> AsyncIterator:
+        """
+        发起流式 Chat Completions 请求，逐个产出 chunk (增量的 content / tool_calls 参数)。
+        调用方提前停止迭代时关闭底层连接。请求附带 stream_options.include_usage，最后一个 chunk 的 usage 计入 Token 指标。
+
+        :param model: 模型名称
+        :param messages: OpenAI 格式的消息列表
+        :param kwargs: 透传给 chat.completions.create 的其他参数 (tools, tool_choice 等)
+        """
+        start = time.perf_counter()
+        outcome = "error"
+        # 生成器可能在其它上下文中被关闭，Span 不设为当前 Span，由这里手动结束
+        span = tracing.start_span("llm.chat_stream", model=model)
+        first_chunk_at = None
+        try:
+            # 只有建立流之前的请求会排队与重试，已开始产出的流中断时直接抛出
+            stream = await call_with_rate_limit(
+                get_llm_rate_limiter(model),
+                lambda: self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    **kwargs
+                ),
+                transient=_TRANSIENT_ERRORS,
+                non_transient=_NON_TRANSIENT_ERRORS,
+            )
+            try:
+                async for chunk in stream:
+                    if first_chunk_at is None:
+                        first_chunk_at = time.perf_counter()
+                        span.set(first_chunk_ms=round((first_chunk_at - start) * 1000, 2))
+                    usage = getattr(chunk, "usage", None)
+                    record_llm_usage(model, usage)
+                    if usage is not None:
+                        span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+                    yield chunk
+                outcome = "success"
+            finally:
+                await stream.close()
+        except (GeneratorExit, asyncio.CancelledError):
+            # 调用方提前停止迭代或任务被取消
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            span.fail(e)
+            raise
+        finally:
+            LLM_LATENCY.observe(time.perf_counter() - start, model=model)
+            LLM_REQUESTS.inc(model=model, outcome=outcome)
+            span.set(outcome=outcome)
+            span.end()
+
+    async def warm_up(self) -> bool:
+        """
+        对 base_url 发送一次 HEAD 请求，预先建立 keep-alive 连接，失败时只记录警告。
+        """
+        start = time.perf_counter()
+        try:
+            await self.http_client.head(self.base_url, timeout=httpx.Timeout(settings.PROVIDER_CONNECT_TIMEOUT))
+        except httpx.HTTPError as e:
+            logger.warning(f"Failed to warm up LLM connection to {self.base_url}: {e}")
+            return False
+        logger.info(f"Warmed up LLM connection to {httpx.URL(self.base_url).host} in {time.perf_counter() - start:.2f}s")
+        return True
+
+    async def aclose(self):
+        await self.client.close()
+
+_llm_client: LLMClient = None
+
+def get_llm_client() -> LLMClient:
+    """
+    获取进程内共享的 LLMClient 实例 (首次调用时创建)。
+    """
+    global _llm_client
+    if _llm_client is None:
+        _llm_client = LLMClient()
+        logger.info(f"Initialized shared async LLM client: {_llm_client.base_url}")
+    return _llm_client
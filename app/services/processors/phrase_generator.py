@@ -1,20 +1,32 @@
+import argparse
+import asyncio
+import hashlib
 import json
-from openai import OpenAI
+import time
+from pathlib import Path
+from typing import AsyncIterator, List, Tuple
 from loguru import logger
-from app.schemas import ProductInput, RefinedScene, PhraseResult, ScenePhrase
+from app.schemas import ProductInput, RefinedScene, PhraseResult, ScenePhrase, SceneItem
 from app.core.config import settings
+from .llm_client import get_llm_client
 from .prompt_manager import PromptManager
+from .json_stream import IncrementalArrayParser
+
+# 强制模型调用 generate_scene_phrases 函数
+TOOL_CHOICE = {"type": "function", "function": {"name": "generate_scene_phrases"}}
+
+# 生成方式：一次请求生成全部场景 / 每个场景单独并发请求
+MODE_BATCH = "batch"
+MODE_PER_SCENE = "per_scene"
 
 class PhraseGenerator:
     def __init__(self):
         self.api_key = settings.QWEN_API_KEY
         self.model_name = "qwen-plus"
-        self.client = OpenAI(
-            api_key=self.api_key,
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-        )
+        self.client = get_llm_client()
         self.prompt_type = settings.PHRASE_PROMPT_TYPE
         self.prompt_version = settings.PHRASE_PROMPT_VERSION
+        self.mode = settings.PHRASE_MODE
 
     def _get_system_prompt(self, image_num: int, product_name: str, product_function: str, refined_scenes_text: str = "") -> str:
         """
@@ -28,10 +40,26 @@ class PhraseGenerator:
             refined_scenes=refined_scenes_text
         )
 
-    async def process(self, product: ProductInput, refined_scene: RefinedScene) -> PhraseResult:
-        logger.info(f"Generating scene phrases ({self.prompt_type} - {self.prompt_version}) for product: {product.name}")
-        
-        # 1. 解析场景来源配置
+    def cache_inputs(self, product: ProductInput, refined_scene: RefinedScene) -> dict:
+        """
+        阶段缓存键使用的规范化输入：商品文本、场景优化结果、场景来源配置与提示词模板内容。
+        模板内容参与哈希，原地修改同一版本的模板文件也会使缓存失效。
+        """
+        system_prompt_tpl, positive_prompt_template = PromptManager.get_prompt(self.prompt_type, self.prompt_version)
+        return {
+            "name": product.name.strip(),
+            "detail": (product.detail or "").strip(),
+            "refined_scene": refined_scene.model_dump(mode="json"),
+            "prompt_type": self.prompt_type,
+            "mode": self.mode,
+            "scene_source_config": settings.PHRASE_SCENE_SOURCE_CONFIG.replace(" ", ""),
+            "template": hashlib.sha256((system_prompt_tpl + positive_prompt_template).encode("utf-8")).hexdigest(),
+        }
+
+    def source_config(self) -> dict:
+        """
+        解析 PHRASE_SCENE_SOURCE_CONFIG，返回 {来源: 数量}。
+        """
         source_config = {}
         try:
             for item in settings.PHRASE_SCENE_SOURCE_CONFIG.split(","):
@@ -41,6 +69,14 @@ class PhraseGenerator:
         except Exception as e:
             logger.warning(f"Failed to parse PHRASE_SCENE_SOURCE_CONFIG: {e}. Using default.")
             source_config = {"optimized": 3, "new": 2}
+        return source_config
+
+    def _select_scenes(self, refined_scene: RefinedScene) -> List[SceneItem]:
+        """
+        按 PHRASE_SCENE_SOURCE_CONFIG 从场景优化结果中筛选参与生成的场景。
+        """
+        # 1. 解析场景来源配置
+        source_config = self.source_config()
 
         # 2. 根据配置筛选场景
         selected_scenes_data = []
@@ -55,8 +91,17 @@ class PhraseGenerator:
             logger.warning("No scenes matched the source config. Using first 5 scenes.")
             selected_scenes_data = refined_scene.scenes[:5]
             
+        logger.info(f"Total scenes selected for phrase generation: {len(selected_scenes_data)}")
+        return selected_scenes_data
+
+    def _build_request(self, product: ProductInput, selected_scenes_data: List[SceneItem]) -> Tuple[list, list, str]:
+        """
+        为筛选出的场景构建 LLM 请求 (per_scene 模式下每次只传入一个场景)。
+        
+        Returns:
+            tuple: (messages, tools, positive_prompt_template)
+        """
         image_num = len(selected_scenes_data)
-        logger.info(f"Total scenes selected for phrase generation: {image_num}")
         
         # 3. 格式化筛选出的场景信息供提示词使用
         refined_scenes_text = ""
@@ -134,45 +179,207 @@ class PhraseGenerator:
                 }
             }
         ]
+        return messages, tools, positive_prompt_template
+
+    def _to_phrase(self, scene: dict, positive_prompt_template: str) -> ScenePhrase:
+        """
+        将 LLM 返回的单个场景参数转换为 ScenePhrase。
+        """
+        if self.prompt_type == "structured":
+            # 对于结构化模板，我们需要手动填充 template
+            filled_prompt = positive_prompt_template.replace("{{scene_name}}", scene["scene_name"])
+            filled_prompt = filled_prompt.replace("{{description}}", scene["description"])
+            filled_prompt = filled_prompt.replace("{{surrounding_objects}}", scene["surrounding_objects"])
+            filled_prompt = filled_prompt.replace("{{details}}", scene["details"])
+            filled_prompt = filled_prompt.replace("{{selling_point}}", scene["selling_point"])
+            
+            return ScenePhrase(
+                scene_no=scene["scene_no"],
+                scene_description=filled_prompt
+            )
+        return ScenePhrase(**scene)
+
+    def result_template(self) -> str:
+        """
+        PhraseResult.positive_prompt_template 的取值。
+        注意：对于 structured，返回的 phrases.scene_description 已经是完整提示词了，
+        所以 positive_prompt_template 我们传一个直接透传的占位符。
+        """
+        if self.prompt_type == "structured":
+            return "{{}}"
+        _, positive_prompt_template = PromptManager.get_prompt(self.prompt_type, self.prompt_version)
+        return positive_prompt_template
+
+    async def _generate_scene(self, product: ProductInput, scene: SceneItem, scene_no: int, semaphore: asyncio.Semaphore) -> ScenePhrase:
+        """
+        per_scene 模式：为单个场景发起一次请求，复用相同的提示词模板与 tools 定义，
+        返回的 scene_no 按场景在筛选结果中的顺序重写，与 batch 模式的编号一致。
+        """
+        messages, tools, positive_prompt_template = self._build_request(product, [scene])
+        async with semaphore:
+            response = await self.client.chat(
+                model=self.model_name,
+                messages=messages,
+                tools=tools,
+                tool_choice=TOOL_CHOICE
+            )
+        arguments = json.loads(response.choices[0].message.tool_calls[0].function.arguments)
+        logger.debug(f"LLM Response Arguments (scene {scene_no}): {json.dumps(arguments, ensure_ascii=False)}")
+        scenes = arguments.get("scenes", [])
+        if not scenes:
+            raise ValueError(f"LLM returned no phrase for scene {scene_no} ({scene.scene_name})")
+        phrase = self._to_phrase(scenes[0], positive_prompt_template)
+        phrase.scene_no = scene_no
+        return phrase
+
+    def _per_scene_tasks(self, product: ProductInput, refined_scene: RefinedScene) -> List[asyncio.Task]:
+        semaphore = asyncio.Semaphore(max(1, settings.PHRASE_PER_SCENE_CONCURRENCY))
+        return [
+            asyncio.create_task(self._generate_scene(product, scene, i + 1, semaphore))
+            for i, scene in enumerate(self._select_scenes(refined_scene))
+        ]
+
+    async def process(self, product: ProductInput, refined_scene: RefinedScene) -> PhraseResult:
+        logger.info(f"Generating scene phrases ({self.prompt_type} - {self.prompt_version}, {self.mode}) for product: {product.name}")
+        if self.mode == MODE_PER_SCENE:
+            tasks = self._per_scene_tasks(product, refined_scene)
+            try:
+                phrases = await asyncio.gather(*tasks)
+            except Exception as e:
+                for t in tasks:
+                    t.cancel()
+                logger.error(f"Error generating scene phrases: {e}")
+                raise e
+            return PhraseResult(phrases=list(phrases), positive_prompt_template=self.result_template())
+
+        messages, tools, positive_prompt_template = self._build_request(product, self._select_scenes(refined_scene))
 
         try:
-            response = self.client.chat.completions.create(
+            response = await self.client.chat(
                 model=self.model_name,
                 messages=messages,
                 tools=tools,
-                tool_choice={"type": "function", "function": {"name": "generate_scene_phrases"}}
+                tool_choice=TOOL_CHOICE
             )
             
             tool_call = response.choices[0].message.tool_calls[0]
             arguments = json.loads(tool_call.function.arguments)
             logger.debug(f"LLM Response Arguments: {json.dumps(arguments, ensure_ascii=False, indent=2)}")
             
-            scenes = []
-            for s in arguments.get("scenes", []):
-                if self.prompt_type == "structured":
-                    # 对于结构化模板，我们需要手动填充 template
-                    filled_prompt = positive_prompt_template.replace("{{scene_name}}", s["scene_name"])
-                    filled_prompt = filled_prompt.replace("{{description}}", s["description"])
-                    filled_prompt = filled_prompt.replace("{{surrounding_objects}}", s["surrounding_objects"])
-                    filled_prompt = filled_prompt.replace("{{details}}", s["details"])
-                    filled_prompt = filled_prompt.replace("{{selling_point}}", s["selling_point"])
-                    
-                    scenes.append(ScenePhrase(
-                        scene_no=s["scene_no"],
-                        scene_description=filled_prompt
-                    ))
-                else:
-                    scenes.append(ScenePhrase(**s))
-            
-            # 注意：对于 structured，返回的 phrases.scene_description 已经是完整提示词了
-            # 所以 positive_prompt_template 我们传一个直接透传的占位符
-            final_template = "{{}}" if self.prompt_type == "structured" else positive_prompt_template
-            
+            scenes = [self._to_phrase(s, positive_prompt_template) for s in arguments.get("scenes", [])]
             return PhraseResult(
                 phrases=scenes,
-                positive_prompt_template=final_template
+                positive_prompt_template=self.result_template()
             )
 
         except Exception as e:
             logger.error(f"Error generating scene phrases: {e}")
             raise e
+
+    async def process_stream(self, product: ProductInput, refined_scene: RefinedScene) -> AsyncIterator[ScenePhrase]:
+        """
+        流式生成提示词：增量解析 Function Calling 的参数，每个 scenes[i] 对象完整到达后立即产出，
+        下游可在 LLM 继续生成后续场景的同时开始生图。提示词模板见 result_template()。
+        """
+        logger.info(f"Streaming scene phrases ({self.prompt_type} - {self.prompt_version}, {self.mode}) for product: {product.name}")
+        if self.mode == MODE_PER_SCENE:
+            # 每个场景的请求完成即产出，无需增量解析
+            tasks = self._per_scene_tasks(product, refined_scene)
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    yield await next_done
+            except Exception as e:
+                logger.error(f"Error streaming scene phrases: {e}")
+                raise e
+            finally:
+                for t in tasks:
+                    t.cancel()
+            return
+
+        messages, tools, positive_prompt_template = self._build_request(product, self._select_scenes(refined_scene))
+        parser = IncrementalArrayParser("scenes")
+        emitted = 0
+
+        try:
+            async for chunk in self.client.chat_stream(
+                model=self.model_name,
+                messages=messages,
+                tools=tools,
+                tool_choice=TOOL_CHOICE
+            ):
+                if not chunk.choices or not chunk.choices[0].delta.tool_calls:
+                    continue
+                for tool_call in chunk.choices[0].delta.tool_calls:
+                    fragment = tool_call.function.arguments if tool_call.function else None
+                    if not fragment:
+                        continue
+                    for s in parser.feed(fragment):
+                        emitted += 1
+                        logger.info(f"Received scene phrase {emitted} (scene_no={s.get('scene_no')})")
+                        yield self._to_phrase(s, positive_prompt_template)
+            
+            logger.debug(f"LLM Streamed Arguments: {parser.text}")
+            # 兜底：增量解析未取到的场景 (如参数格式异常) 从完整参数中补齐
+            if parser.text:
+                scenes = json.loads(parser.text).get("scenes", [])
+                for s in scenes[emitted:]:
+                    yield self._to_phrase(s, positive_prompt_template)
+        except Exception as e:
+            logger.error(f"Error streaming scene phrases: {e}")
+            raise e
+
+async def _benchmark(task_dir: Path, rounds: int) -> None:
+    """
+    在同一组输入上交替运行 batch 与 per_scene 模式，比较耗时与 Token 消耗。
+    输入取自任务输出目录中保存的商品信息与场景优化结果。
+    """
+    generator = PhraseGenerator()
+    intermediates = task_dir / "intermediates"
+    with open(intermediates / "00_product_input.json", "r", encoding="utf-8") as f:
+        product = ProductInput(**json.load(f))
+    refined_files = sorted(intermediates.glob("02_scene_refiner_*.json"))
+    if not refined_files:
+        raise SystemExit(f"{intermediates} has no Step 2 result (02_scene_refiner_*.json)")
+    with open(refined_files[0], "r", encoding="utf-8") as f:
+        refined_scene = RefinedScene(**json.load(f))
+
+    usage = {}
+    chat = generator.client.chat
+
+    async def counting_chat(model, messages, **kwargs):
+        response = await chat(model=model, messages=messages, **kwargs)
+        if response.usage:
+            usage["prompt"] = usage.get("prompt", 0) + response.usage.prompt_tokens
+            usage["completion"] = usage.get("completion", 0) + response.usage.completion_tokens
+        return response
+
+    generator.client = type("CountingClient", (), {"chat": staticmethod(counting_chat)})()
+    stats = {MODE_BATCH: [], MODE_PER_SCENE: []}
+    for r in range(rounds):
+        for mode in stats:
+            generator.mode = mode
+            usage.clear()
+            start = time.perf_counter()
+            result = await generator.process(product, refined_scene)
+            elapsed = time.perf_counter() - start
+            stats[mode].append((elapsed, usage.get("prompt", 0), usage.get("completion", 0)))
+            logger.info(f"[round {r + 1}] {mode}: {elapsed:.2f}s, {len(result.phrases)} phrases, tokens {usage}")
+
+    for mode, runs in stats.items():
+        elapsed = sorted(run[0] for run in runs)
+        logger.info(
+            f"{mode:>9}: median {elapsed[len(elapsed) // 2]:.2f}s (min {elapsed[0]:.2f}s, max {elapsed[-1]:.2f}s), "
+            f"avg prompt tokens {sum(run[1] for run in runs) / len(runs):.0f}, "
+            f"avg completion tokens {sum(run[2] for run in runs) / len(runs):.0f}"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="比较 batch 与 per_scene 提示词生成模式的耗时与 Token 消耗")
+    parser.add_argument("--task-dir", type=Path, required=True, help="已完成 Step 2 的任务输出目录，如 data/outputs/<目录名>")
+    parser.add_argument("--rounds", type=int, default=3, help="每种模式运行的轮数 (默认: 3)")
+    parser.add_argument("--concurrency", type=int, default=None, help="per_scene 模式的并发请求数 (默认: PHRASE_PER_SCENE_CONCURRENCY)")
+    args = parser.parse_args()
+
+    if args.concurrency:
+        settings.PHRASE_PER_SCENE_CONCURRENCY = args.concurrency
+    asyncio.run(_benchmark(args.task_dir, args.rounds))
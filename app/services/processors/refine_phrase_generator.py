@@ -0,0 +1,139 @@
+import hashlib
+import json
+from loguru import logger
+from app.schemas import ProductInput, SceneSummary, RefinedScene, PhraseResult, RefinedPhraseResult, SceneItem
+from app.core.config import settings
+from .llm_client import get_llm_client
+from .prompt_manager import PromptManager
+from .scene_refiner import SceneRefiner
+from .phrase_generator import PhraseGenerator
+
+TOOL_NAME = "generate_refined_scene_phrases"
+
+class RefinePhraseGenerator:
+    """
+    融合模式：一次 Function Calling 请求直接从 SceneSummary 得到 PhraseResult，替代 Step 2 + Step 3 两次串行请求。
+
+    只生成 PHRASE_SCENE_SOURCE_CONFIG 需要的场景 (optimized 个优化场景 + new 个新场景)，
+    复用 SceneRefiner 的商品上下文与 PromptManager 的提示词模板，同时返回这些场景组成的 RefinedScene 用于保存中间结果。
+    """
+    def __init__(self, refiner: SceneRefiner, phrase_generator: PhraseGenerator):
+        self.refiner = refiner
+        self.phrase_generator = phrase_generator
+        self.model_name = "qwen-plus"
+        self.prompt_version = "v1"  # 修改内置提示词时递增，使阶段缓存失效
+        self.client = get_llm_client()
+
+    def _scene_counts(self, summary: SceneSummary) -> tuple:
+        source_config = self.phrase_generator.source_config()
+        optimized_count = min(source_config.get("optimized", 0), len(summary.scenes))
+        new_count = source_config.get("new", 0)
+        if optimized_count + new_count == 0:
+            logger.warning("PHRASE_SCENE_SOURCE_CONFIG selects no optimized/new scenes. Using optimized:3, new:2.")
+            optimized_count, new_count = min(3, len(summary.scenes)), 2
+        return optimized_count, new_count
+
+    def cache_inputs(self, product: ProductInput, summary: SceneSummary) -> dict:
+        """
+        阶段缓存键使用的规范化输入：场景优化的输入、场景来源配置与提示词模板内容。
+        """
+        system_prompt_tpl, positive_prompt_template = PromptManager.get_prompt(self.phrase_generator.prompt_type, self.phrase_generator.prompt_version)
+        return {
+            **self.refiner.cache_inputs(product, summary),
+            "prompt_type": self.phrase_generator.prompt_type,
+            "scene_source_config": settings.PHRASE_SCENE_SOURCE_CONFIG.replace(" ", ""),
+            "template": hashlib.sha256((system_prompt_tpl + positive_prompt_template).encode("utf-8")).hexdigest(),
+        }
+
+    def _build_request(self, product: ProductInput, summary: SceneSummary, optimized_count: int, new_count: int):
+        max_id = max((scene.id for scene in summary.scenes), default=0)
+        image_num = optimized_count + new_count
+        prompt = self.refiner._context(product, summary) + f"""
+            ### 任务 1：挑选并优化现有场景
+            1. 从输入 JSON 的 `scenes` 列表中挑选最适合该商品展示的 {optimized_count} 个场景，保持原有 `id`，`source` 填入 "optimized"。
+            2. 优化其 `description`、`surrounding_objects`、`details` 和 `selling_point`：用具象名词替代抽象形容词，简化句子结构，确保 `details` 和 `selling_point` 描述的是画面元素而非功能说明。
+
+            ### 任务 2：扩展新场景
+            1. 结合产品名称、描述及已有场景，额外生成 {new_count} 个新的静态商品展示场景，`id` 从 {max_id + 1} 开始顺延，`source` 填入 "new"。
+            2. 泛化维度包括使用场景、时间/季节、背景主题、情绪氛围；避免与原有场景重复，也不要天马行空。
+
+            ### 任务 3：生成场景短语
+            为任务 1、任务 2 得到的共 {image_num} 个场景 (优化场景在前，新场景在后) 按以下要求各生成一条场景短语：
+        """ + self.phrase_generator._get_system_prompt(
+            image_num=image_num,
+            product_name=product.name,
+            product_function=product.detail or "",
+            refined_scenes_text="(即任务 1、任务 2 得到的场景)"
+        )
+        logger.debug(f"Refine+Phrase Prompt (length={len(prompt)}): \n{prompt}")
+
+        properties = {
+            "id": {"type": "integer"},
+            "scene_name": {"type": "string"},
+            "description": {"type": "string"},
+            "surrounding_objects": {"type": "string"},
+            "details": {"type": "string"},
+            "selling_point": {"type": "string"},
+            "source": {"type": "string", "enum": ["optimized", "new"]},
+        }
+        if self.phrase_generator.prompt_type != "structured":
+            # structured 模式直接用场景字段填充模板，text 模式额外生成场景短语
+            properties["scene_description"] = {"type": "string"}
+
+        messages = [
+            {"role": "system", "content": "你是一位资深电商运营与海报摄影导演。"},
+            {"role": "user", "content": prompt}
+        ]
+        tools = [
+            {
+                "type": "function",
+                "function": {
+                    "name": TOOL_NAME,
+                    "description": f"生成 {image_num} 个优化后的场景及其场景短语",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "scenes": {
+                                "type": "array",
+                                "items": {
+                                    "type": "object",
+                                    "properties": properties,
+                                    "required": list(properties)
+                                }
+                            }
+                        },
+                        "required": ["scenes"]
+                    }
+                }
+            }
+        ]
+        return messages, tools
+
+    async def process(self, product: ProductInput, summary: SceneSummary) -> RefinedPhraseResult:
+        optimized_count, new_count = self._scene_counts(summary)
+        logger.info(f"Refining scenes and generating phrases in one request ({optimized_count} optimized + {new_count} new) for product: {product.name}")
+        messages, tools = self._build_request(product, summary, optimized_count, new_count)
+
+        try:
+            response = await self.client.chat(
+                model=self.model_name,
+                messages=messages,
+                tools=tools,
+                tool_choice={"type": "function", "function": {"name": TOOL_NAME}}
+            )
+            arguments = json.loads(response.choices[0].message.tool_calls[0].function.arguments)
+            logger.debug(f"LLM Response Arguments: {json.dumps(arguments, ensure_ascii=False, indent=2)}")
+        except Exception as e:
+            logger.error(f"Error generating refined scene phrases: {e}")
+            raise e
+
+        # 优化场景在前、新场景在后，与 PHRASE_SCENE_SOURCE_CONFIG 的筛选顺序一致
+        scenes = sorted(arguments.get("scenes", []), key=lambda s: s.get("source") != "optimized")
+        _, positive_prompt_template = PromptManager.get_prompt(self.phrase_generator.prompt_type, self.phrase_generator.prompt_version)
+        return RefinedPhraseResult(
+            refined_scene=RefinedScene(scenes=[SceneItem(**s) for s in scenes]),
+            phrase_result=PhraseResult(
+                phrases=[self.phrase_generator._to_phrase({**s, "scene_no": i + 1}, positive_prompt_template) for i, s in enumerate(scenes)],
+                positive_prompt_template=self.phrase_generator.result_template()
+            )
+        )
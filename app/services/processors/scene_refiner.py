@@ -1,37 +1,47 @@
+import asyncio
 import json
-from openai import OpenAI
 from loguru import logger
 from app.schemas import ProductInput, SceneSummary, RefinedScene
 from app.core.config import settings
+from .llm_client import get_llm_client
+
+# 扩展阶段新增的场景数
+NEW_SCENE_COUNT = 5
 
 class SceneRefiner:
     def __init__(self):
         self.api_key = settings.QWEN_API_KEY
         self.model_name = "qwen-plus"
-        self.client = OpenAI(
-            api_key=self.api_key,
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-        )
+        self.prompt_version = "v1"  # 修改内置提示词时递增，使阶段缓存失效
+        self.client = get_llm_client()
 
-    async def process(self, product: ProductInput, summary: SceneSummary) -> RefinedScene:
-        logger.info(f"Refining scenes for product: {product.name}")
-        
+    def cache_inputs(self, product: ProductInput, summary: SceneSummary) -> dict:
+        """
+        阶段缓存键使用的规范化输入：商品文本与视觉分析结果。
+        """
+        return {
+            "name": product.name.strip(),
+            "detail": (product.detail or "").strip(),
+            "attributes": (product.attributes or "").strip(),
+            "summary": summary.model_dump(mode="json"),
+            "parallel": settings.REFINER_PARALLEL,
+        }
+
+    def _example_scene(self, summary: SceneSummary) -> str:
         # Prepare example scene from input data for prompt
-        first_scene_str = ""
         if summary.scenes:
             example_scene = summary.scenes[0].model_dump()
             if "source" not in example_scene:
                 example_scene["source"] = "optimized_original"
-            first_scene_str = json.dumps(example_scene, ensure_ascii=False, indent=8)
-        else:
-            first_scene_str = json.dumps({
-                "id": 1, 
-                "scene_name": "示例", 
-                "source": "optimized_original"
-            }, ensure_ascii=False, indent=8)
+            return json.dumps(example_scene, ensure_ascii=False, indent=8)
+        return json.dumps({
+            "id": 1, 
+            "scene_name": "示例", 
+            "source": "optimized_original"
+        }, ensure_ascii=False, indent=8)
 
-        # Construct Prompt
-        prompt = f"""
+    def _context(self, product: ProductInput, summary: SceneSummary) -> str:
+        return f"""
             ### 角色设定
             你是一位资深电商运营与海报摄影导演，将帮助我生成商品展示海报的“场景短语”。所有描述必须用于**静态**的商品展示海报，画面必须是静止的瞬间，而非动态视频。
 
@@ -43,61 +53,127 @@ class SceneRefiner:
             ### 输入 JSON 数据
             以下是需要优化和泛化的原始 JSON 数据，请基于此进行操作：
             {summary.model_dump_json(indent=2)}
+"""
 
-            ### 任务 1：优化现有场景
-            1. 遍历输入 JSON 中 `scenes` 列表，对每个场景的 `description`（场景描述）、`surrounding_objects`（周围物体）、`details`（细节展示）和 `selling_point`（卖点展示）进行优化。
-            2. **更清晰**：用具象名词和视觉动作替代抽象形容词，使描述直观且易于想象。
-            3. **更简单**：简化句子结构，使其符合 Stable Diffusion 或 Midjourney 风格的提示词，但保持中文表达。
-            4. **画面化**：确保 `details` 和 `selling_point` 的内容描述的是画面元素或视觉特写，而非功能说明。
-
-            ### 任务 2：扩展新场景
-            1. 结合产品名称、描述及输入 JSON 中已有的场景内容，发散思维但保持合理，在此基础上额外生成 5 个新的静态商品展示场景。
-            2. 泛化维度包括：使用场景（室内、户外、办公、休闲等）、时间/季节（春夏秋冬、不同时段光线）、背景主题（现代都市、自然风光、简约摄影棚等）、情绪氛围（温馨、活力、专业、奢华等）。
-            3. 避免与原有场景重复，也不要天马行空；每个新场景应突出商品特色并符合品牌风格。
-            4. 为新场景生成唯一的 `id`（在现有最大 `id` 基础上顺延）和简洁独特的 `scene_name`。
-
+    def _output_spec(self, summary: SceneSummary, intro: str, source_rule: str) -> str:
+        return f"""
             ### 输出格式
-            请将优化后的原有场景和新增的 5 个场景合并为一个新的 `scenes` 列表，每个场景对象必须包含以下字段：
+            {intro}，每个场景对象必须包含以下字段：
             - `id`: 数字标识，不重复。
             - `scene_name`: 概括场景主题的名称。
             - `description`: 对场景画面的整体描述，静态的画面，不要有产品本身或者使用产品的描述存在。
             - `surrounding_objects`: 出现在画面中的其他物体，用逗号分隔。
             - `details`: 需要突出的视觉细节，如光影、材质特写等，禁止出现跟产品相关或者产品替代物的描述。
             - `selling_point`: 突出卖点的画面展示方式。
-            - `source`: 对原有场景填入 "optimized"，对新增场景填入 "new"。
+            - `source`: {source_rule}
 
             ### 示例场景（仅供参考，用于理解结构）
-            {first_scene_str}
+            {self._example_scene(summary)}
 
             ### 输出要求
             - 请直接返回修改后的完整 JSON 数据，不要包含任何 Markdown 标记（如 ```json）。
             - 输出的根对象应该至少包含 `scenes` 字段，且结构与示例一致。
         """
-        logger.debug(f"Refiner Prompt (length={len(prompt)}): \n{prompt}")
 
-        try:
-            completion = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that outputs valid JSON only."},
-                    {"role": "user", "content": prompt}
-                ],
-            )
-            
-            content = completion.choices[0].message.content.strip()
-            logger.debug(f"Raw Qwen Refiner response: {content}")
+    def _optimize_task(self) -> str:
+        return """
+            ### 任务 1：优化现有场景
+            1. 遍历输入 JSON 中 `scenes` 列表，对每个场景的 `description`（场景描述）、`surrounding_objects`（周围物体）、`details`（细节展示）和 `selling_point`（卖点展示）进行优化。
+            2. **更清晰**：用具象名词和视觉动作替代抽象形容词，使描述直观且易于想象。
+            3. **更简单**：简化句子结构，使其符合 Stable Diffusion 或 Midjourney 风格的提示词，但保持中文表达。
+            4. **画面化**：确保 `details` 和 `selling_point` 的内容描述的是画面元素或视觉特写，而非功能说明。
+"""
+
+    def _expand_task(self, title: str = "任务 2：扩展新场景") -> str:
+        return f"""
+            ### {title}
+            1. 结合产品名称、描述及输入 JSON 中已有的场景内容，发散思维但保持合理，在此基础上额外生成 {NEW_SCENE_COUNT} 个新的静态商品展示场景。
+            2. 泛化维度包括：使用场景（室内、户外、办公、休闲等）、时间/季节（春夏秋冬、不同时段光线）、背景主题（现代都市、自然风光、简约摄影棚等）、情绪氛围（温馨、活力、专业、奢华等）。
+            3. 避免与原有场景重复，也不要天马行空；每个新场景应突出商品特色并符合品牌风格。
+            4. 为新场景生成唯一的 `id`（在现有最大 `id` 基础上顺延）和简洁独特的 `scene_name`。
+"""
+
+    async def _request(self, prompt: str, label: str) -> dict:
+        logger.debug(f"Refiner {label} Prompt (length={len(prompt)}): \n{prompt}")
+        completion = await self.client.chat(
+            model=self.model_name,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant that outputs valid JSON only."},
+                {"role": "user", "content": prompt}
+            ],
+        )
+        
+        content = completion.choices[0].message.content.strip()
+        logger.debug(f"Raw Qwen Refiner {label} response: {content}")
+        
+        # Simple cleanup
+        if content.startswith("```json"):
+            content = content[7:]
+        elif content.startswith("```"):
+            content = content[3:]
+        if content.endswith("```"):
+            content = content[:-3]
             
-            # Simple cleanup
-            if content.startswith("```json"):
-                content = content[7:]
-            elif content.startswith("```"):
-                content = content[3:]
-            if content.endswith("```"):
-                content = content[:-3]
-                
-            refined_data = json.loads(content)
+        return json.loads(content)
+
+    async def process(self, product: ProductInput, summary: SceneSummary) -> RefinedScene:
+        logger.info(f"Refining scenes for product: {product.name}")
+        if settings.REFINER_PARALLEL:
+            return await self._process_parallel(product, summary)
+
+        # Construct Prompt
+        prompt = (
+            self._context(product, summary)
+            + self._optimize_task()
+            + self._expand_task()
+            + self._output_spec(
+                summary,
+                f"请将优化后的原有场景和新增的 {NEW_SCENE_COUNT} 个场景合并为一个新的 `scenes` 列表",
+                '对原有场景填入 "optimized"，对新增场景填入 "new"。'
+            )
+        )
+
+        try:
+            refined_data = await self._request(prompt, "combined")
             return RefinedScene(**refined_data)
 
         except Exception as e:
             logger.error(f"Error calling Qwen for refinement: {e}")
             raise e
+
+    async def _process_parallel(self, product: ProductInput, summary: SceneSummary) -> RefinedScene:
+        """
+        并行模式：优化已有场景与扩展新场景互不依赖，拆为两个并发请求，
+        合并时新场景的 id 在优化结果的最大 id 之后顺延，并按来源重写 source。
+        """
+        max_id = max((scene.id for scene in summary.scenes), default=0)
+        optimize_prompt = self._context(product, summary) + self._optimize_task() + self._output_spec(
+            summary,
+            "请只返回优化后的原有场景，组成一个新的 `scenes` 列表，保持原有的 `id` 不变",
+            '固定填入 "optimized"。'
+        )
+        expand_prompt = self._context(product, summary) + self._expand_task("任务：扩展新场景") + self._output_spec(
+            summary,
+            f"请只返回新增的 {NEW_SCENE_COUNT} 个场景，组成一个新的 `scenes` 列表，`id` 从 {max_id + 1} 开始顺延，不要包含原有场景",
+            '固定填入 "new"。'
+        )
+
+        try:
+            optimized_data, expanded_data = await asyncio.gather(
+                self._request(optimize_prompt, "optimize"),
+                self._request(expand_prompt, "expand")
+            )
+            optimized = RefinedScene(**optimized_data).scenes
+            expanded = RefinedScene(**expanded_data).scenes
+        except Exception as e:
+            logger.error(f"Error calling Qwen for parallel refinement: {e}")
+            raise e
+
+        for scene in optimized:
+            scene.source = "optimized"
+        next_id = max([max_id] + [scene.id for scene in optimized]) + 1
+        for offset, scene in enumerate(expanded):
+            scene.id = next_id + offset
+            scene.source = "new"
+        logger.info(f"Parallel refinement merged {len(optimized)} optimized and {len(expanded)} new scenes")
+        return RefinedScene(scenes=optimized + expanded)
@@ -3,20 +3,21 @@ import io
 import json
 import os
 from pathlib import Path
+from typing import Optional
 from PIL import Image
-from openai import OpenAI
 from loguru import logger
 from app.schemas import ProductInput, SceneSummary
 from app.core.config import settings
+from app.core.static_files import content_hash
+from app.services import tracing
+from .llm_client import get_llm_client
 
 class SceneSummarizer:
     def __init__(self):
         self.api_key = settings.QWEN_API_KEY
         self.model_name = "qwen-vl-plus"
-        self.client = OpenAI(
-            api_key=self.api_key,
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-        )
+        self.prompt_version = "v1"  # 修改内置提示词时递增，使阶段缓存失效
+        self.client = get_llm_client()
 
     def encode_image(self, image_path: Path):
         """
@@ -77,13 +78,10 @@ class SceneSummarizer:
                 
         return self._process_pil_image(canvas)
 
-    async def process(self, product: ProductInput) -> SceneSummary:
-        logger.info(f"Summarizing product: {product.name} (Dir: {product.sample_dir})")
-        logger.info(f"--- [Visual Analysis Start] ---")
-        
-        image_contents = []
-        valid_extensions = {".jpg", ".jpeg", ".png", ".webp"}
-        
+    def _resolve_sample_path(self, product: ProductInput) -> Path:
+        """
+        解析商品素材目录的绝对路径。
+        """
         # 根据 sample_dir 获取绝对路径
         sample_path = Path(product.sample_dir)
         if not sample_path.is_absolute():
@@ -103,16 +101,20 @@ class SceneSummarizer:
                     else:
                         new_parts.append(p)
                 sample_path = Path(*new_parts)
+        return sample_path
 
-        # 1. 加载主参考图 (由 ProductInput 指定)
+    def _resolve_primary_image(self, product: ProductInput, sample_path: Path) -> Optional[Path]:
+        """
+        确定主参考图路径，指定的图片不存在时在 sample_dir 下搜索常用名称，均不存在时返回 None。
+        """
         # 遵循用户指令：如果没有生成 white_bg_main.jpg，使用 main.jpg；如果生成了，使用 white_bg_main.jpg
         primary_img_path = Path(product.image) if not isinstance(product.image, Path) else product.image
         
         # 💡 修复：防御性处理路径冗余，确保不会出现 data/data/
+        data_name = Path(settings.DATA_ROOT).name
         if not primary_img_path.is_absolute():
             # 检查是否已经是 'data' 开头
             path_parts = primary_img_path.parts
-            data_name = Path(settings.DATA_ROOT).name
             if path_parts and path_parts[0] == data_name:
                 primary_img_path_abs = Path(os.getcwd()) / primary_img_path
             else:
@@ -128,47 +130,75 @@ class SceneSummarizer:
             primary_img_path_abs = Path(path_str)
 
         if primary_img_path_abs.exists():
-            base64_img = self.encode_image(primary_img_path_abs)
+            return primary_img_path_abs
+
+        logger.warning(f"Primary Reference Image: [NOT FOUND] -> {primary_img_path_abs}")
+        # 备选方案：如果指定的图片不存在，则尝试在 sample_dir 下搜索常用名称
+        primary_candidates = [
+            "white_bg_main.jpg", "white_bg_main.png", 
+            "white_bg.jpg", "white_bg.png", 
+            "main.jpg", "main.png"
+        ]
+        for candidate in primary_candidates:
+            img_path = sample_path / candidate
+            if img_path.exists():
+                return img_path
+        return None
+
+    def _list_detail_images(self, sample_path: Path) -> list[Path]:
+        """
+        列出 detail 目录下的详情图 (按文件名排序)，跳过之前生成的九宫格拼图。
+        """
+        detail_images_path = sample_path / "detail"
+        if not detail_images_path.is_dir():
+            return []
+        valid_extensions = {".jpg", ".jpeg", ".png", ".webp"}
+        return [
+            detail_images_path / filename
+            for filename in sorted(os.listdir(detail_images_path))
+            if os.path.splitext(filename)[1].lower() in valid_extensions
+            and not filename.startswith("stitched_grid_")
+        ]
+
+    def cache_inputs(self, product: ProductInput) -> dict:
+        """
+        阶段缓存键使用的规范化输入：商品文本与实际送入模型的图片内容哈希。
+        """
+        sample_path = self._resolve_sample_path(product)
+        primary_img_path = self._resolve_primary_image(product, sample_path)
+        return {
+            "name": product.name.strip(),
+            "detail": (product.detail or "").strip(),
+            "attributes": (product.attributes or "").strip(),
+            "image": content_hash(primary_img_path) if primary_img_path else None,
+            "detail_images": [content_hash(p) for p in self._list_detail_images(sample_path)],
+        }
+
+    async def process(self, product: ProductInput) -> SceneSummary:
+        logger.info(f"Summarizing product: {product.name} (Dir: {product.sample_dir})")
+        logger.info(f"--- [Visual Analysis Start] ---")
+        
+        image_contents = []
+        sample_path = self._resolve_sample_path(product)
+
+        # 1. 加载主参考图 (由 ProductInput 指定)
+        primary_img_path = self._resolve_primary_image(product, sample_path)
+        if primary_img_path is not None:
+            base64_img = self.encode_image(primary_img_path)
             if base64_img:
                 image_contents.append({
                     "type": "image_url",
                     "image_url": {"url": f"data:image/jpeg;base64,{base64_img}"}
                 })
-                logger.info(f"Primary Reference Image: [USED] -> {primary_img_path_abs}")
-        else:
-            logger.warning(f"Primary Reference Image: [NOT FOUND] -> {primary_img_path_abs}")
-            # 备选方案：如果指定的图片不存在，则尝试在 sample_dir 下搜索常用名称
-            primary_candidates = [
-                "white_bg_main.jpg", "white_bg_main.png", 
-                "white_bg.jpg", "white_bg.png", 
-                "main.jpg", "main.png"
-            ]
-            
-            for candidate in primary_candidates:
-                img_path = sample_path / candidate
-                if img_path.exists():
-                    base64_img = self.encode_image(img_path)
-                    if base64_img:
-                        image_contents.append({
-                            "type": "image_url",
-                            "image_url": {"url": f"data:image/jpeg;base64,{base64_img}"}
-                        })
-                        logger.info(f"Fallback Reference Image: [USED] -> {img_path}")
-                        break
+                logger.info(f"Primary Reference Image: [USED] -> {primary_img_path}")
         
         # 2. 加载 detail 目录下的详情图 (进行九宫格拼接预处理)
-        detail_images_path = sample_path / "detail"
-        if detail_images_path.exists() and detail_images_path.is_dir():
-            detail_files = sorted(os.listdir(detail_images_path))
-            detail_paths = []
-            for filename in detail_files:
-                ext = os.path.splitext(filename)[1].lower()
-                if ext in valid_extensions:
-                    detail_paths.append(detail_images_path / filename)
-            
-            if detail_paths:
-                logger.info(f"Stitching {len(detail_paths)} detail images into 9-patch grids...")
-                # 每 9 张图一组进行拼接
+        detail_paths = self._list_detail_images(sample_path)
+        if detail_paths:
+            detail_images_path = sample_path / "detail"
+            logger.info(f"Stitching {len(detail_paths)} detail images into 9-patch grids...")
+            # 每 9 张图一组进行拼接
+            with tracing.span("summarize.stitch_grids", detail_images=len(detail_paths)):
                 for i in range(0, len(detail_paths), 9):
                     batch = detail_paths[i:i+9]
                     grid_index = i // 9 + 1
@@ -236,7 +266,7 @@ class SceneSummarizer:
         logger.debug(f"Summarizer Prompt (length={len(prompt_text)}): \n{prompt_text}")
 
         try:
-            completion = self.client.chat.completions.create(
+            completion = await self.client.chat(
                 model=self.model_name,
                 messages=messages,
             )
@@ -1,8 +1,10 @@
+import asyncio
 import PIL.Image
 from pathlib import Path
 from loguru import logger
 from app.core.config import settings
 from .image_providers.provider_factory import ImageProviderFactory
+from .image_providers.reference_image import PreparedReference
 
 GEMINI_WHITE_BG_PROMPT = """
 Identify the main product in the uploaded photo (automatically removing any hands holding it or messy background details).
@@ -36,9 +38,10 @@ class WhiteBGGenerator:
         """
         logger.info(f"Generating white background for: {image_path}")
         
-        # 1. 打开原始图片
+        # 1. 打开原始图片并预处理为参考图 (归一化 + 限制分辨率)
         try:
-            base_img = PIL.Image.open(image_path)
+            with PIL.Image.open(image_path) as base_img:
+                reference = await asyncio.to_thread(PreparedReference, base_img)
         except Exception as e:
             logger.error(f"Failed to open source image for white bg: {e}")
             raise e
@@ -49,9 +52,9 @@ class WhiteBGGenerator:
         # 3. 调用提供商生成图片
         try:
             logger.info(f"Calling provider {self.provider.provider_name} for white background generation...")
-            success = await self.provider.generate_image(
+            success = await self.provider.generate(
                 prompt=GEMINI_WHITE_BG_PROMPT,
-                original_image=base_img,
+                original_image=reference,
                 output_path=output_path
             )
             
@@ -64,5 +67,3 @@ class WhiteBGGenerator:
         except Exception as e:
             logger.error(f"White background generation failed: {e}")
             raise e
-        finally:
-            base_img.close()
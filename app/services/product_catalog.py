@@ -0,0 +1,195 @@
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional
+from loguru import logger
+from app.core.config import settings
+
+# 超过该值的序号视为异常 (例如误用时间戳作为序号)，不参与自增计数，以保持序列连续
+MAX_SEQUENTIAL_INDEX = 1000000
+
+class ProductCatalog:
+    """
+    基于 SQLite (WAL 模式) 的商品目录，替代整体读写的 products.json。
+
+    - 序号分配使用持久化的原子计数器，O(1)，多个 Worker / 进程共享同一个数据库文件时也不会重复。
+    - 商品按序号 (主键) 做 upsert，无需扫描或重写整个目录。
+    - 首次启动且目录为空时，自动导入已有的 products.json；也可通过 import_json / export_json 手动迁移。
+    """
+    def __init__(self, db_path: Path = None, legacy_json_path: Path = None):
+        self.db_path = Path(db_path or settings.full_product_catalog_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # isolation_level=None: 由代码显式控制事务 (BEGIN IMMEDIATE)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS products (
+                product_index INTEGER PRIMARY KEY,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('product_index', 0)")
+        logger.info(f"Initialized product catalog: {self.db_path}")
+
+        legacy_json_path = Path(legacy_json_path or settings.full_products_json_path)
+        if legacy_json_path.exists() and self.count() == 0:
+            imported = self.import_json(legacy_json_path)
+            logger.info(f"Imported {imported} products from legacy {legacy_json_path}")
+
+    def allocate_index(self) -> int:
+        """
+        原子地分配下一个商品序号。
+
+        :return: 新序号 (从 1 开始)
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("UPDATE counters SET value = value + 1 WHERE name = 'product_index'")
+                value = self._conn.execute("SELECT value FROM counters WHERE name = 'product_index'").fetchone()[0]
+                self._conn.execute("COMMIT")
+                return value
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _upsert(self, product: dict, now: float) -> None:
+        index = product["index"]
+        self._conn.execute(
+            "INSERT INTO products (product_index, data, created_at, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(product_index) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            (index, json.dumps(product, ensure_ascii=False), now, now)
+        )
+        # 显式指定的序号可能超过当前计数，推进计数器避免后续分配冲突
+        if index < MAX_SEQUENTIAL_INDEX:
+            self._conn.execute(
+                "UPDATE counters SET value = MAX(value, ?) WHERE name = 'product_index'", (index,)
+            )
+
+    def upsert(self, product: dict) -> None:
+        """
+        保存或更新商品数据 (按 product["index"] 定位)。
+
+        :param product: 商品信息字典，必须包含整数字段 index
+        """
+        if not isinstance(product.get("index"), int):
+            raise ValueError(f"Product index must be an integer: {product.get('index')!r}")
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._upsert(product, time.time())
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get(self, index: int) -> Optional[dict]:
+        """
+        按序号获取商品数据，不存在时返回 None。
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM products WHERE product_index = ?", (index,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list_products(self) -> List[dict]:
+        """
+        按序号升序返回全部商品。
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM products ORDER BY product_index").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+    def import_json(self, json_path: Path) -> int:
+        """
+        从 products.json 格式的文件导入商品 (同序号覆盖)，在单个事务中完成。
+
+        :return: 导入的商品数量
+        """
+        with open(json_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        products = [item for item in data if isinstance(item.get("index"), int)]
+        skipped = len(data) - len(products)
+        if skipped:
+            logger.warning(f"Skipped {skipped} products without an integer index in {json_path}")
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for product in products:
+                    self._upsert(product, now)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(products)
+
+    def export_json(self, json_path: Path) -> int:
+        """
+        将全部商品导出为 products.json 格式 (先写临时文件再原子替换，写入中途崩溃不会损坏原文件)。
+
+        :return: 导出的商品数量
+        """
+        json_path = Path(json_path)
+        json_path.parent.mkdir(parents=True, exist_ok=True)
+        products = self.list_products()
+
+        fd, tmp_path = tempfile.mkstemp(dir=json_path.parent, prefix=f".{json_path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(products, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, json_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return len(products)
+
+_catalog: Optional[ProductCatalog] = None
+_catalog_lock = threading.Lock()
+
+def get_product_catalog() -> ProductCatalog:
+    """
+    获取进程内共享的商品目录实例 (首次调用时创建)。
+    """
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = ProductCatalog()
+    return _catalog
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="商品目录导入 / 导出 (products.json <-> SQLite)")
+    parser.add_argument("action", choices=["import", "export"], help="import: JSON 导入目录; export: 目录导出为 JSON")
+    parser.add_argument("--json", type=Path, default=None, help="JSON 文件路径，默认为 PRODUCTS_JSON_PATH")
+    args = parser.parse_args()
+
+    json_file = args.json or settings.full_products_json_path
+    catalog = get_product_catalog()
+    if args.action == "import":
+        logger.info(f"Imported {catalog.import_json(json_file)} products from {json_file}")
+    else:
+        logger.info(f"Exported {catalog.export_json(json_file)} products to {json_file}")
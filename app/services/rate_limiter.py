@@ -0,0 +1,276 @@
+import asyncio
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, Type, TypeVar
+from loguru import logger
+from app.core.config import settings
+from app.services import tracing
+from app.services.metrics import registry, RATE_LIMIT_RATE, RATE_LIMIT_WAITING, RATE_LIMIT_WAIT, RATE_LIMITED
+
+T = TypeVar("T")
+
+# 同一波并发请求先后收到的多个 429 只下调一次速率
+_DECREASE_COOLDOWN_SECONDS = 1.0
+
+class WaitTimer:
+    """
+    累计 call_with_rate_limit 排队取令牌与退避重试等待的秒数。
+    嵌套的计时器 (如故障转移链中包着成员的 generate) 在记录时同时累加到外层。
+    """
+    def __init__(self, parent: "WaitTimer" = None):
+        self.seconds = 0.0
+        self.parent = parent
+
+    def add(self, seconds: float) -> None:
+        timer = self
+        while timer is not None:
+            timer.seconds += seconds
+            timer = timer.parent
+
+_wait_timer: ContextVar[Optional[WaitTimer]] = ContextVar("rate_limit_wait_timer", default=None)
+
+@contextmanager
+def measure_rate_limit_wait() -> Iterator[WaitTimer]:
+    """
+    统计块内 (含其中创建的子任务) 在限流器中等待的总时长，供调用方从总耗时中扣除，只保留请求本身的耗时。
+    """
+    timer = WaitTimer(_wait_timer.get())
+    token = _wait_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _wait_timer.reset(token)
+
+async def _timed_wait(awaitable: Awaitable) -> None:
+    start = time.perf_counter()
+    try:
+        await awaitable
+    finally:
+        timer = _wait_timer.get()
+        if timer is not None:
+            timer.add(time.perf_counter() - start)
+
+class AdaptiveRateLimiter:
+    """
+    单个接口 (生图服务商或 LLM 模型) 的自适应令牌桶限流器。
+
+    - 令牌按当前速率 rate (次/秒) 补充，桶容量为 RATE_LIMIT_BURST。
+    - AIMD：收到 429 时速率乘以 RATE_LIMIT_DECREASE_FACTOR (不低于 RATE_LIMIT_MIN_RATE) 并清空令牌，
+      带 Retry-After 时在此之前暂停发放令牌；每次成功请求后速率增加 RATE_LIMIT_INCREASE_STEP，不超过配置的上限。
+    - 等待令牌的请求按到达顺序排队 (asyncio.Lock 先到先得)，不会被后来的请求插队。
+    """
+    def __init__(self, name: str, max_rate: float):
+        self.name = name
+        self.max_rate = max(max_rate, settings.RATE_LIMIT_MIN_RATE)
+        self.min_rate = settings.RATE_LIMIT_MIN_RATE
+        self.burst = max(1, settings.RATE_LIMIT_BURST)
+        self.rate = self.max_rate
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._waiting = 0
+        self._throttled = 0
+        self._queue_lock: Optional[asyncio.Lock] = None
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self) -> None:
+        """
+        取得一个令牌，没有令牌或处于 Retry-After 暂停期时排队等待。
+        """
+        if self._queue_lock is None:
+            self._queue_lock = asyncio.Lock()
+        start = time.perf_counter()
+        self._waiting += 1
+        try:
+            async with self._queue_lock:
+                while True:
+                    with self._lock:
+                        now = time.monotonic()
+                        self._refill(now)
+                        wait = self._blocked_until - now
+                        if wait <= 0:
+                            if self._tokens >= 1:
+                                self._tokens -= 1
+                                break
+                            wait = (1 - self._tokens) / self.rate
+                    await asyncio.sleep(wait)
+        finally:
+            self._waiting -= 1
+            RATE_LIMIT_WAIT.observe(time.perf_counter() - start, limiter=self.name)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = min(self.max_rate, self.rate + settings.RATE_LIMIT_INCREASE_STEP)
+
+    def on_rate_limited(self, retry_after: Optional[float] = None) -> None:
+        """
+        记录一次 429：下调速率、清空令牌，并按 Retry-After (不超过 RATE_LIMIT_BACKOFF_MAX) 暂停发放令牌。
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._throttled += 1
+            RATE_LIMITED.inc(limiter=self.name)
+            self._refill(now)
+            self._tokens = 0.0
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, now + min(retry_after, settings.RATE_LIMIT_BACKOFF_MAX))
+            if now - self._last_decrease < _DECREASE_COOLDOWN_SECONDS:
+                return
+            self._last_decrease = now
+            previous = self.rate
+            self.rate = max(self.min_rate, self.rate * settings.RATE_LIMIT_DECREASE_FACTOR)
+        logger.warning(
+            f"Rate limited by {self.name}: {previous:.2f} -> {self.rate:.2f} req/s"
+            + (f", retry after {retry_after:.1f}s" if retry_after else "")
+        )
+
+    def snapshot(self) -> dict:
+        """
+        当前速率、令牌数与排队情况，用于监控。
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            return {
+                "limiter": self.name,
+                "rate": round(self.rate, 3),
+                "max_rate": self.max_rate,
+                "tokens": round(self._tokens, 2),
+                "waiting": self._waiting,
+                "blocked_for": round(max(0.0, self._blocked_until - now), 2),
+                "throttled": self._throttled,
+            }
+
+def _parse_rate_config(config: str, setting_name: str) -> Dict[str, float]:
+    """
+    解析 "name1:rate1,name2:rate2" 格式的速率配置。
+    """
+    result = {}
+    try:
+        for item in config.split(","):
+            if ":" in item:
+                name, rate = item.rsplit(":", 1)
+                result[name.strip().lower()] = float(rate.strip())
+    except Exception as e:
+        logger.warning(f"Failed to parse {setting_name}: {e}. Using default.")
+        return {}
+    return result
+
+_limiters: Dict[str, AdaptiveRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def _get_limiter(key: str, max_rate: float) -> AdaptiveRateLimiter:
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = AdaptiveRateLimiter(key, max_rate)
+        return _limiters[key]
+
+def get_provider_rate_limiter(provider_name: str) -> AdaptiveRateLimiter:
+    """
+    获取生图服务商的限流器 (按服务商名称在进程内共享)，上限取 PROVIDER_RATE_LIMIT_CONFIG 或 PROVIDER_RATE_LIMIT。
+    """
+    name = provider_name.lower()
+    overrides = _parse_rate_config(settings.PROVIDER_RATE_LIMIT_CONFIG, "PROVIDER_RATE_LIMIT_CONFIG")
+    return _get_limiter(f"provider/{name}", overrides.get(name, settings.PROVIDER_RATE_LIMIT))
+
+def get_llm_rate_limiter(model: str) -> AdaptiveRateLimiter:
+    """
+    获取 LLM 模型的限流器 (DashScope 按模型分配配额)，上限取 LLM_RATE_LIMIT_CONFIG 或 LLM_RATE_LIMIT。
+    """
+    name = model.lower()
+    overrides = _parse_rate_config(settings.LLM_RATE_LIMIT_CONFIG, "LLM_RATE_LIMIT_CONFIG")
+    return _get_limiter(f"llm/{name}", overrides.get(name, settings.LLM_RATE_LIMIT))
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def rate_limit_info(exc: BaseException) -> Tuple[bool, Optional[float]]:
+    """
+    判断异常是否为限流 (HTTP 429)，返回 (是否限流, Retry-After 秒数)。
+    兼容 httpx.HTTPStatusError、openai.RateLimitError 与 google.api_core 的 ResourceExhausted。
+    """
+    response = getattr(exc, "response", None)
+    status = getattr(exc, "status_code", None) or getattr(response, "status_code", None) or getattr(exc, "code", None)
+    if status != 429:
+        return False, None
+    headers = getattr(response, "headers", None)
+    return True, _parse_retry_after(headers.get("retry-after")) if headers is not None else None
+
+def backoff_delay(attempt: int) -> float:
+    """
+    第 attempt 次重试 (从 0 开始) 前的等待时间：在 [0, RATE_LIMIT_BACKOFF_BASE * 2^attempt] 内随机 (full jitter)，
+    上限 RATE_LIMIT_BACKOFF_MAX。
+    """
+    return random.uniform(0, min(settings.RATE_LIMIT_BACKOFF_MAX, settings.RATE_LIMIT_BACKOFF_BASE * (2 ** attempt)))
+
+async def call_with_rate_limit(
+    limiter: AdaptiveRateLimiter,
+    call: Callable[[], Awaitable[T]],
+    transient: Tuple[Type[BaseException], ...] = (),
+    non_transient: Tuple[Type[BaseException], ...] = (),
+) -> T:
+    """
+    在限流器下执行一次请求：先排队取得令牌，429 时通知限流器并按抖动指数退避重试，
+    transient 中的异常 (如连接错误) 同样退避重试但不调整速率。重试 RATE_LIMIT_MAX_RETRIES 次后抛出最后一次的异常。
+    RATE_LIMIT_ENABLED=False 时直接执行，不排队也不重试。
+
+    :param limiter: 接口的限流器
+    :param call: 每次调用创建一次新请求的无参协程函数
+    :param transient: 需要重试的临时错误类型
+    :param non_transient: 即使属于 transient 的子类也不重试的错误类型 (如超时，重试会让总耗时成倍增加)
+    """
+    if not settings.RATE_LIMIT_ENABLED:
+        return await call()
+    attempt = 0
+    while True:
+        await _timed_wait(limiter.acquire())
+        try:
+            result = await call()
+        except Exception as e:
+            limited, retry_after = rate_limit_info(e)
+            if not limited and (not isinstance(e, transient) or isinstance(e, non_transient)):
+                raise
+            if limited:
+                limiter.on_rate_limited(retry_after)
+            if attempt >= settings.RATE_LIMIT_MAX_RETRIES:
+                logger.error(f"Giving up on {limiter.name} after {attempt} retries: {e}")
+                raise
+            delay = backoff_delay(attempt)
+            attempt += 1
+            tracing.current_span().set(rate_limit_retries=attempt)
+            logger.warning(f"Retrying {limiter.name} in {delay:.1f}s ({attempt}/{settings.RATE_LIMIT_MAX_RETRIES}): {type(e).__name__}: {e}")
+            await _timed_wait(asyncio.sleep(delay))
+            continue
+        limiter.on_success()
+        return result
+
+def rate_limiter_snapshots() -> List[dict]:
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return [limiter.snapshot() for limiter in limiters]
+
+def collect_rate_limiter_states() -> None:
+    for snapshot in rate_limiter_snapshots():
+        RATE_LIMIT_RATE.set(snapshot["rate"], limiter=snapshot["limiter"])
+        RATE_LIMIT_WAITING.set(snapshot["waiting"], limiter=snapshot["limiter"])
+
+registry.add_collector(collect_rate_limiter_states)
@@ -0,0 +1,172 @@
+import asyncio
+import math
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+from loguru import logger
+from app.core.config import settings
+
+# 任务通道：完整流水线与仅白底图任务使用独立的队列和 Worker，互不阻塞
+LANE_PIPELINE = "pipeline"
+LANE_WHITE_BG = "white_bg"
+
+class QueueFullError(Exception):
+    """
+    队列已满，调用方应稍后重试 (API 返回 429 + Retry-After)。
+    """
+    def __init__(self, lane: str, retry_after: int):
+        super().__init__(f"Job queue '{lane}' is full, retry after {retry_after}s")
+        self.lane = lane
+        self.retry_after = retry_after
+
+@dataclass
+class _Job:
+    task_id: str
+    run: Callable[[], Awaitable[None]]
+    queued_at: float = field(default_factory=time.time)
+
+class _Lane:
+    """
+    单个任务通道：有界 FIFO 队列 + 固定数量的 Worker (max_queue_size <= 0 表示不限制队列长度)。
+    """
+    def __init__(self, name: str, workers: int, max_queue_size: int):
+        self.name = name
+        self.worker_count = max(1, workers)
+        self.max_queue_size: Optional[int] = max_queue_size if max_queue_size > 0 else None
+        self.queue: Deque[_Job] = deque()
+        self.running: Dict[str, float] = {}
+        self.condition: Optional[asyncio.Condition] = None
+        self.workers: List[asyncio.Task] = []
+        # 最近任务耗时的指数加权平均，用于估算排队时间与 Retry-After
+        self.avg_duration: Optional[float] = None
+
+    def estimate_wait(self, position: int) -> Optional[float]:
+        """
+        估算排在第 position 位 (从 1 开始) 的任务还需等待多久开始执行。
+        """
+        if self.avg_duration is None:
+            return None
+        return math.ceil((position - 1) / self.worker_count) * self.avg_duration + (
+            self.avg_duration if len(self.running) >= self.worker_count else 0
+        )
+
+class JobScheduler:
+    """
+    进程内任务调度器，替代无上限的 BackgroundTasks。
+
+    - 每个通道 (pipeline / white_bg) 有独立的有界队列与 Worker 数，白底图任务不会排在完整流水线之后。
+    - 队列已满时 submit 抛出 QueueFullError，携带按历史平均耗时估算的 Retry-After。
+    - 可查询任务的排队位置与已等待时间。
+    - Worker 在首次提交任务时于当前事件循环中启动，stop() 时取消。
+    """
+    def __init__(self, pipeline_workers: int = None, white_bg_workers: int = None, max_queue_size: int = None):
+        max_queue_size = max_queue_size if max_queue_size is not None else settings.SCHEDULER_MAX_QUEUE_SIZE
+        self.lanes: Dict[str, _Lane] = {
+            LANE_PIPELINE: _Lane(LANE_PIPELINE, pipeline_workers or settings.SCHEDULER_PIPELINE_WORKERS, max_queue_size),
+            LANE_WHITE_BG: _Lane(LANE_WHITE_BG, white_bg_workers or settings.SCHEDULER_WHITE_BG_WORKERS, max_queue_size),
+        }
+
+    def _ensure_started(self) -> None:
+        for lane in self.lanes.values():
+            if lane.workers:
+                continue
+            lane.condition = asyncio.Condition()
+            lane.workers = [
+                asyncio.create_task(self._worker(lane, i), name=f"scheduler-{lane.name}-{i}")
+                for i in range(lane.worker_count)
+            ]
+            logger.info(f"Started {lane.worker_count} '{lane.name}' workers (max queue size {lane.max_queue_size})")
+
+    def retry_after(self, lane_name: str) -> int:
+        """
+        估算队列腾出空位所需的秒数 (无历史数据时使用 SCHEDULER_RETRY_AFTER_SECONDS)。
+        """
+        lane = self.lanes[lane_name]
+        if lane.avg_duration is None:
+            return settings.SCHEDULER_RETRY_AFTER_SECONDS
+        return max(1, math.ceil(lane.avg_duration / lane.worker_count))
+
+    async def submit(self, task_id: str, lane_name: str, run: Callable[[], Awaitable[None]]) -> int:
+        """
+        提交任务到指定通道。
+
+        :param task_id: 任务唯一标识
+        :param lane_name: 通道名称 (LANE_PIPELINE / LANE_WHITE_BG)
+        :param run: 无参协程函数，由 Worker 调用执行任务
+        :return: 排队位置 (从 1 开始)
+        :raises QueueFullError: 队列已满
+        """
+        self._ensure_started()
+        lane = self.lanes[lane_name]
+        async with lane.condition:
+            if lane.max_queue_size is not None and len(lane.queue) >= lane.max_queue_size:
+                raise QueueFullError(lane_name, self.retry_after(lane_name))
+            lane.queue.append(_Job(task_id=task_id, run=run))
+            lane.condition.notify()
+            return len(lane.queue)
+
+    def queue_info(self, task_id: str) -> Optional[dict]:
+        """
+        查询排队中任务的位置与等待时间，任务不在队列中时返回 None。
+        """
+        now = time.time()
+        for lane in self.lanes.values():
+            for position, job in enumerate(lane.queue, start=1):
+                if job.task_id == task_id:
+                    return {
+                        "lane": lane.name,
+                        "queue_position": position,
+                        "queue_wait_seconds": round(now - job.queued_at, 2),
+                        "estimated_start_seconds": lane.estimate_wait(position),
+                    }
+        return None
+
+    def stats(self) -> Dict[str, dict]:
+        return {
+            name: {
+                "workers": lane.worker_count,
+                "running": len(lane.running),
+                "queued": len(lane.queue),
+                "max_queue_size": lane.max_queue_size,
+                "avg_duration_seconds": lane.avg_duration,
+            }
+            for name, lane in self.lanes.items()
+        }
+
+    async def _worker(self, lane: _Lane, worker_index: int) -> None:
+        while True:
+            async with lane.condition:
+                while not lane.queue:
+                    await lane.condition.wait()
+                job = lane.queue.popleft()
+
+            started_at = time.time()
+            lane.running[job.task_id] = started_at
+            logger.info(
+                f"[{lane.name}#{worker_index}] Starting task {job.task_id} "
+                f"after {started_at - job.queued_at:.2f}s in queue"
+            )
+            try:
+                await job.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"[{lane.name}#{worker_index}] Task {job.task_id} crashed: {e}")
+            finally:
+                duration = time.time() - started_at
+                lane.running.pop(job.task_id, None)
+                lane.avg_duration = duration if lane.avg_duration is None else 0.8 * lane.avg_duration + 0.2 * duration
+
+    async def stop(self) -> None:
+        """
+        取消所有 Worker (正在执行的任务随之取消，排队中的任务被丢弃)。
+        """
+        workers = [task for lane in self.lanes.values() for task in lane.workers]
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for lane in self.lanes.values():
+            lane.workers = []
+            lane.queue.clear()
+            lane.running.clear()
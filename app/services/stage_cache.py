@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Optional
+from loguru import logger
+from app.core.config import settings
+
+class StageCache:
+    """
+    流水线阶段结果 (summarize / refine / phrase) 的磁盘缓存，按总大小做 LRU 淘汰。
+
+    - 缓存键为阶段名、模型名、提示词版本与规范化输入的 SHA-256，输入不变时复用上次的 LLM 结果。
+    - 每条结果保存为 DATA_ROOT/STAGE_CACHE_DIR/<stage>/<key>.json，内容与 intermediates/ 下的中间结果格式一致。
+    - 命中时更新文件修改时间，总大小超过 STAGE_CACHE_MAX_MB 时删除最久未使用的条目。
+    - 多个进程可共享同一目录：写入为 临时文件 + os.replace，淘汰时重新统计目录实际大小。
+    """
+    def __init__(self, root: Path = None, max_bytes: int = None):
+        self.root = Path(root or settings.full_stage_cache_dir)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes if max_bytes is not None else settings.STAGE_CACHE_MAX_MB * 1024 * 1024
+        self._lock = threading.Lock()
+        self._total_bytes = sum(size for _, size, _ in self._entries())
+        logger.info(f"Initialized stage cache: {self.root} ({self._total_bytes / 1024:.1f} KB used)")
+
+    @staticmethod
+    def make_key(stage: str, model_name: str, prompt_version: str, inputs: dict) -> str:
+        """
+        计算缓存键：对阶段名、模型名、提示词版本与输入做规范化 JSON 序列化后取 SHA-256。
+        """
+        payload = json.dumps(
+            {"stage": stage, "model": model_name, "prompt_version": prompt_version, "inputs": inputs},
+            ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, stage: str, key: str) -> Path:
+        return self.root / stage / f"{key}.json"
+
+    def _entries(self):
+        for path in self.root.glob("*/*.json"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            yield path, st.st_size, st.st_mtime
+
+    def get(self, stage: str, key: str) -> Optional[Any]:
+        """
+        读取缓存结果，未命中 (或文件损坏) 时返回 None。
+        """
+        path = self._path(stage, key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                content = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Discarding unreadable stage cache entry {path}: {e}")
+            path.unlink(missing_ok=True)
+            return None
+        try:
+            # 更新修改时间，作为 LRU 的最近使用时间
+            os.utime(path)
+        except OSError:
+            pass
+        return content
+
+    def put(self, stage: str, key: str, data: Any) -> None:
+        """
+        写入阶段结果 (支持 Pydantic 模型或普通字典/列表)，必要时淘汰最久未使用的条目。
+        """
+        content = data.model_dump(mode="json") if hasattr(data, "model_dump") else data
+        path = self._path(stage, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.part")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(content, f, ensure_ascii=False, indent=2)
+        size = tmp_path.stat().st_size
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._total_bytes += size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            evicted += 1
+        self._total_bytes = total
+        if evicted:
+            logger.info(f"Evicted {evicted} stage cache entries, {total / 1024:.1f} KB used")
+
+_cache: Optional[StageCache] = None
+_cache_lock = threading.Lock()
+
+def get_stage_cache() -> Optional[StageCache]:
+    """
+    获取进程内共享的 StageCache 实例，STAGE_CACHE_ENABLED=False 时返回 None。
+    """
+    global _cache
+    if not settings.STAGE_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = StageCache()
+    return _cache
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import time
+from typing import AsyncIterator, Dict, List, Optional
+from loguru import logger
+from app.core.config import settings
+
+# 订阅队列中的结束标记
+_CLOSED = None
+
+class _TaskChannel:
+    """
+    单个任务的事件频道：保存已发布事件 (供后连接的客户端回放) 及当前订阅者队列。
+    """
+    def __init__(self):
+        self.history: List[str] = []
+        self.subscribers: List[asyncio.Queue] = []
+        self.closed_at: Optional[float] = None
+
+class TaskEventBus:
+    """
+    进程内的任务事件发布/订阅总线，用于 SSE 进度推送。
+
+    - 事件在发布时只序列化一次，所有订阅者共享同一份 SSE 报文。
+    - 保留每个任务的事件历史，客户端晚于事件连接 (或断线重连) 时可回放，支持 Last-Event-ID。
+    - 任务结束后频道关闭，历史保留 SSE_HISTORY_TTL_SECONDS 秒后清理。
+
+    注意：只能在事件循环线程中调用 publish / close。
+    """
+    def __init__(self, history_ttl: int = None, keepalive_interval: float = None):
+        self.history_ttl = history_ttl if history_ttl is not None else settings.SSE_HISTORY_TTL_SECONDS
+        self.keepalive_interval = keepalive_interval or settings.SSE_KEEPALIVE_SECONDS
+        self._channels: Dict[str, _TaskChannel] = {}
+
+    @staticmethod
+    def format_event(event_id: int, event: str, data: dict) -> str:
+        payload = json.dumps(data, ensure_ascii=False)
+        return f"id: {event_id}\nevent: {event}\ndata: {payload}\n\n"
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.history_ttl
+        expired = [
+            task_id for task_id, channel in self._channels.items()
+            if channel.closed_at is not None and channel.closed_at < cutoff
+        ]
+        for task_id in expired:
+            del self._channels[task_id]
+
+    def has_channel(self, task_id: str) -> bool:
+        return task_id in self._channels
+
+    def publish(self, task_id: str, event: str, **data) -> None:
+        """
+        发布一个任务事件。
+
+        :param task_id: 任务唯一标识
+        :param event: 事件类型 (如 stage, image, completed, failed)
+        :param data: 事件数据，会被序列化为 JSON
+        """
+        channel = self._channels.setdefault(task_id, _TaskChannel())
+        if channel.closed_at is not None:
+            logger.warning(f"Dropping event '{event}' for closed task channel {task_id}")
+            return
+        message = self.format_event(len(channel.history) + 1, event, {"task_id": task_id, **data})
+        channel.history.append(message)
+        for queue in channel.subscribers:
+            queue.put_nowait(message)
+
+    def reopen(self, task_id: str) -> None:
+        """
+        重新打开已结束任务的频道 (任务被恢复执行时)，保留历史事件，事件 ID 继续递增。
+        """
+        channel = self._channels.get(task_id)
+        if channel is not None:
+            channel.closed_at = None
+
+    def close(self, task_id: str) -> None:
+        """
+        关闭任务频道，通知所有订阅者事件流结束。
+        """
+        channel = self._channels.setdefault(task_id, _TaskChannel())
+        channel.closed_at = time.time()
+        for queue in channel.subscribers:
+            queue.put_nowait(_CLOSED)
+        self._prune()
+
+    async def subscribe(self, task_id: str, last_event_id: int = 0) -> AsyncIterator[str]:
+        """
+        订阅任务事件，先回放历史事件，再实时推送新事件，频道关闭后结束。
+        长时间无事件时发送 SSE 注释作为心跳。
+
+        :param task_id: 任务唯一标识
+        :param last_event_id: 客户端已收到的最后一个事件 ID (断线重连时跳过已收到的事件)
+        """
+        channel = self._channels.setdefault(task_id, _TaskChannel())
+        queue: asyncio.Queue = asyncio.Queue()
+        # 回放与注册在同一个同步片段内完成，期间不会有新事件插入
+        for message in channel.history[last_event_id:]:
+            queue.put_nowait(message)
+        if channel.closed_at is not None:
+            queue.put_nowait(_CLOSED)
+        channel.subscribers.append(queue)
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=self.keepalive_interval)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is _CLOSED:
+                    break
+                yield message
+        finally:
+            channel.subscribers.remove(queue)
@@ -0,0 +1,424 @@
+"""
+任务执行逻辑，由 API 进程 (JOB_QUEUE_BACKEND=local) 或独立的 Worker 进程 (`python -m app.worker`) 调用。
+"""
+import os
+import socket
+import time
+import shutil
+import base64
+import asyncio
+from pathlib import Path
+from typing import List, Optional
+
+from app.schemas import ProductInput, TaskStatus, GenerateRequest
+from app.services.pipeline import ProductImagePipeline
+from app.core.logging import logger
+from app.core.config import settings
+from app.core.static_files import content_version
+from app.services.asset_downloader import get_asset_downloader
+from app.services.asset_store import get_asset_store
+from app.services.product_catalog import get_product_catalog
+from app.services.task_store import create_task_store
+from app.services.task_events import TaskEventBus
+from app.services import tracing
+
+# 数据存储路径 (静态文件服务与任务执行共用)
+DATA_ROOT = Path("data")
+DATA_OUTPUTS = DATA_ROOT / "outputs"
+
+# 确保必要的目录存在
+DATA_ROOT.mkdir(parents=True, exist_ok=True)
+DATA_OUTPUTS.mkdir(parents=True, exist_ok=True)
+
+# -----------------------------------------------------------------------------
+# 全局状态 (Global State)
+# -----------------------------------------------------------------------------
+# 商品目录 (SQLite)，负责商品序号分配与商品数据持久化。
+# 首次启动时自动导入已有的 products.json。
+product_catalog = get_product_catalog()
+
+# 任务状态存储 (由 TASK_STORE_BACKEND 决定)。
+# 默认为进程内存储；多 Worker 部署时请使用 sqlite 后端以共享任务状态。
+task_store = create_task_store()
+
+# 任务进度事件总线 (进程内 pub/sub)，用于 SSE 推送
+task_events = TaskEventBus()
+
+# 当前进程标识，记录在任务的 owner 字段中，用于判断任务是否因进程退出而中断
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# 进程内共享的流水线实例 (各处理器、LLM 客户端与生图服务商在所有任务间复用)
+_pipeline: Optional[ProductImagePipeline] = None
+
+def get_pipeline() -> ProductImagePipeline:
+    """
+    获取共享的 ProductImagePipeline (应用启动时创建，未经过启动流程时按需创建)。
+    """
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = ProductImagePipeline()
+    return _pipeline
+
+# -----------------------------------------------------------------------------
+# 辅助函数 (Helper Functions)
+# -----------------------------------------------------------------------------
+
+def get_next_product_index() -> int:
+    """
+    从商品目录的原子计数器分配下一个可用的商品序号。
+    
+    Returns:
+        int: 下一个可用的自增序号，从 1 开始。
+    """
+    return product_catalog.allocate_index()
+
+def save_product_to_json(product_data: dict) -> None:
+    """
+    保存或更新商品数据到商品目录 (按序号 upsert)。
+    
+    Args:
+        product_data (dict): 要保存的商品信息字典。
+    """
+    try:
+        product_catalog.upsert(product_data)
+    except Exception as e:
+        logger.error(f"Error saving product {product_data.get('index')} to catalog: {e}")
+
+async def update_task_progress(task_id: str, phrases: List[str] = None, new_image_url: str = None, status: str = None):
+    """
+    原子地更新任务存储中的任务状态，供前端轮询。
+    
+    Args:
+        task_id (str): 任务的唯一标识符。
+        phrases (List[str], optional): 生成的提示词列表。
+        new_image_url (str, optional): 新生成图片的 URL。
+        status (str, optional): 新的状态字符串 (例如 'processing', 'completed', 'failed')。
+    """
+    fields = {}
+    append = {}
+    
+    if phrases is not None:
+        fields["phrases"] = phrases
+        
+    if new_image_url is not None:
+        append["images"] = [new_image_url]
+        
+    if status is not None:
+        fields["status"] = status
+    
+    await task_store.aupdate(task_id, append=append, **fields)
+
+def is_owner_alive(owner: Optional[str]) -> bool:
+    """
+    判断执行任务的进程是否仍在运行。只能检查本机进程，其它主机上的进程一律视为存活。
+    """
+    if not owner:
+        return False
+    if owner == PROCESS_ID:
+        return True
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    if os.name == "nt":
+        # Windows 上 os.kill(pid, 0) 会向进程发送 CTRL_C_EVENT，无法用于探测；本机其它进程视为已退出
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def find_interrupted_tasks() -> List[dict]:
+    """
+    查找因服务重启而中断的任务 (pending / processing，且 owner 进程已不存在)，每条结果包含 task_id 字段。
+    只有保存了可恢复请求 (request 字段) 的任务才会返回。
+    """
+    return [
+        task for task in task_store.find_unfinished()
+        if task.get("request") and not is_owner_alive(task.get("owner"))
+    ]
+
+def resumable_request(request: GenerateRequest, index: Optional[int], image_path: Path) -> dict:
+    """
+    构造可用于恢复任务的请求：源图片已落盘，改为引用服务端路径，不在任务存储中保存 Base64。
+    """
+    data = request.model_dump(exclude={"image_base64"})
+    data.update(image_url=None, image_path=f"/data/{image_path.resolve().relative_to(DATA_ROOT.resolve()).as_posix()}")
+    if index is not None:
+        data["product_index"] = index
+    return data
+
+def get_image_url(image_path: Path) -> str:
+    """
+    将服务器上的图片绝对路径转换为可访问的静态资源 URL。
+    
+    Args:
+        image_path (Path): 图片的绝对路径。
+    
+    Returns:
+        str: `/outputs/...` 或 `/data/...` 形式的 URL，无法映射时返回原始路径。
+             文件存在时附加 `?v=<内容哈希>` 版本参数，只有这种内容寻址的 URL 会被长期缓存。
+
+    计算哈希需要读取文件，异步代码中应通过 asyncio.to_thread 调用。
+    """
+    try:
+        url = f"/outputs/{image_path.relative_to(DATA_OUTPUTS.resolve()).as_posix()}"
+    except ValueError:
+        try:
+            url = f"/data/{image_path.relative_to(DATA_ROOT.resolve()).as_posix()}"
+        except ValueError:
+            return str(image_path)
+    if image_path.exists():
+        url += f"?v={content_version(image_path)}"
+    return url
+
+# -----------------------------------------------------------------------------
+# 任务执行逻辑 (Task Execution Logic)
+# -----------------------------------------------------------------------------
+
+async def execute_job(task_id: str, request: GenerateRequest, queued_at: float) -> None:
+    """
+    任务被 Worker 领取后的入口：记录排队耗时并执行流水线。
+    
+    Args:
+        task_id (str): 任务唯一标识。
+        request (GenerateRequest): 生成请求。
+        queued_at (float): 入队时间戳。
+    """
+    queue_wait = round(time.time() - queued_at, 2)
+    task = await task_store.aget(task_id) or {}
+    await task_store.aupdate(task_id, status="processing", queue_wait_seconds=queue_wait, owner=PROCESS_ID)
+    task_events.publish(task_id, "started", status="processing", queue_wait_seconds=queue_wait)
+    
+    # 任务此前已开始过 (手动恢复、服务重启或 Worker 崩溃后重新领取)：从已有的输出目录继续执行
+    resume_dir = task.get("output_dir")
+    if resume_dir and not Path(resume_dir).is_dir():
+        resume_dir = None
+    if resume_dir:
+        logger.info(f"Resuming task {task_id} from {resume_dir}")
+    await run_pipeline_task(task_id, request, resume_dir=Path(resume_dir) if resume_dir else None)
+
+async def run_pipeline_task(task_id: str, request: GenerateRequest, resume_dir: Optional[Path] = None):
+    """
+    执行核心 AI 生成流水线，整个过程记录为一条以 run_pipeline_task 为根 Span 的链路。
+    
+    Args:
+        resume_dir (Path, optional): 已有的任务输出目录，传入时流水线复用其中已完成的中间结果与场景图。
+    
+    链路结束后写入任务输出目录下的 TRACE_FILENAME (与 intermediates/ 同级)；
+    没有输出目录的任务 (仅去底) 写入 DATA_ROOT/TRACE_DIR/<task_id>.jsonl。
+    """
+    with tracing.start_trace("run_pipeline_task", task_id=task_id, white_bg_only=request.white_bg_only, resume=resume_dir is not None):
+        task_span = tracing.current_span()
+        await _run_pipeline_task(task_id, request, resume_dir)
+        task = await task_store.aget(task_id) or {}
+        task_span.set(status=task.get("status"), product_index=task.get("product_index"))
+        if task.get("status") == "failed":
+            task_span.fail(task.get("error") or "failed")
+
+async def _run_pipeline_task(task_id: str, request: GenerateRequest, resume_dir: Optional[Path] = None):
+    """
+    步骤:
+    1. 确定存储路径并下载资源 (橱窗/详情图)。
+    2. 解析源图片 (来自 Path, Base64 或 URL)。
+    3. 获取共享的 ProductImagePipeline。
+    4. 执行流水线 (仅去底 或 全流程生成)。
+    5. 完成或失败时更新任务状态，并通过事件总线推送进度。
+    """
+    def on_event(stage, state, **data):
+        # 记录当前阶段，供轮询及跨进程 SSE 使用；阶段缓存命中情况记录在 cache_hits / cache_misses
+        append = {}
+        if data.get("cache") == "hit":
+            append["cache_hits"] = [stage]
+        elif data.get("cache") == "miss":
+            append["cache_misses"] = [stage]
+        fields = {"output_dir": data["output_dir"]} if "output_dir" in data else {}
+        # 同步回调中不能等待存储写入：提交到存储的执行器后立即返回 (按提交顺序写入)
+        task_store.update_nowait(task_id, append=append, stage=stage, stage_state=state, **fields)
+        task_events.publish(task_id, "stage", stage=stage, state=state, **data)
+
+    try:
+        pipeline = get_pipeline()
+        index = request.product_index
+        
+        # --- 步骤 1: 确定存储路径 & 下载资源 ---
+        if request.save_to_data:
+            if index is None:
+                index = get_next_product_index()
+            
+            target_dir = settings.DATA_ROOT / str(index)
+            target_dir.mkdir(parents=True, exist_ok=True)
+            img_path = target_dir / "main.jpg"
+            
+            # 并发下载橱窗图和详情图 (同一 URL 只下载一次)
+            downloader = get_asset_downloader()
+            with tracing.span("download_assets", gallery=len(request.gallery_images), detail=len(request.detail_images)):
+                saved_sub_images, saved_detail_images = await asyncio.gather(
+                    downloader.download_to_dir(request.gallery_images, target_dir / "sub_images", "gallery"),
+                    downloader.download_to_dir(request.detail_images, target_dir / "detail", "detail")
+                )
+
+            # 持久化商品信息到 JSON
+            product_info = {
+                "index": index,
+                "name": request.name,
+                "detail": request.detail,
+                "attributes": request.attributes,
+                "image": str(img_path.relative_to(settings.DATA_ROOT)),
+                "sub_images": saved_sub_images,
+                "detail_images": saved_detail_images,
+                "task_id": task_id
+            }
+            save_product_to_json(product_info)
+            # 更新任务状态中的商品序号
+            await task_store.aupdate(task_id, product_index=index)
+        else:
+            # 如果不保存到数据根目录，则使用临时目录
+            task_dir = Path(f"data/temp/{task_id}")
+            task_dir.mkdir(parents=True, exist_ok=True)
+            img_path = task_dir / "main.jpg"
+
+        # --- 步骤 2: 解析源图片 ---
+        active_image_path = img_path
+        if request.image_path:
+            # 情况 A: 图片已存在于服务器上 (例如来自上一步的白底图)
+            # 去掉 ?v= 版本参数
+            rel_path = request.image_path.split('?', 1)[0].lstrip('/')
+            src_path = None
+            if rel_path.startswith('outputs/'):
+                src_path = DATA_OUTPUTS / rel_path[8:]
+            elif rel_path.startswith('data/'):
+                src_path = DATA_ROOT / rel_path[5:]
+            
+            if src_path and src_path.exists():
+                active_image_path = src_path
+                logger.info(f"Using provided image source: {active_image_path}")
+            else:
+                raise Exception(f"Image path not found or invalid format: {request.image_path}")
+        elif request.image_base64:
+            # 情况 B: 提供了 Base64 数据
+            header, data = request.image_base64.split(',', 1) if ',' in request.image_base64 else (None, request.image_base64)
+            image_bytes = base64.b64decode(data)
+            asset_store = get_asset_store()
+            if asset_store is not None:
+                # 同一张主图重复提交时只保存一份，商品目录中为硬链接
+                _, blob = await asyncio.to_thread(asset_store.put_bytes, image_bytes, img_path.suffix)
+                await asyncio.to_thread(asset_store.link, blob, img_path)
+            else:
+                # 先删除旧文件，避免原地改写硬链接指向的共享内容
+                img_path.unlink(missing_ok=True)
+                with open(img_path, "wb") as f:
+                    f.write(image_bytes)
+        elif request.image_url:
+            # 情况 C: 从 URL 下载 (保存为 main.jpg，与其它来源保持一致)
+            result = await get_asset_downloader().download(request.image_url, img_path.with_suffix(""))
+            if not result.ok:
+                raise Exception(f"Failed to download image {request.image_url}: {result.error}")
+            if result.path != img_path:
+                os.replace(result.path, img_path)
+        else:
+            raise Exception("No image provided (base64, URL or path)")
+
+        # 源图片已落盘，保存可恢复的请求 (不含 Base64)，任务中断后据此重新执行
+        await task_store.aupdate(task_id, request=resumable_request(request, index, active_image_path))
+
+        # --- 步骤 3: 准备流水线输入 ---
+        product = ProductInput(
+            name=request.name,
+            detail=request.detail,
+            attributes=request.attributes,
+            sample_dir=str(img_path.parent.relative_to(DATA_ROOT)), 
+            image=active_image_path.relative_to(DATA_ROOT) if active_image_path.is_absolute() else active_image_path
+        )
+        
+        # --- 步骤 4: 执行流水线 ---
+        if request.white_bg_only:
+            # 子流程: 仅生成白底图
+            white_bg_path = await pipeline.run_white_bg_only(product, on_event=on_event)
+            white_bg_path_abs = Path(white_bg_path).resolve()
+            
+            # 保存到永久位置
+            # save_to_data 时步骤 1 已分配过序号，避免重复分配
+            product_index = index if index is not None else get_next_product_index()
+            task_dir = DATA_ROOT / str(product_index)
+            task_dir.mkdir(parents=True, exist_ok=True)
+            
+            output_white_bg = task_dir / "white_bg_main.jpg"
+            white_bg_path_p = Path(white_bg_path).resolve()
+            output_white_bg_p = output_white_bg.resolve()
+            
+            # 避免自我覆盖
+            if white_bg_path_p == output_white_bg_p:
+                logger.info(f"New white bg is already at target: {output_white_bg_p}")
+            else:
+                if output_white_bg_p.exists():
+                    output_white_bg_p.unlink()
+                shutil.copy(white_bg_path, output_white_bg)
+            
+            output_white_bg_abs = output_white_bg.resolve()
+            
+            # 生成返回 URL (带内容哈希版本参数，白底图被重新生成时 URL 随之变化)
+            url = await asyncio.to_thread(get_image_url, output_white_bg_abs)
+
+            # 更新任务状态 (Base64 由查询接口按需编码，不再常驻任务存储)
+            await task_store.aupdate(
+                task_id,
+                append={"images": [url]},
+                white_bg_url=url,
+                status="completed",
+                product_index=product_index
+            )
+            task_events.publish(task_id, "completed", status="completed", images=[url], phrases=[], product_index=product_index)
+        else:
+            # 子流程: 全流程生成
+            # 每张场景图完成后立即写入任务状态，前端轮询时即可看到已完成的图片
+            async def on_image_complete(image):
+                url = await asyncio.to_thread(get_image_url, Path(image.image_path).resolve())
+                await update_task_progress(task_id, new_image_url=url)
+                task_events.publish(task_id, "image", scene_no=image.scene_no, url=url)
+
+            result_task = await pipeline.run(
+                product, 
+                need_white_bg=request.need_white_bg,
+                on_image_complete=on_image_complete,
+                on_event=on_event,
+                resume_dir=resume_dir
+            )
+            
+            if result_task.status == TaskStatus.COMPLETED:
+                # 任务完成，提取生成的提示词并更新状态
+                final_phrases = []
+                if result_task.phrase_result and result_task.phrase_result.phrases:
+                    final_phrases = [p.scene_description for p in result_task.phrase_result.phrases]
+                
+                # 提取生成的所有图片
+                final_images = []
+                if result_task.image_result and result_task.image_result.images:
+                    for img_obj in result_task.image_result.images:
+                        final_images.append(await asyncio.to_thread(get_image_url, Path(img_obj.image_path).resolve()))
+
+                # 图片 URL 已在生成过程中逐张追加，这里只补充遗漏项，保持列表只追加以便 since 游标增量读取
+                streamed_images = (await task_store.aget(task_id) or {}).get("images", [])
+                missing_images = [url for url in final_images if url not in streamed_images]
+                await task_store.aupdate(
+                    task_id,
+                    append={"images": missing_images},
+                    phrases=final_phrases,
+                    status="completed"
+                )
+                task_events.publish(
+                    task_id, "completed",
+                    status="completed", images=final_images, phrases=final_phrases, product_index=index
+                )
+            else:
+                await task_store.aupdate(task_id, status="failed", error=result_task.error)
+                task_events.publish(task_id, "failed", status="failed", error=result_task.error)
+            
+    except Exception as e:
+        logger.error(f"Error in background task {task_id}: {str(e)}")
+        await task_store.aupdate(task_id, status="failed", error=str(e))
+        task_events.publish(task_id, "failed", status="failed", error=str(e))
+    finally:
+        task_events.close(task_id)
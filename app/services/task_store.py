@@ -0,0 +1,330 @@
+import asyncio
+import copy
+import functools
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+from loguru import logger
+from app.core.config import settings
+
+# 进入这些状态后任务视为已结束，开始计算 TTL
+FINISHED_STATUSES = {"completed", "failed"}
+# 尚未结束的任务状态 (服务重启后可能需要恢复)
+UNFINISHED_STATUSES = ("pending", "processing")
+
+class BaseTaskStore(ABC):
+    """
+    任务状态存储基类，供 API 创建任务、流水线回写进度、前端轮询查询。
+
+    所有实现都需保证 update 的原子性：同一次调用中的字段赋值与列表追加要么全部生效，要么全部不生效。
+
+    同步方法可能阻塞 (SQLite 跨进程写锁最长等待 30 秒)，异步代码中应使用 acreate / aget / aupdate / afind_unfinished / afind_by_product_index，
+    同步回调中使用 update_nowait。这些调用在存储专用的单线程执行器中按提交顺序执行，不阻塞事件循环，
+    同一进程内先提交的写入总是先于后提交的读取生效。
+    """
+    def __init__(self, ttl_seconds: int = None, evict_interval: int = None):
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else settings.TASK_TTL_SECONDS
+        self.evict_interval = evict_interval if evict_interval is not None else settings.TASK_EVICT_INTERVAL_SECONDS
+        self._last_evict = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="task-store")
+
+    async def _run(self, func, *args, **kwargs):
+        return await asyncio.wrap_future(self._executor.submit(functools.partial(func, *args, **kwargs)))
+
+    async def acreate(self, task_id: str, data: dict) -> None:
+        await self._run(self.create, task_id, data)
+
+    async def aget(self, task_id: str) -> Optional[dict]:
+        return await self._run(self.get, task_id)
+
+    async def aupdate(self, task_id: str, append: Dict[str, list] = None, expect: dict = None, **fields) -> bool:
+        return await self._run(self.update, task_id, append=append, expect=expect, **fields)
+
+    async def afind_unfinished(self) -> List[dict]:
+        return await self._run(self.find_unfinished)
+
+    async def afind_by_product_index(self, product_index: int) -> List[dict]:
+        return await self._run(self.find_by_product_index, product_index)
+
+    def update_nowait(self, task_id: str, append: Dict[str, list] = None, **fields) -> Future:
+        """
+        提交一次更新后立即返回 (供同步回调使用)，失败时记录错误。
+        """
+        future = self._executor.submit(functools.partial(self.update, task_id, append=append, **fields))
+        def log_failure(f: Future) -> None:
+            if f.exception() is not None:
+                logger.error(f"Failed to update task {task_id}: {f.exception()}")
+
+        future.add_done_callback(log_failure)
+        return future
+
+    @abstractmethod
+    def create(self, task_id: str, data: dict) -> None:
+        """
+        创建一个新任务。
+
+        :param task_id: 任务唯一标识
+        :param data: 初始任务状态字典
+        """
+        pass
+
+    @abstractmethod
+    def get(self, task_id: str) -> Optional[dict]:
+        """
+        获取任务状态的快照 (副本)，不存在时返回 None。
+        """
+        pass
+
+    @abstractmethod
+    def update(self, task_id: str, append: Dict[str, list] = None, expect: dict = None, **fields) -> bool:
+        """
+        原子地更新任务状态。
+
+        :param task_id: 任务唯一标识
+        :param append: 需要追加到列表字段的值，如 {"images": [url]}
+        :param expect: 条件更新，仅当任务当前的这些字段等于给定值时才更新，如 {"owner": old_owner}
+        :param fields: 需要直接赋值的字段，如 status="completed"
+        :return: 任务是否存在且已更新
+        """
+        pass
+
+    @abstractmethod
+    def find_unfinished(self) -> List[dict]:
+        """
+        查找尚未结束 (pending / processing) 的任务，每条结果包含 task_id 字段。
+        """
+        pass
+
+    @abstractmethod
+    def find_by_product_index(self, product_index: int) -> List[dict]:
+        """
+        按商品序号查找任务 (按创建时间倒序)，每条结果包含 task_id 字段。
+        """
+        pass
+
+    @abstractmethod
+    def evict_expired(self) -> int:
+        """
+        清理结束时间早于 TTL 的任务。
+
+        :return: 被清理的任务数量
+        """
+        pass
+
+    def maybe_evict(self) -> None:
+        """
+        距离上次清理超过 evict_interval 时执行一次过期清理。
+        """
+        now = time.time()
+        if now - self._last_evict < self.evict_interval:
+            return
+        self._last_evict = now
+        evicted = self.evict_expired()
+        if evicted:
+            logger.info(f"Evicted {evicted} expired tasks from task store")
+
+    @staticmethod
+    def _matches(data: dict, expect: Optional[dict]) -> bool:
+        return all(data.get(key) == value for key, value in (expect or {}).items())
+
+    @staticmethod
+    def _apply(data: dict, append: Dict[str, list], fields: dict) -> None:
+        for key, values in (append or {}).items():
+            data.setdefault(key, []).extend(values)
+        data.update(fields)
+
+class InMemoryTaskStore(BaseTaskStore):
+    """
+    进程内任务存储 (默认)。仅适用于单 Worker 部署，重启后数据丢失。
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._lock = threading.Lock()
+        self._tasks: Dict[str, dict] = {}
+        self._meta: Dict[str, dict] = {}
+        self._by_product: Dict[int, set] = {}
+
+    def _index_product(self, task_id: str, product_index: Optional[int]) -> None:
+        old_index = self._meta[task_id].get("product_index")
+        if old_index == product_index:
+            return
+        if old_index is not None:
+            self._by_product.get(old_index, set()).discard(task_id)
+        if product_index is not None:
+            self._by_product.setdefault(product_index, set()).add(task_id)
+        self._meta[task_id]["product_index"] = product_index
+
+    def create(self, task_id: str, data: dict) -> None:
+        now = time.time()
+        with self._lock:
+            if task_id in self._meta:
+                self._index_product(task_id, None)
+            self._tasks[task_id] = copy.deepcopy(data)
+            self._meta[task_id] = {"created_at": now, "finished_at": None, "product_index": None}
+            self._index_product(task_id, data.get("product_index"))
+        self.maybe_evict()
+
+    def get(self, task_id: str) -> Optional[dict]:
+        with self._lock:
+            data = self._tasks.get(task_id)
+            return copy.deepcopy(data) if data is not None else None
+
+    def update(self, task_id: str, append: Dict[str, list] = None, expect: dict = None, **fields) -> bool:
+        with self._lock:
+            data = self._tasks.get(task_id)
+            if data is None or not self._matches(data, expect):
+                return False
+            self._apply(data, append, fields)
+            if "product_index" in fields:
+                self._index_product(task_id, fields["product_index"])
+            if "status" in fields:
+                # 重新执行 (恢复) 的任务不再计入 TTL
+                self._meta[task_id]["finished_at"] = time.time() if fields["status"] in FINISHED_STATUSES else None
+            return True
+
+    def find_unfinished(self) -> List[dict]:
+        with self._lock:
+            return [
+                {"task_id": t, **copy.deepcopy(data)}
+                for t, data in self._tasks.items() if data.get("status") in UNFINISHED_STATUSES
+            ]
+
+    def find_by_product_index(self, product_index: int) -> List[dict]:
+        with self._lock:
+            task_ids = sorted(
+                self._by_product.get(product_index, set()),
+                key=lambda t: self._meta[t]["created_at"],
+                reverse=True
+            )
+            return [{"task_id": t, **copy.deepcopy(self._tasks[t])} for t in task_ids]
+
+    def evict_expired(self) -> int:
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            expired = [
+                t for t, meta in self._meta.items()
+                if meta["finished_at"] is not None and meta["finished_at"] < cutoff
+            ]
+            for t in expired:
+                self._index_product(t, None)
+                del self._tasks[t]
+                del self._meta[t]
+        return len(expired)
+
+class SQLiteTaskStore(BaseTaskStore):
+    """
+    基于 SQLite (WAL 模式) 的任务存储。
+
+    数据落盘，服务重启后仍可查询；多个 uvicorn Worker 可共享同一个数据库文件。
+    task_id 为主键，product_index、status 与 finished_at 建有索引。
+    """
+    def __init__(self, db_path: Path = None, **kwargs):
+        super().__init__(**kwargs)
+        self.db_path = Path(db_path or settings.full_task_store_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # isolation_level=None: 由代码显式控制事务 (BEGIN IMMEDIATE)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id TEXT PRIMARY KEY,
+                product_index INTEGER,
+                status TEXT,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                finished_at REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_product_index ON tasks(product_index)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_finished_at ON tasks(finished_at)")
+        logger.info(f"Initialized SQLite task store: {self.db_path}")
+
+    def create(self, task_id: str, data: dict) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tasks (task_id, product_index, status, data, created_at, updated_at, finished_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, NULL)",
+                (task_id, data.get("product_index"), data.get("status"), json.dumps(data, ensure_ascii=False), now, now)
+            )
+        self.maybe_evict()
+
+    def get(self, task_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, task_id: str, append: Dict[str, list] = None, expect: dict = None, **fields) -> bool:
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE 获取写锁，保证跨进程的读-改-写原子性
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT data, finished_at FROM tasks WHERE task_id = ?", (task_id,)
+                ).fetchone()
+                data = json.loads(row[0]) if row is not None else None
+                if data is None or not self._matches(data, expect):
+                    self._conn.execute("ROLLBACK")
+                    return False
+                self._apply(data, append, fields)
+                finished_at = row[1]
+                if "status" in fields:
+                    # 重新执行 (恢复) 的任务不再计入 TTL
+                    finished_at = now if fields["status"] in FINISHED_STATUSES else None
+                self._conn.execute(
+                    "UPDATE tasks SET product_index = ?, status = ?, data = ?, updated_at = ?, finished_at = ? WHERE task_id = ?",
+                    (data.get("product_index"), data.get("status"), json.dumps(data, ensure_ascii=False), now, finished_at, task_id)
+                )
+                self._conn.execute("COMMIT")
+                return True
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def find_by_product_index(self, product_index: int) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT task_id, data FROM tasks WHERE product_index = ? ORDER BY created_at DESC",
+                (product_index,)
+            ).fetchall()
+        return [{"task_id": task_id, **json.loads(data)} for task_id, data in rows]
+
+    def find_unfinished(self) -> List[dict]:
+        placeholders = ", ".join("?" for _ in UNFINISHED_STATUSES)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT task_id, data FROM tasks WHERE status IN ({placeholders}) ORDER BY created_at",
+                UNFINISHED_STATUSES
+            ).fetchall()
+        return [{"task_id": task_id, **json.loads(data)} for task_id, data in rows]
+
+    def evict_expired(self) -> int:
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM tasks WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,)
+            )
+            return cursor.rowcount
+
+def create_task_store(backend: str = None) -> BaseTaskStore:
+    """
+    根据配置创建任务存储实例。
+
+    :param backend: 存储后端 (memory, sqlite)，为空时读取 TASK_STORE_BACKEND
+    """
+    name = (backend or settings.TASK_STORE_BACKEND).lower()
+    if name == "memory":
+        return InMemoryTaskStore()
+    if name == "sqlite":
+        return SQLiteTaskStore()
+    raise ValueError(f"Unknown task store backend: {name}. Available: ['memory', 'sqlite']")
@@ -0,0 +1,274 @@
+import contextvars
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Union
+from loguru import logger
+from app.core.config import settings
+
+class Span:
+    """
+    链路中的一个计时区间 (阶段、LLM 调用、生图请求、下载等)，parent_id 指向外层 Span。
+    """
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: dict):
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = dict(attributes)
+        self.start = time.time()
+        self._start_perf = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.status = "running"
+        self.error: Optional[str] = None
+
+    def set(self, **attributes) -> None:
+        """
+        追加或覆盖属性 (如 Token 数、下载字节数)。
+        """
+        self.attributes.update(attributes)
+
+    def fail(self, error: Union[BaseException, str]) -> None:
+        """
+        将 Span 标记为失败 (不结束计时)，用于异常已被内部捕获、只能从返回值判断失败的场景。
+        """
+        self.status = "error"
+        self.error = error if isinstance(error, str) else f"{type(error).__name__}: {error}"
+
+    def end(self, error: Union[BaseException, str, None] = None) -> None:
+        """
+        结束计时，重复调用无效。
+        """
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._start_perf
+        if error is not None:
+            self.fail(error)
+        elif self.status == "running":
+            self.status = "ok"
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": round(self.start, 6),
+            "duration_ms": round(self.duration * 1000, 2) if self.duration is not None else None,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+class _NoopSpan:
+    """
+    没有活动链路 (或 TRACING_ENABLED=False) 时返回的空 Span，调用方无需判断。
+    """
+    span_id = None
+
+    def set(self, **attributes) -> None:
+        pass
+
+    def fail(self, error) -> None:
+        pass
+
+    def end(self, error=None) -> None:
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+class Trace:
+    """
+    一个任务的完整链路：根 Span 与其下所有嵌套 Span。
+
+    结束时以 JSONL (每行一个 Span) 追加写入 export_paths 中的每个文件；
+    同一输出目录被恢复执行多次时，各次执行的 trace_id 不同，记录依次追加。
+    """
+    def __init__(self, name: str, task_id: Optional[str] = None, attributes: dict = None):
+        self.trace_id = uuid.uuid4().hex
+        self.task_id = task_id
+        self.spans: List[Span] = []
+        self.export_paths: List[Path] = []
+        # 由阶段事件 (started / completed / failed) 驱动的阶段 Span，按阶段名索引
+        self._stages: Dict[str, Span] = {}
+        self._lock = threading.Lock()
+        self.root = self.new_span(name, None, attributes or {})
+
+    def new_span(self, name: str, parent: Optional[Span], attributes: dict) -> Span:
+        span = Span(self, name, parent.span_id if parent else None, attributes)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def add_export_path(self, path: Path) -> None:
+        path = Path(path)
+        if path not in self.export_paths:
+            self.export_paths.append(path)
+
+    def records(self) -> List[dict]:
+        with self._lock:
+            return [span.to_dict() for span in self.spans]
+
+    def export(self) -> List[Path]:
+        """
+        追加写入所有导出文件；没有导出路径但属于某个任务时写入 DATA_ROOT/TRACE_DIR/<task_id>.jsonl。
+        """
+        paths = list(self.export_paths)
+        if not paths and self.task_id:
+            paths.append(task_trace_fallback_path(self.task_id))
+        lines = "".join(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in self.records())
+        for path in paths:
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+            except OSError as e:
+                logger.warning(f"Failed to write trace {self.trace_id} to {path}: {e}")
+        return paths
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("span", default=None)
+
+# 本进程内正在执行的任务链路，供 /api/task/{task_id}/trace 查看进行中的任务
+_active: Dict[str, Trace] = {}
+
+def task_trace_fallback_path(task_id: str) -> Path:
+    return settings.full_trace_dir / f"{task_id}.jsonl"
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+def get_active_trace(task_id: str) -> Optional[Trace]:
+    return _active.get(task_id)
+
+def current_span() -> Union[Span, _NoopSpan]:
+    """
+    当前 Span，没有活动链路时返回 NOOP_SPAN。
+    """
+    return _current_span.get() or NOOP_SPAN
+
+def start_span(name: str, **attributes) -> Union[Span, _NoopSpan]:
+    """
+    在当前 Span 下创建子 Span 但不设为当前 Span，由调用方负责 end()。
+    用于异步生成器等可能在其它上下文中结束的场景 (无法安全地重置 ContextVar)。
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return NOOP_SPAN
+    return trace.new_span(name, _current_span.get(), attributes)
+
+@contextmanager
+def start_trace(name: str, task_id: str = None, **attributes) -> Iterator[Optional[Trace]]:
+    """
+    开启新链路并将其根 Span 设为当前 Span，退出时结束根 Span 并导出。
+
+    已处于某条链路中时 (如任务执行器调用流水线) 退化为普通的嵌套 Span，由外层链路负责导出；
+    TRACING_ENABLED=False 时不做任何记录，返回 None。
+    """
+    if not settings.TRACING_ENABLED:
+        yield None
+        return
+    existing = _current_trace.get()
+    if existing is not None:
+        with span(name, **attributes):
+            yield existing
+        return
+
+    trace = Trace(name, task_id, attributes)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(trace.root)
+    if task_id:
+        _active[task_id] = trace
+    try:
+        yield trace
+    except BaseException as e:
+        trace.root.end(e)
+        raise
+    finally:
+        trace.root.end()
+        # 异常或取消时遗留的阶段 Span 也要结束，避免导出 duration 为空的记录
+        for stage_span in list(trace._stages.values()):
+            stage_span.end("unfinished")
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        if task_id:
+            _active.pop(task_id, None)
+        trace.export()
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Union[Span, _NoopSpan]]:
+    """
+    在当前 Span 下创建子 Span (同步与异步代码均可使用)，异常时记录错误后继续抛出。
+    asyncio.create_task / gather 创建的任务会复制上下文，其中的 Span 自动挂在创建时的当前 Span 下。
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield NOOP_SPAN
+        return
+    child = trace.new_span(name, _current_span.get(), attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.end(e)
+        raise
+    finally:
+        child.end()
+        _current_span.reset(token)
+
+def add_export_path(path: Path) -> None:
+    """
+    为当前链路登记导出文件 (如任务输出目录下的 trace.jsonl)，没有活动链路时忽略。
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_export_path(path)
+
+def stage_event(stage: str, state: str, **data) -> None:
+    """
+    根据流水线阶段事件维护阶段 Span：started 时开启并设为当前 Span，completed / failed 时结束。
+
+    阶段之间可能重叠 (如流式短语与生图)，新阶段总是挂在外层的非阶段 Span 下；
+    没有 started 的 completed 事件 (命中中间结果的恢复阶段) 记录为零耗时的 Span。
+    """
+    trace = _current_trace.get()
+    if trace is None or not stage:
+        return
+    name = f"stage.{stage}"
+    attributes = {k: v for k, v in data.items() if isinstance(v, (str, int, float, bool)) and k not in ("error", "duration")}
+    if state == "started":
+        parent = _current_span.get()
+        while parent is not None and parent in trace._stages.values():
+            parent = next((s for s in trace.spans if s.span_id == parent.parent_id), None)
+        stage_span = trace.new_span(name, parent, attributes)
+        trace._stages[stage] = stage_span
+        _current_span.set(stage_span)
+        return
+    if state not in ("completed", "failed"):
+        return
+    stage_span = trace._stages.pop(stage, None)
+    if stage_span is None:
+        stage_span = trace.new_span(name, _current_span.get(), attributes)
+    stage_span.set(**attributes)
+    stage_span.end(data.get("error", "failed") if state == "failed" else None)
+    if _current_span.get() is stage_span:
+        _current_span.set(next((s for s in trace.spans if s.span_id == stage_span.parent_id), trace.root))
+
+def read_trace(path: Path) -> List[dict]:
+    """
+    读取 JSONL 链路文件，跳过损坏的行。
+    """
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
@@ -0,0 +1,137 @@
+"""
+独立的流水线 Worker 进程。
+
+从持久化任务队列 (JOB_QUEUE_BACKEND=sqlite / redis) 领取任务并执行，进度写回共享的任务存储
+(TASK_STORE_BACKEND=sqlite)，API 进程只负责入队与查询状态。可在同一台机器或多台机器上运行多个 Worker：
+
+    python -m app.worker
+    python -m app.worker --lanes white_bg --concurrency 4
+    python -m app.worker --metrics-port 9101    # 同时在 9101 端口输出 Prometheus 指标
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import uuid
+from typing import List
+from app.core.config import settings
+from app.core.logging import logger, setup_logging
+from app.schemas import GenerateRequest
+from app.services.job_queue import BaseJobQueue, QueuedJob, create_job_queue
+from app.services.metrics import TASKS_IN_FLIGHT, serve_metrics
+from app.services.scheduler import LANE_PIPELINE, LANE_WHITE_BG
+from app.services.task_runner import task_store, get_pipeline, execute_job
+
+class PipelineWorker:
+    """
+    任务 Worker：concurrency 个执行槽并发领取并执行任务，执行期间定期发送心跳，
+    并定期将心跳超时 (其它 Worker 崩溃) 的任务放回队列。
+    """
+    def __init__(self, queue: BaseJobQueue, lanes: List[str], concurrency: int, metrics_port: int = 0):
+        self.queue = queue
+        self.lanes = lanes
+        self.concurrency = max(1, concurrency)
+        self.metrics_port = metrics_port
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._stopping = asyncio.Event()
+
+    def stop(self) -> None:
+        """
+        停止领取新任务，正在执行的任务执行完毕后退出。
+        """
+        if not self._stopping.is_set():
+            logger.info(f"Worker {self.worker_id} stopping, waiting for running tasks to finish")
+            self._stopping.set()
+
+    async def _sleep(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _heartbeat(self, job: QueuedJob) -> None:
+        while True:
+            await asyncio.sleep(settings.WORKER_HEARTBEAT_SECONDS)
+            await asyncio.to_thread(self.queue.heartbeat, job.task_id)
+
+    async def _run_job(self, job: QueuedJob) -> None:
+        logger.info(f"[{self.worker_id}] Running task {job.task_id} ({job.lane}, attempt {job.attempts})")
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        TASKS_IN_FLIGHT.inc(lane=job.lane)
+        try:
+            if await task_store.aget(job.task_id) is None:
+                logger.warning(f"Task {job.task_id} not found in task store, skipping")
+            else:
+                await execute_job(job.task_id, GenerateRequest(**job.payload), job.queued_at)
+        finally:
+            TASKS_IN_FLIGHT.dec(lane=job.lane)
+            heartbeat.cancel()
+            if not await asyncio.to_thread(self.queue.complete, job.task_id, self.worker_id, job.attempts):
+                logger.warning(f"[{self.worker_id}] Task {job.task_id} (attempt {job.attempts}) was requeued or claimed again while running, leaving it in the queue")
+
+    async def _slot(self, slot: int) -> None:
+        while not self._stopping.is_set():
+            job = await asyncio.to_thread(self.queue.claim, self.lanes, self.worker_id)
+            if job is None:
+                await self._sleep(settings.WORKER_POLL_INTERVAL_SECONDS)
+                continue
+            try:
+                await self._run_job(job)
+            except Exception as e:
+                logger.exception(f"[{self.worker_id}#{slot}] Task {job.task_id} crashed: {e}")
+
+    async def _reaper(self) -> None:
+        while not self._stopping.is_set():
+            requeued = await asyncio.to_thread(self.queue.requeue_stale, settings.WORKER_LEASE_SECONDS)
+            if requeued:
+                logger.warning(f"Requeued {requeued} tasks with expired heartbeats")
+            await self._sleep(settings.WORKER_LEASE_SECONDS / 2)
+
+    async def run(self) -> None:
+        logger.info(f"Worker {self.worker_id} started (lanes={self.lanes}, concurrency={self.concurrency})")
+        pipeline = get_pipeline()
+        if settings.PROVIDER_STARTUP_WARMUP:
+            await pipeline.warm_up()
+        metrics_server = asyncio.create_task(serve_metrics("0.0.0.0", self.metrics_port)) if self.metrics_port else None
+        try:
+            await asyncio.gather(self._reaper(), *[self._slot(i) for i in range(self.concurrency)])
+        finally:
+            if metrics_server:
+                metrics_server.cancel()
+        logger.info(f"Worker {self.worker_id} stopped")
+
+async def main(lanes: List[str], concurrency: int, metrics_port: int = 0) -> None:
+    if settings.JOB_QUEUE_BACKEND.lower() == "local":
+        raise SystemExit("JOB_QUEUE_BACKEND is 'local': tasks run inside the API process, set it to 'sqlite' or 'redis' to use workers")
+    if settings.TASK_STORE_BACKEND.lower() == "memory":
+        raise SystemExit("Workers need a shared task store, set TASK_STORE_BACKEND=sqlite")
+
+    worker = PipelineWorker(create_job_queue(), lanes, concurrency, metrics_port)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, worker.stop)
+        except NotImplementedError:
+            # Windows 不支持 add_signal_handler，Ctrl+C 时直接退出
+            pass
+    await worker.run()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Visual Engine 流水线 Worker")
+    parser.add_argument(
+        "--lanes", default=f"{LANE_WHITE_BG},{LANE_PIPELINE}",
+        help="领取任务的通道，逗号分隔，靠前的优先 (默认: white_bg,pipeline)"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=settings.WORKER_CONCURRENCY,
+        help="同时执行的任务数 (默认: WORKER_CONCURRENCY)"
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, default=settings.WORKER_METRICS_PORT,
+        help="Prometheus 指标端口，0 表示不输出 (默认: WORKER_METRICS_PORT)"
+    )
+    args = parser.parse_args()
+
+    setup_logging()
+    asyncio.run(main([lane.strip() for lane in args.lanes.split(",") if lane.strip()], args.concurrency, args.metrics_port))
@@ -10,6 +10,13 @@ export default defineBackground(() => {
       fetch(url, options)
         .then(async (response) => {
           const data = await response.json();
+          if (!response.ok) {
+            // 例如队列已满时返回 429，附带 Retry-After
+            const retryAfter = response.headers.get('Retry-After');
+            const detail = data?.detail || `HTTP ${response.status}`;
+            sendResponse({ success: false, error: retryAfter ? `${detail} (${retryAfter}s)` : detail, status: response.status });
+            return;
+          }
           sendResponse({ success: true, data });
         })
         .catch((error) => {
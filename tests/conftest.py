@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Settings 要求的密钥在测试中使用占位值，测试不会访问真实服务
+os.environ.setdefault("QWEN_API_KEY", "test-qwen-key")
+os.environ.setdefault("GEMINI_API_KEY", "test-gemini-key")
+# 数据库、日志与任务输出写入临时目录，不污染仓库中的 data/
+os.environ.setdefault("DATA_ROOT", tempfile.mkdtemp(prefix="visual-engine-tests-"))
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
@@ -0,0 +1,19 @@
+import os
+from app.services.asset_store import AssetStore
+
+def test_linked_product_file_stays_writable(tmp_path):
+    store = AssetStore(root=tmp_path / "assets", db_path=tmp_path / "assets.db")
+    sha256, blob = store.put_bytes(b"image", ".jpg")
+    dest = store.link(blob, tmp_path / "0" / "main.jpg")
+
+    assert dest.read_bytes() == b"image"
+    assert os.stat(dest).st_mode & 0o200
+    # 相同内容再次保存时复用同一份素材
+    assert store.put_bytes(b"image", ".jpg") == (sha256, blob)
+
+def test_link_restores_write_permission_on_legacy_blob(tmp_path):
+    store = AssetStore(root=tmp_path / "assets", db_path=tmp_path / "assets.db")
+    _, blob = store.put_bytes(b"image", ".jpg")
+    os.chmod(blob, 0o444)
+    dest = store.link(blob, tmp_path / "0" / "main.jpg")
+    assert os.stat(dest).st_mode & 0o200
@@ -0,0 +1,154 @@
+import asyncio
+import time
+from pathlib import Path
+from app.core.config import settings
+from app.services.metrics import PROVIDER_REQUESTS
+from app.services.processors.image_providers.base_provider import BaseImageProvider
+from app.services.processors.image_providers.failover_provider import FailoverProvider
+from app.services.processors.image_providers.hedging import HedgeBudget, RequestHedger
+from app.services.processors.image_providers.latency_stats import get_latency_stats
+from app.services.rate_limiter import call_with_rate_limit, get_provider_rate_limiter
+
+class FakeProvider(BaseImageProvider):
+    """
+    耗时 service_seconds 的假服务商，请求前先在限流器中等待 queue_seconds。
+    """
+    def __init__(self, name: str, service_seconds: float = 0.01, queue_seconds: float = 0.0, success: bool = True):
+        super().__init__()
+        self.provider_name = name
+        self.model_name = "fake"
+        self.service_seconds = service_seconds
+        self.queue_seconds = queue_seconds
+        self.success = success
+
+    async def generate_image(self, prompt, original_image, output_path: Path) -> bool:
+        async def call():
+            await asyncio.sleep(self.service_seconds)
+            return self.success
+        if self.queue_seconds:
+            # 模拟被其它请求占满的令牌桶
+            limiter = get_provider_rate_limiter(self.provider_name)
+            limiter._tokens = 0.0
+            limiter.rate = 1.0 / self.queue_seconds
+        return await call_with_rate_limit(get_provider_rate_limiter(self.provider_name), call)
+
+def test_recorded_latency_excludes_rate_limiter_wait(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+    provider = FakeProvider("fake-queued", service_seconds=0.05, queue_seconds=0.3)
+    assert asyncio.run(provider.generate("prompt", None, tmp_path / "out.png"))
+    latency = get_latency_stats("fake-queued").ewma_latency
+    assert 0.04 <= latency < 0.2
+
+def test_failover_chain_records_each_request_once(tmp_path):
+    primary = FakeProvider("fake-primary", success=False)
+    secondary = FakeProvider("fake-secondary")
+    chain = FailoverProvider([primary, secondary])
+    assert asyncio.run(chain.generate("prompt", None, tmp_path / "out.png"))
+
+    assert PROVIDER_REQUESTS.value(provider="fake-primary", outcome="failure") == 1
+    assert PROVIDER_REQUESTS.value(provider="fake-secondary", outcome="success") == 1
+    assert PROVIDER_REQUESTS.value(provider=chain.provider_name, outcome="success") == 0
+    assert get_latency_stats(chain.provider_name).observations == 0
+    # 对冲等待时间按主服务商的统计估算
+    assert chain.latency_stats() is get_latency_stats("fake-primary")
+
+class ConcurrencyTrackingProvider(FakeProvider):
+    """
+    记录同时进行的 generate_image 调用数峰值的假服务商。
+    """
+    def __init__(self, name: str, service_seconds: float = 0.05):
+        super().__init__(name, service_seconds=service_seconds)
+        self.active = 0
+        self.peak = 0
+
+    async def generate_image(self, prompt, original_image, output_path: Path) -> bool:
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            return await super().generate_image(prompt, original_image, output_path)
+        finally:
+            self.active -= 1
+
+def test_concurrency_limit_is_shared_by_chain_members_and_direct_calls(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "IMAGE_GEN_CONCURRENCY_CONFIG", "fake-shared:1")
+    backend = ConcurrencyTrackingProvider("fake-shared")
+    chain = FailoverProvider([backend, FakeProvider("fake-shared-fallback")])
+
+    async def run():
+        return await asyncio.gather(
+            backend.generate("prompt", None, tmp_path / "direct.png"),
+            chain.generate("prompt", None, tmp_path / "chain.png"),
+            chain.generate("prompt", None, tmp_path / "chain2.png"),
+        )
+
+    assert all(asyncio.run(run()))
+    # 名额按实际服务商计，而不是按链的名称 ("fake-shared+fake-shared-fallback")
+    assert backend.peak == 1
+    assert chain.has_capacity()
+
+class FileWritingProvider(BaseImageProvider):
+    """
+    在线程池中耗时 seconds 后写入 content 的假服务商，与 Gemini SDK 调用一样被取消后线程仍会写完。
+    """
+    def __init__(self, name: str, seconds: float, content: bytes):
+        super().__init__()
+        self.provider_name = name
+        self.model_name = "fake"
+        self.seconds = seconds
+        self.content = content
+
+    async def generate_image(self, prompt, original_image, output_path: Path) -> bool:
+        def write():
+            time.sleep(self.seconds)
+            output_path.write_bytes(self.content)
+            return True
+        return await asyncio.get_running_loop().run_in_executor(None, write)
+
+def test_hedge_winner_output_is_not_overwritten_by_cancelled_primary(tmp_path):
+    primary = FileWritingProvider("fake-slow", seconds=0.5, content=b"primary")
+    hedge = FileWritingProvider("fake-fast", seconds=0.05, content=b"hedge")
+    get_latency_stats("fake-slow").record(0.01)
+    hedger = RequestHedger(primary, hedge)
+    hedger.min_samples = 1
+    hedger.budget = HedgeBudget(1.0, 60)
+    output_path = tmp_path / "scene1.png"
+
+    async def run():
+        success = await hedger.generate("prompt", None, output_path)
+        # 等被取消的主请求线程写完
+        await asyncio.sleep(0.6)
+        return success
+    assert asyncio.run(run())
+    assert output_path.read_bytes() == b"hedge"
+    assert list(tmp_path.glob("*.png")) == [output_path]
+
+def test_cancelled_hedge_loser_is_kept_as_lower_bound_sample(tmp_path):
+    primary = FileWritingProvider("fake-censored", seconds=0.4, content=b"primary")
+    hedge = FileWritingProvider("fake-censored-hedge", seconds=0.01, content=b"hedge")
+    stats = get_latency_stats("fake-censored")
+    stats.record(0.05)
+    hedger = RequestHedger(primary, hedge)
+    hedger.min_samples = 1
+    hedger.budget = HedgeBudget(1.0, 60)
+
+    async def run():
+        success = await hedger.generate("prompt", None, tmp_path / "scene1.png")
+        await asyncio.sleep(0.5)
+        return success
+    assert asyncio.run(run())
+    # 落败的主请求至少耗时 hedge_delay (0.05 秒)，作为下界样本保留，分位数不会下降
+    assert stats.count() == 2
+    assert stats.quantile(1.0) >= 0.05
+    assert stats.observations == 1
+
+def test_breaker_latency_excludes_rate_limiter_wait(monkeypatch, tmp_path):
+    from app.services.processors.image_providers.circuit_breaker import get_circuit_breaker
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+    member = FakeProvider("fake-throttled", service_seconds=0.01, queue_seconds=0.3)
+    chain = FailoverProvider([member])
+    recorded = []
+    breaker = get_circuit_breaker("fake-throttled")
+    monkeypatch.setattr(breaker, "record", lambda success, latency: recorded.append((success, latency)))
+
+    assert asyncio.run(chain.generate("prompt", None, tmp_path / "out.png"))
+    assert recorded[0][0] and recorded[0][1] < 0.2
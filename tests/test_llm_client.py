@@ -0,0 +1,87 @@
+import asyncio
+import time
+from types import SimpleNamespace
+import httpx
+from app.services.processors.llm_client import LLMClient
+
+FAKE_LLM_SECONDS = 1.0
+
+def _slow_client() -> LLMClient:
+    client = LLMClient(api_key="test", base_url="http://llm.invalid/v1")
+
+    async def slow_create(**kwargs):
+        # 模拟一次耗时的 LLM 请求：只让出事件循环，不阻塞
+        await asyncio.sleep(FAKE_LLM_SECONDS)
+        return SimpleNamespace(choices=[], usage=None)
+
+    client.client.chat.completions.create = slow_create
+    return client
+
+def test_event_loop_stays_responsive_during_llm_call():
+    async def main():
+        client = _slow_client()
+        start = time.perf_counter()
+        llm_task = asyncio.create_task(client.chat("qwen-plus", [{"role": "user", "content": "hi"}]))
+
+        # LLM 请求进行中，其它协程仍能按时执行
+        ticks = 0
+        while ticks < 10:
+            await asyncio.sleep(0.01)
+            ticks += 1
+        ticker_elapsed = time.perf_counter() - start
+        assert not llm_task.done()
+
+        await llm_task
+        llm_elapsed = time.perf_counter() - start
+        await client.aclose()
+        return ticker_elapsed, llm_elapsed
+
+    ticker_elapsed, llm_elapsed = asyncio.run(main())
+    assert ticker_elapsed < FAKE_LLM_SECONDS / 4
+    assert llm_elapsed >= FAKE_LLM_SECONDS
+
+def test_api_request_served_during_llm_call():
+    import api_server
+
+    async def main():
+        client = _slow_client()
+        llm_task = asyncio.create_task(client.chat("qwen-plus", [{"role": "user", "content": "hi"}]))
+        transport = httpx.ASGITransport(app=api_server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            start = time.perf_counter()
+            response = await http.get("/api/task/does-not-exist")
+            request_elapsed = time.perf_counter() - start
+        assert not llm_task.done()
+        await llm_task
+        await client.aclose()
+        return response.status_code, request_elapsed
+
+    status, request_elapsed = asyncio.run(main())
+    assert status == 404
+    assert request_elapsed < FAKE_LLM_SECONDS / 4
+
+def _count_attempts(client: LLMClient, error: Exception) -> int:
+    attempts = 0
+
+    async def failing_create(**kwargs):
+        nonlocal attempts
+        attempts += 1
+        raise error
+
+    client.client.chat.completions.create = failing_create
+    try:
+        asyncio.run(client.chat("qwen-plus", [{"role": "user", "content": "hi"}]))
+    except type(error):
+        pass
+    return attempts
+
+def test_rate_limiter_retries_connection_errors_but_not_timeouts(monkeypatch):
+    from openai import APIConnectionError, APITimeoutError
+    from app.core.config import settings
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(settings, "RATE_LIMIT_BACKOFF_BASE", 0.0)
+    client = LLMClient(api_key="test", base_url="http://llm.invalid/v1")
+    request = httpx.Request("POST", "http://llm.invalid/v1/chat/completions")
+
+    assert _count_attempts(client, APITimeoutError(request)) == 1
+    assert _count_attempts(client, APIConnectionError(request=request)) == 1 + settings.RATE_LIMIT_MAX_RETRIES
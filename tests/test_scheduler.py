@@ -0,0 +1,23 @@
+import asyncio
+import pytest
+from app.services.job_queue import SQLiteJobQueue
+from app.services.scheduler import JobScheduler, LANE_PIPELINE, QueueFullError
+
+def test_non_positive_queue_size_is_unbounded(tmp_path):
+    async def run():
+        scheduler = JobScheduler(pipeline_workers=1, max_queue_size=0)
+        release = asyncio.Event()
+        positions = [await scheduler.submit(f"task-{i}", LANE_PIPELINE, release.wait) for i in range(5)]
+        release.set()
+        await scheduler.stop()
+        return positions
+    assert asyncio.run(run())[-1] >= 4
+
+    queue = SQLiteJobQueue(db_path=tmp_path / "jobs.db", max_queue_size=0)
+    assert [queue.enqueue(f"task-{i}", LANE_PIPELINE, {}) for i in range(3)] == [1, 2, 3]
+
+def test_bounded_queue_rejects_when_full(tmp_path):
+    queue = SQLiteJobQueue(db_path=tmp_path / "jobs.db", max_queue_size=1)
+    queue.enqueue("task-0", LANE_PIPELINE, {})
+    with pytest.raises(QueueFullError):
+        queue.enqueue("task-1", LANE_PIPELINE, {})
@@ -0,0 +1,36 @@
+import asyncio
+import httpx
+from fastapi import FastAPI
+from app.core.static_files import CachedStaticFiles, IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, content_version
+
+def _get(app, url, headers=None):
+    async def request():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.get(url, headers=headers)
+    return asyncio.run(request())
+
+def test_only_matching_version_is_immutable(tmp_path):
+    target = tmp_path / "trace.jsonl"
+    target.write_text("first\n")
+    app = FastAPI()
+    app.mount("/outputs", CachedStaticFiles(directory=tmp_path), name="outputs")
+
+    version = content_version(target)
+    assert _get(app, "/outputs/trace.jsonl").headers["cache-control"] == REVALIDATE_CACHE_CONTROL
+    assert _get(app, f"/outputs/trace.jsonl?v={version}").headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+    assert _get(app, "/outputs/trace.jsonl?v=0000000000000000").headers["cache-control"] == REVALIDATE_CACHE_CONTROL
+
+    # 文件被改写后旧版本 URL 不再 immutable，ETag 随内容变化
+    etag = _get(app, "/outputs/trace.jsonl").headers["etag"]
+    target.write_text("rewritten on resume\n")
+    response = _get(app, f"/outputs/trace.jsonl?v={version}")
+    assert response.headers["cache-control"] == REVALIDATE_CACHE_CONTROL
+    assert response.headers["etag"] != etag
+    assert response.text == "rewritten on resume\n"
+
+def test_etag_revalidation(tmp_path):
+    (tmp_path / "a.png").write_bytes(b"png")
+    app = FastAPI()
+    app.mount("/data", CachedStaticFiles(directory=tmp_path), name="data")
+    etag = _get(app, "/data/a.png").headers["etag"]
+    assert _get(app, "/data/a.png", headers={"if-none-match": etag}).status_code == 304
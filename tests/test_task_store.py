@@ -0,0 +1,26 @@
+import asyncio
+import pytest
+from app.services.task_store import InMemoryTaskStore, SQLiteTaskStore
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryTaskStore()
+    return SQLiteTaskStore(db_path=tmp_path / "tasks.db")
+
+def test_find_by_product_index(store):
+    store.create("a", {"status": "pending", "product_index": 1})
+    store.create("b", {"status": "pending", "product_index": 2})
+    store.create("c", {"status": "pending", "product_index": 1})
+
+    assert [t["task_id"] for t in store.find_by_product_index(1)] == ["c", "a"]
+    # 更新商品序号后索引随之变化
+    store.update("c", product_index=2)
+    assert [t["task_id"] for t in store.find_by_product_index(1)] == ["a"]
+    assert [t["task_id"] for t in asyncio.run(store.afind_by_product_index(2))] == ["c", "b"]
+    assert store.find_by_product_index(3) == []
+
+def test_sqlite_lookup_uses_product_index(tmp_path):
+    store = SQLiteTaskStore(db_path=tmp_path / "tasks.db")
+    plan = store._conn.execute("EXPLAIN QUERY PLAN SELECT task_id FROM tasks WHERE product_index = 1").fetchall()
+    assert any("idx_tasks_product_index" in row[-1] for row in plan)
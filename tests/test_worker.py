@@ -0,0 +1,84 @@
+import asyncio
+import json
+import httpx
+import api_server
+from app import worker as worker_module
+from app.core.config import settings
+from app.services.job_queue import SQLiteJobQueue
+from app.services.scheduler import LANE_PIPELINE, LANE_WHITE_BG
+from app.services.task_runner import task_store
+
+def _sse_events(body: str) -> list:
+    events = []
+    for block in body.split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if ": " in line and not line.startswith(":"))
+        if "event" in fields:
+            events.append((fields["event"], json.loads(fields.get("data", "{}"))))
+    return events
+
+def test_event_stream_ends_when_task_runs_on_worker(monkeypatch, tmp_path):
+    queue = SQLiteJobQueue(db_path=tmp_path / "jobs.db")
+    monkeypatch.setattr(api_server, "job_queue", queue)
+    monkeypatch.setattr(settings, "SSE_POLL_INTERVAL_SECONDS", 0.05)
+    monkeypatch.setattr(settings, "WORKER_POLL_INTERVAL_SECONDS", 0.05)
+
+    async def fake_execute_job(task_id, request, queued_at):
+        # 模拟另一个进程中的 Worker：只写共享的任务存储，不发布到 API 进程的事件总线
+        await task_store.aupdate(task_id, status="processing", stage="image", stage_state="started")
+        await asyncio.sleep(0.1)
+        await task_store.aupdate(task_id, append={"images": ["/outputs/scene1.png"]})
+        await task_store.aupdate(task_id, status="completed", stage_state="completed")
+    monkeypatch.setattr(worker_module, "execute_job", fake_execute_job)
+
+    async def run():
+        worker = worker_module.PipelineWorker(queue, [LANE_WHITE_BG, LANE_PIPELINE], concurrency=1)
+        slot = asyncio.create_task(worker._slot(0))
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api_server.app), base_url="http://test") as client:
+                response = await client.post("/api/generate", json={"name": "杯子", "detail": "陶瓷马克杯"})
+                task_id = response.json()["task_id"]
+                stream = await asyncio.wait_for(client.get(f"/api/task/{task_id}/events"), timeout=10)
+        finally:
+            worker.stop()
+            await slot
+        return stream.text
+
+    events = _sse_events(asyncio.run(run()))
+    assert [name for name, _ in events][-1] == "completed"
+    assert ("image", {"task_id": events[0][1]["task_id"], "url": "/outputs/scene1.png"}) in events
+    assert queue.running(LANE_PIPELINE) == 0
+
+def test_stale_worker_does_not_complete_reclaimed_job(monkeypatch, tmp_path):
+    queue = SQLiteJobQueue(db_path=tmp_path / "jobs.db")
+    task_store.create("race", {"status": "pending"})
+    queue.enqueue("race", LANE_PIPELINE, {"name": "杯子", "detail": "陶瓷马克杯"})
+    releases = []
+
+    async def blocking_execute_job(task_id, request, queued_at):
+        await releases.pop(0).wait()
+    monkeypatch.setattr(worker_module, "execute_job", blocking_execute_job)
+
+    async def run():
+        first, second = asyncio.Event(), asyncio.Event()
+        releases.extend([first, second])
+        stalled = worker_module.PipelineWorker(queue, [LANE_PIPELINE], concurrency=1)
+        healthy = worker_module.PipelineWorker(queue, [LANE_PIPELINE], concurrency=1)
+
+        stalled_run = asyncio.create_task(stalled._run_job(queue.claim([LANE_PIPELINE], stalled.worker_id)))
+        await asyncio.sleep(0.05)
+        # 第一个 Worker 心跳停顿，任务被放回队列并由第二个 Worker 重新领取
+        assert queue.requeue_stale(0) == 1
+        healthy_run = asyncio.create_task(healthy._run_job(queue.claim([LANE_PIPELINE], healthy.worker_id)))
+        await asyncio.sleep(0.05)
+
+        first.set()
+        await stalled_run
+        # 旧的执行结束不会删除新的领取，任务仍在执行中，不会被再次回收
+        assert queue.running(LANE_PIPELINE) == 1
+
+        second.set()
+        await healthy_run
+        assert queue.running(LANE_PIPELINE) == 0
+        assert queue.size(LANE_PIPELINE) == 0
+        assert queue.requeue_stale(0) == 0
+    asyncio.run(run())